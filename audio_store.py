@@ -0,0 +1,250 @@
+import json
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from cancel import Cancelled, check
+
+SAMPLE_WIDTH = 2  # The store always holds signed 16-bit little-endian PCM
+PROBE_CACHE_SIZE = 64  # Files whose probe results are kept
+DECODE_BLOCK = 1 << 20  # Bytes copied from ffmpeg at a time
+
+_probe_cache = OrderedDict()  # (path, size, mtime) -> probe result, least recently used first
+_probe_lock = threading.Lock()
+
+
+def _wav_layout(path):
+    """Return (data offset, frames, frame rate, channels) for a 16-bit PCM WAV file, else None"""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(12)
+            if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+                return None
+            fmt = None
+            while True:
+                chunk_header = f.read(8)
+                if len(chunk_header) < 8:
+                    return None
+                chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+                if chunk_id == b'fmt ':
+                    fmt = struct.unpack('<HHIIHH', f.read(16))
+                    f.seek(chunk_size - 16 + (chunk_size & 1), os.SEEK_CUR)
+                elif chunk_id == b'data':
+                    if fmt is None:
+                        return None
+                    format_tag, channels, frame_rate, _, _, bits = fmt
+                    # 1 = PCM, 0xFFFE = WAVE_FORMAT_EXTENSIBLE (PCM for 16-bit files in practice)
+                    if format_tag not in (1, 0xFFFE) or bits != 16:
+                        return None
+                    offset = f.tell()
+                    # Some encoders write a bogus size for streamed WAVs; trust the file length
+                    available = os.path.getsize(path) - offset
+                    if chunk_size == 0 or chunk_size > available:
+                        chunk_size = available
+                    return offset, chunk_size // (channels * SAMPLE_WIDTH), frame_rate, channels
+                else:
+                    f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+    except (OSError, struct.error):
+        return None
+
+
+def probe_audio(audio_path):
+    """Read duration, sample rate and channel count of the first audio stream without decoding it
+
+    Results are cached per path, size and modification time, so the GUI,
+    the pipeline and the video renderer run ffprobe once per file.
+    """
+    try:
+        stat = os.stat(audio_path)
+        key = (os.path.abspath(audio_path), stat.st_size, stat.st_mtime_ns)
+    except OSError:
+        key = None
+    with _probe_lock:
+        if key in _probe_cache:
+            _probe_cache.move_to_end(key)
+            return dict(_probe_cache[key])
+    info = _probe_audio(audio_path)
+    if key:
+        with _probe_lock:
+            _probe_cache[key] = dict(info)
+            while len(_probe_cache) > PROBE_CACHE_SIZE:
+                _probe_cache.popitem(last=False)
+    return info
+
+
+def _probe_audio(audio_path):
+    layout = _wav_layout(audio_path)
+    if layout:
+        _, frames, frame_rate, channels = layout
+        return {
+            'duration': frames / frame_rate,
+            'sample_rate': frame_rate,
+            'channels': channels,
+            'codec_name': 'pcm_s16le',
+        }
+
+    probe_cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'a:0',
+        '-show_entries', 'stream=codec_name,sample_rate,channels:format=duration',
+        '-of', 'json',
+        audio_path
+    ]
+    try:
+        result = subprocess.run(probe_cmd, capture_output=True, text=True, encoding='utf-8')
+        result.check_returncode()
+        info = json.loads(result.stdout)
+        stream = info['streams'][0]
+        return {
+            'duration': float(info['format']['duration']),
+            'sample_rate': int(stream['sample_rate']),
+            'channels': int(stream['channels']),
+            'codec_name': stream.get('codec_name'),
+        }
+    except Exception as e:
+        raise Exception(f"Failed to probe audio: {str(e)}")
+
+
+def downmix(samples):
+    """Average the channels of a (frames, channels) int16 array into mono int16"""
+    if samples.shape[1] == 1:
+        return samples[:, 0]
+    return samples.mean(axis=1, dtype=np.float32).astype(np.int16)
+
+
+class PCMStore:
+    """Source audio decoded once into a memory-mapped file of 16-bit PCM
+
+    16-bit PCM WAV input is mapped in place. Anything else is decoded by a
+    single ffmpeg process streaming raw PCM into scratch_dir, so the decoded
+    audio lives in the page cache rather than on the Python heap. Slices are
+    zero-copy views of shape (frames, channels). A decoded file can outlive
+    the store (keep_file) and be mapped again later by passing it as pcm.
+    """
+
+    def __init__(self, audio_path, scratch_dir="chunks", info=None, progress_callback=None, cancel=None, pcm=None):
+        self.audio_path = audio_path
+        self.info = info  # probe_audio result, when the source had to be probed
+        self.sample_width = SAMPLE_WIDTH
+        self.pcm_path = None  # Set when the store owns a decoded file
+
+        # pcm: (path, frame_rate, channels) of raw PCM this source was already decoded to
+        layout = None if pcm else _wav_layout(audio_path)
+        if pcm:
+            path, self.frame_rate, self.channels = pcm
+            offset = 0
+            frames = os.path.getsize(path) // (self.channels * SAMPLE_WIDTH)
+        elif layout:
+            offset, frames, self.frame_rate, self.channels = layout
+            path = audio_path
+        else:
+            self.info = info = info or probe_audio(audio_path)
+            self.frame_rate = info['sample_rate']
+            self.channels = info['channels']
+            path = self._decode(scratch_dir, progress_callback, cancel)
+            offset = 0
+            frames = os.path.getsize(path) // (self.channels * SAMPLE_WIDTH)
+
+        if frames:
+            self.samples = np.memmap(path, dtype='<i2', mode='r', offset=offset, shape=(frames, self.channels))
+        else:
+            self.samples = np.zeros((0, self.channels), dtype='<i2')
+
+    def _decode(self, scratch_dir, progress_callback=None, cancel=None):
+        """Stream the source through ffmpeg into a raw PCM scratch file
+
+        progress_callback, if given, is called with the decoded fraction (0 to 1)
+        as the file grows, estimated from the probed duration. Cancelling
+        cancel (cancel.CancelToken) kills ffmpeg, deletes the partial file
+        and raises Cancelled.
+        """
+        expected = self.info['duration'] * self.frame_rate * self.channels * SAMPLE_WIDTH
+        os.makedirs(scratch_dir, exist_ok=True)
+        fd, self.pcm_path = tempfile.mkstemp(suffix='.pcm', dir=scratch_dir)
+        decode_cmd = [
+            'ffmpeg',
+            '-v', 'error',
+            '-i', self.audio_path,
+            '-map', '0:a:0',
+            '-f', 's16le',
+            '-acodec', 'pcm_s16le',
+            '-ar', str(self.frame_rate),
+            '-ac', str(self.channels),
+            'pipe:1'
+        ]
+        process = None
+        try:
+            # stderr goes to a file: a pipe nobody reads until stdout ends fills up on a damaged
+            # input that logs a lot, and ffmpeg then blocks on it while we block on stdout
+            with os.fdopen(fd, 'wb') as pcm_file, tempfile.TemporaryFile() as error_file:
+                process = subprocess.Popen(decode_cmd, stdout=subprocess.PIPE, stderr=error_file)
+                if cancel:
+                    cancel.attach(process)
+                if progress_callback:
+                    written = 0
+                    while True:
+                        block = process.stdout.read(DECODE_BLOCK)
+                        if not block:
+                            break
+                        pcm_file.write(block)
+                        written += len(block)
+                        progress_callback(min(1.0, written / expected) if expected else 0.0)
+                else:
+                    shutil.copyfileobj(process.stdout, pcm_file, DECODE_BLOCK)
+                process.stdout.close()
+                process.wait()
+                error_file.seek(0)
+                stderr = error_file.read()
+            check(cancel)
+            if process.returncode != 0:
+                raise Exception(stderr.decode('utf-8', errors='replace'))
+        except Exception as e:
+            self.close()
+            if cancel and cancel.cancelled:
+                raise Cancelled("Cancelled")
+            raise Exception(f"Failed to decode audio: {str(e)}")
+        finally:
+            if cancel and process:
+                cancel.detach(process)
+        return self.pcm_path
+
+    @property
+    def frames(self):
+        return len(self.samples)
+
+    @property
+    def duration_ms(self):
+        return round(self.frames * 1000 / self.frame_rate)
+
+    def frame_at(self, ms):
+        """Frame index of a position in milliseconds, clamped to the audio"""
+        return min(max(0, int(ms * self.frame_rate // 1000)), self.frames)
+
+    def view(self, start_ms, end_ms):
+        """Zero-copy (frames, channels) view of the audio between two positions"""
+        return self.samples[self.frame_at(start_ms):self.frame_at(end_ms)]
+
+    def keep_file(self):
+        """Hand the decoded file over to the caller, so close() leaves it on disk
+
+        Returns (path, frame_rate, channels) to pass as pcm later, or None when
+        the source is a WAV file mapped in place.
+        """
+        if self.pcm_path is None:
+            return None
+        pcm, self.pcm_path = (self.pcm_path, self.frame_rate, self.channels), None
+        return pcm
+
+    def close(self):
+        """Unmap the samples and delete the decoded scratch file, if any"""
+        self.samples = np.zeros((0, self.channels), dtype='<i2')
+        if self.pcm_path and os.path.isfile(self.pcm_path):
+            os.remove(self.pcm_path)
+        self.pcm_path = None
@@ -0,0 +1,240 @@
+"""Transcribe a directory or glob of audio files on a process pool
+
+    python -m batch recordings/ --workers 4 --concurrency 8
+    python -m batch "archive/**/*.mp3" --output-dir output/archive
+
+Every file gets its own scratch directory; all workers share one budget of
+recognition requests in flight. A summary with per-file duration, wall
+time, realtime factor, failures and reused transcripts is printed and saved
+as JSON. Workers share one fingerprint index, so an intro or ad recognized
+in one file is not recognized again in the next.
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from ingest import AUDIO_EXTENSIONS
+
+
+_budget = None  # Shared request semaphore, set in each worker process
+_google = None  # GoogleBackend of this worker process, kept so files reuse its connections
+
+
+def find_audio_files(patterns):
+    """Expand directories (non-recursively) and glob patterns into a sorted list of audio files"""
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            candidates = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            candidates = glob.glob(pattern, recursive=True)
+        files.extend(
+            path for path in candidates
+            if os.path.isfile(path) and path.lower().endswith(AUDIO_EXTENSIONS)
+        )
+    return sorted(set(files))
+
+
+def _output_names(files):
+    """Map every file to a unique output stem, even when names repeat across directories"""
+    stems = {}
+    used = set()
+    for path in files:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        candidate, n = stem, 1
+        while candidate in used:
+            n += 1
+            candidate = f"{stem}_{n}"
+        used.add(candidate)
+        stems[path] = candidate
+    return stems
+
+
+def _init_worker(budget):
+    global _budget
+    _budget = budget
+
+
+def _make_backend(options):
+    from recognition import AdaptiveScheduler, BudgetedBackend, FakeBackend, GoogleBackend
+
+    global _google
+    if options['backend'] == 'fake':
+        backend = FakeBackend(latency=options['fake_latency'])
+    else:
+        if _google is None:
+            _google = GoogleBackend(language=options['language'], endpoint=options['endpoint'],
+                                    pool_size=options['concurrency'])
+        backend = _google
+    return AdaptiveScheduler(BudgetedBackend(backend, _budget), max_concurrency=options['concurrency'])
+
+
+def transcribe_job(audio_path, stem, options):
+    """Transcribe one file in a worker process and return its summary row"""
+    from main import Transcribe
+
+    row = {'file': audio_path, 'duration_s': None, 'wall_s': None, 'realtime_factor': None,
+           'chunks': 0, 'failed_chunks': 0, 'skipped_chunks': 0, 'dedup_lookups': 0, 'dedup_hits': 0,
+           'error': None, 'report': None}
+    scratch = tempfile.mkdtemp(prefix=f"{stem}-", dir=options['scratch_root'])
+    start = time.perf_counter()
+    try:
+        transcriber = Transcribe(
+            audio_path,
+            f"{stem}_transcript.txt",
+            f"{stem}_subtitles.srt",
+            backend=_make_backend(options),
+            max_workers=options['concurrency'],
+            output_dir=options['output_dir'],
+            scratch_dir=scratch,
+            preprocess_workers=0,  # Files already run in parallel, one per worker process
+            speech_gate=None if options['speech_gate'] else False,
+            fingerprints=None if options['dedup'] else False,
+        )
+        transcriber.run()
+        row['duration_s'] = transcriber.audio_info['duration']
+        row['chunks'] = transcriber.metrics.chunks
+        row['skipped_chunks'] = transcriber.metrics.skipped_chunks
+        row['dedup_lookups'] = transcriber.metrics.dedup_lookups
+        row['dedup_hits'] = transcriber.metrics.dedup_hits
+        row['failed_chunks'] = sum(
+            1 for segment in transcriber.subtitles if segment['text'].startswith('[Unable to transcribe'))
+        row['report'] = transcriber.metrics.report()
+    except Exception as e:
+        row['error'] = str(e)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    row['wall_s'] = time.perf_counter() - start
+    if row['duration_s']:
+        row['realtime_factor'] = row['wall_s'] / row['duration_s']
+    return row
+
+
+def run_batch(files, output_dir="output", workers=2, concurrency=8, backend='google', language='fa-IR',
+              endpoint=None, fake_latency=0.0, speech_gate=True, dedup=True, progress=print):
+    """Transcribe files on a process pool and return the summary"""
+    os.makedirs(output_dir, exist_ok=True)
+    scratch_root = tempfile.mkdtemp(prefix='transcribe-batch-')
+    options = {
+        'output_dir': os.path.abspath(output_dir),
+        'scratch_root': scratch_root,
+        'concurrency': concurrency,
+        'backend': backend,
+        'language': language,
+        'endpoint': endpoint,
+        'fake_latency': fake_latency,
+        'speech_gate': speech_gate,
+        'dedup': dedup,
+    }
+    stems = _output_names(files)
+    rows = []
+    start = time.perf_counter()
+    try:
+        with multiprocessing.Manager() as manager:
+            budget = manager.BoundedSemaphore(concurrency)
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(budget,)) as pool:
+                futures = [pool.submit(transcribe_job, path, stems[path], options) for path in files]
+                for future in as_completed(futures):
+                    row = future.result()
+                    rows.append(row)
+                    status = f"failed: {row['error']}" if row['error'] else f"{row['wall_s']:.1f} s"
+                    progress(f"[{len(rows)}/{len(files)}] {row['file']}: {status}")
+    finally:
+        shutil.rmtree(scratch_root, ignore_errors=True)
+
+    rows.sort(key=lambda row: files.index(row['file']))
+    wall = time.perf_counter() - start
+    audio = sum(row['duration_s'] or 0 for row in rows)
+    lookups = sum(row['dedup_lookups'] for row in rows)
+    hits = sum(row['dedup_hits'] for row in rows)
+    return {
+        'files': rows,
+        'total': {
+            'files': len(rows),
+            'failed_files': sum(1 for row in rows if row['error']),
+            'failed_chunks': sum(row['failed_chunks'] for row in rows),
+            'skipped_chunks': sum(row['skipped_chunks'] for row in rows),
+            'dedup_lookups': lookups,
+            'dedup_hits': hits,
+            'dedup_hit_rate': hits / lookups if lookups else None,
+            'saved_requests': hits,
+            'saved_request_s': sum(row['report']['dedup']['saved_request_s'] or 0 for row in rows if row['report']),
+            'audio_s': audio,
+            'wall_s': wall,
+            'realtime_factor': wall / audio if audio else None,
+            'workers': workers,
+            'concurrency': concurrency,
+        },
+    }
+
+
+def format_summary(summary):
+    """Plain-text table of a batch summary"""
+    lines = [f"{'file':<40} {'audio s':>9} {'wall s':>8} {'RTF':>6} {'chunks':>7} {'failed':>7} {'skipped':>8} "
+             f"{'reused':>7}"]
+    for row in summary['files']:
+        name = os.path.basename(row['file'])[:40]
+        if row['error']:
+            lines.append(f"{name:<40} ERROR: {row['error']}")
+            continue
+        lines.append(f"{name:<40} {row['duration_s']:>9.1f} {row['wall_s']:>8.1f} "
+                     f"{row['realtime_factor']:>6.3f} {row['chunks']:>7} {row['failed_chunks']:>7} "
+                     f"{row['skipped_chunks']:>8} {row['dedup_hits']:>7}")
+    total = summary['total']
+    rtf = f"{total['realtime_factor']:.3f}" if total['realtime_factor'] else "-"
+    lines.append(f"{total['files']} files, {total['failed_files']} failed, {total['failed_chunks']} failed chunks, "
+                 f"{total['skipped_chunks']} chunks without speech, "
+                 f"{total['audio_s']:.1f} s of audio in {total['wall_s']:.1f} s (RTF {rtf})")
+    if total['dedup_lookups']:
+        lines.append(f"Dedup: {total['dedup_hits']} of {total['dedup_lookups']} chunks reused a transcript "
+                     f"({total['dedup_hit_rate']:.1%} hit rate), {total['saved_requests']} requests "
+                     f"(~{total['saved_request_s']:.1f} s of recognition) saved")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Transcribe a directory or glob of audio files on a process pool")
+    parser.add_argument('inputs', nargs='+', help="Directories or glob patterns (quote globs with **)")
+    parser.add_argument('--output-dir', default='output', help="Where transcripts and subtitles are written")
+    parser.add_argument('--workers', type=int, default=max(1, min(4, os.cpu_count() or 1)),
+                        help="Files processed in parallel")
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help="Recognition requests in flight, shared by all workers")
+    parser.add_argument('--language', default='fa-IR')
+    parser.add_argument('--backend', choices=('google', 'fake'), default='google')
+    parser.add_argument('--endpoint', help="Google-compatible recognition endpoint, e.g. a stub_server URL")
+    parser.add_argument('--fake-latency', type=float, default=0.0, help="Seconds per request with --backend fake")
+    parser.add_argument('--no-speech-gate', action='store_true', help="Recognize chunks without speech too")
+    parser.add_argument('--no-dedup', action='store_true',
+                        help="Recognize every chunk, even ones heard before in this or an earlier batch")
+    parser.add_argument('--summary', help="Summary JSON path (default: <output-dir>/batch_summary.json)")
+    args = parser.parse_args(argv)
+
+    files = find_audio_files(args.inputs)
+    if not files:
+        print("No audio files found")
+        return 1
+
+    print(f"Transcribing {len(files)} files with {args.workers} workers, "
+          f"{args.concurrency} recognition requests in flight")
+    summary = run_batch(files, args.output_dir, args.workers, args.concurrency, args.backend,
+                        args.language, args.endpoint, args.fake_latency, not args.no_speech_gate,
+                        not args.no_dedup)
+
+    summary_path = args.summary or os.path.join(args.output_dir, 'batch_summary.json')
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    print(format_summary(summary))
+    print(f"Summary saved to {summary_path}")
+    return 1 if summary['total']['failed_files'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+"""Compare the chunking strategies of split_audio_file: packed speech, silence fragments, fixed cuts
+
+Each strategy runs through Transcribe.split_audio_file on the same synthetic
+speech-plus-silence audio. Fewer chunks means fewer recognition requests;
+cuts in speech are chunk boundaries that split a word. Run from the
+repository root:
+
+    python -m benchmarks.bench_chunking --seconds 3600
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import wave
+
+from benchmarks.synthetic import speech_like
+from main import Transcribe
+
+STRATEGIES = ('pack', 'silence', 'fixed')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=3600.0, help="Length of the synthetic audio")
+    parser.add_argument('--rate', type=int, default=16000, help="Sample rate of the synthetic audio")
+    parser.add_argument('--chunk-length', type=float, default=59.0, help="Maximum chunk length in seconds")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-chunking-')
+    try:
+        audio_path = os.path.join(workdir, 'speech.wav')
+        with wave.open(audio_path, 'wb') as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(args.rate)
+            wav_file.writeframes(speech_like(args.seconds, args.rate).tobytes())
+
+        print(f"{'strategy':>8} {'chunks':>7} {'per hour':>9} {'mean s':>7} {'max s':>6} {'padding':>8} "
+              f"{'speech':>7} {'cuts in speech':>15} {'time s':>7}")
+        for strategy in STRATEGIES:
+            transcriber = Transcribe(audio_path, cache=False, fingerprints=False, chunking=strategy,
+                                     output_dir=workdir, scratch_dir=os.path.join(workdir, 'scratch'))
+            start = time.perf_counter()
+            chunks = transcriber.split_audio_file(int(args.chunk_length * 1000))
+            seconds = time.perf_counter() - start
+            stats = transcriber.chunk_stats
+            longest = max(chunk['end'] - chunk['start'] for chunk in chunks) / 1000
+            print(f"{strategy:>8} {stats['chunks']:>7} {stats['chunks_per_hour']:>9.1f} {stats['mean_chunk_s']:>7.1f} "
+                  f"{longest:>6.1f} {stats['padding_ratio']:>8.1%} {stats['speech_coverage']:>7.1%} "
+                  f"{stats['cuts_in_speech']:>15} {seconds:>7.3f}")
+            transcriber.cleanup()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Compare chunk preprocessing on the recognition thread with the shared-memory process pool
+
+Runs the long-audio path end to end with a fake recognizer on synthetic
+audio, once per worker count (0 = prepared on the recognition loop's
+thread). Run from the repository root:
+
+    python -m benchmarks.bench_preprocess --seconds 600 --workers 0 2 4
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import wave
+
+from benchmarks.synthetic import speech_like
+from main import Transcribe
+from recognition import FakeBackend
+
+
+class DigestBackend(FakeBackend):
+    """FakeBackend that remembers a digest of every payload, to check both paths send the same audio"""
+
+    def __init__(self, latency):
+        super().__init__(latency=latency)
+        self.digests = set()
+
+    def recognize(self, audio_data):
+        self.digests.add(hashlib.sha1(audio_data.frame_data).hexdigest())
+        return super().recognize(audio_data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=600.0, help="Length of the synthetic audio")
+    parser.add_argument('--rate', type=int, default=44100, help="Sample rate of the synthetic audio")
+    parser.add_argument('--channels', type=int, default=2, help="Channel count of the synthetic audio")
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 2, 4], help="Preprocessing worker counts")
+    parser.add_argument('--latency', type=float, default=0.2, help="Seconds the fake recognizer takes per chunk")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-preprocess-')
+    try:
+        audio_path = os.path.join(workdir, 'speech.wav')
+        with wave.open(audio_path, 'wb') as wav_file:
+            wav_file.setnchannels(args.channels)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(args.rate)
+            wav_file.writeframes(speech_like(args.seconds, args.rate, args.channels).tobytes())
+
+        digests = {}
+        for workers in args.workers:
+            backend = DigestBackend(args.latency)
+            transcriber = Transcribe(audio_path, backend=backend, cache=False, fingerprints=False,
+                                     preprocess_workers=workers,
+                                     output_dir=workdir, scratch_dir=os.path.join(workdir, 'scratch'))
+            start = time.perf_counter()
+            transcriber.run()
+            seconds = time.perf_counter() - start
+            stage = transcriber.metrics.stages.get('preprocess', {})
+            digests[workers] = backend.digests
+            print(f"{workers:>2} workers: {seconds:8.3f} s, {args.seconds / seconds:8.1f}x realtime, "
+                  f"waited {stage.get('wall_s', 0):7.3f} s and spent {stage.get('cpu_s', 0):7.3f} s CPU "
+                  f"on preprocessing in the recognition loop")
+        print(f"identical payloads: {len({frozenset(d) for d in digests.values()}) == 1}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
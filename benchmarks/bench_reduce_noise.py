@@ -0,0 +1,113 @@
+"""Compare the vectorized reduce_noise with the original implementation
+
+Every chunk length is run at every sample rate. The run fails when more than
+MAX_OFF_SHARE of the samples of a chunk differ from the original by more
+than 1 LSB, the tolerance documented in denoise.reduce_noise_samples. Run
+from the repository root:
+
+    python -m benchmarks.bench_reduce_noise --seconds 2 5 10 20 30 59 --rate 16000 44100
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.synthetic import speech_like
+from denoise import reduce_noise_samples
+
+MAX_OFF_SHARE = 0.001  # Samples allowed to differ by more than 1 LSB
+
+
+def legacy_reduce_noise(samples, frame_rate):
+    """The original Transcribe.reduce_noise, minus the AudioSegment wrapping"""
+    samples = np.array(samples)
+    samples = samples / np.max(np.abs(samples))
+    noise_gate_threshold = 0.01
+    samples = np.where(np.abs(samples) < noise_gate_threshold, samples * 0.5, samples)
+    fft_data = np.fft.rfft(samples)
+    freqs = np.fft.rfftfreq(len(samples), 1/frame_rate)
+    noise_floor_db = -40
+    noise_floor_linear = 10 ** (noise_floor_db / 20)
+    fft_data[np.abs(fft_data) < noise_floor_linear] *= 0.5
+    samples = np.fft.irfft(fft_data)
+    window_size = 2048
+    noise_floor = np.array([
+        np.mean(np.abs(samples[i:i+window_size]))
+        for i in range(0, len(samples)-window_size, window_size//2)
+    ])
+    for i in range(0, len(samples)-window_size, window_size//2):
+        local_noise_floor = np.mean(noise_floor[max(0, i//(window_size//2)-2):i//(window_size//2)+2])
+        threshold = local_noise_floor * 1.5
+        samples[i:i+window_size] = np.where(
+            np.abs(samples[i:i+window_size]) < threshold,
+            samples[i:i+window_size] * 0.7,
+            samples[i:i+window_size]
+        )
+    window = np.ones(3) / 3
+    samples = np.convolve(samples, window, mode='same')
+    samples = samples / np.max(np.abs(samples))
+    max_int16 = np.iinfo(np.int16).max
+    min_int16 = np.iinfo(np.int16).min
+    samples = samples * max_int16
+    samples = np.clip(samples, min_int16, max_int16)
+    return samples.astype(np.int16)
+
+
+def measure(function, *args):
+    """Return (result, seconds, peak traced bytes) for one call"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def compare(seconds, rate, repeat):
+    """Print one chunk's speed, memory and difference; True if it is within the tolerance"""
+    samples = speech_like(seconds, rate)[:, 0]
+    runs = {}
+    for name, function, call_args in (
+        ('legacy', legacy_reduce_noise, (samples, rate)),
+        ('vectorized', reduce_noise_samples, (samples,)),
+    ):
+        best = None
+        for _ in range(repeat):
+            result, elapsed, peak = measure(function, *call_args)
+            if best is None or elapsed < best[1]:
+                best = (result, elapsed, peak)
+        runs[name] = best
+
+    legacy, vectorized = runs['legacy'][0], runs['vectorized'][0]
+    difference = np.abs(legacy.astype(np.int32) - vectorized.astype(np.int32))
+    off = np.mean(difference > 1)
+    print(f"{seconds:>6g} {rate:>6} {len(samples) / runs['vectorized'][1] / 1e6:>10.2f} "
+          f"{runs['legacy'][1] / runs['vectorized'][1]:>7.1f}x "
+          f"{runs['legacy'][2] / 2**20:>10.1f} {runs['vectorized'][2] / 2**20:>10.1f} "
+          f"{difference.max():>8} {off:>9.4%}")
+    return off <= MAX_OFF_SHARE
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, nargs='+', default=[2, 5, 10, 20, 30, 59],
+                        help="Lengths of the synthetic chunks")
+    parser.add_argument('--rate', type=int, nargs='+', default=[16000, 44100],
+                        help="Sample rates of the synthetic chunks")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per implementation, the best is reported")
+    args = parser.parse_args()
+
+    print(f"{'s':>6} {'rate':>6} {'Msamples/s':>10} {'speedup':>8} {'legacy MiB':>10} {'peak MiB':>10} "
+          f"{'max LSB':>8} {'>1 LSB':>9}")
+    failed = [(seconds, rate) for rate in args.rate for seconds in args.seconds
+              if not compare(seconds, rate, args.repeat)]
+    for seconds, rate in failed:
+        print(f"{seconds:g} s at {rate} Hz: more than {MAX_OFF_SHARE:.1%} of the samples differ by over 1 LSB")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
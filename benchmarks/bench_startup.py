@@ -0,0 +1,87 @@
+"""Measure the GUI's time to first window, from source and from the frozen build
+
+Launches the GUI with --startup-profile and waits for the "window shown"
+and "pipeline imported" lines, timing from process start, then closes it.
+Needs a display. Also times importing the GUI module and the full pipeline
+in a bare interpreter, which works anywhere. Run from the repository root:
+
+    python -m benchmarks.bench_startup --repeat 5
+    python -m benchmarks.bench_startup --frozen dist/transcribe.exe
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+MILESTONES = ('window shown', 'pipeline imported')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def launch(command, timeout):
+    """Seconds from launching command to each startup milestone it reports"""
+    fd, profile_path = tempfile.mkstemp(suffix='.txt', prefix='startup-')
+    os.close(fd)
+    start = time.perf_counter()
+    process = subprocess.Popen(command + ['--startup-profile', profile_path], cwd=ROOT,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    reached = {}
+    try:
+        while len(reached) < len(MILESTONES) and time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                break
+            with open(profile_path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            for milestone in MILESTONES:
+                if milestone not in reached and f"startup: {milestone} " in text:
+                    reached[milestone] = time.perf_counter() - start
+            time.sleep(0.005)
+    finally:
+        process.kill()
+        process.wait()
+        os.remove(profile_path)
+    return reached
+
+
+def time_import(code):
+    """Seconds a fresh interpreter takes to run code, which is mostly imports"""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help="Launches per build; the median is shown")
+    parser.add_argument('--frozen', help="Path of the PyInstaller build to measure as well")
+    parser.add_argument('--timeout', type=float, default=60.0, help="Seconds to wait for a launch")
+    args = parser.parse_args()
+
+    imports = {
+        'interpreter': 'pass',
+        'gui module': 'import gui',
+        'pipeline': 'from main import preload; preload(); import make_video',
+    }
+    for name, code in imports.items():
+        seconds = statistics.median(time_import(code) for _ in range(args.repeat))
+        print(f"{'import ' + name:>22}: {seconds:7.3f} s")
+
+    builds = {'source': [sys.executable, os.path.join(ROOT, 'gui.py')]}
+    if args.frozen:
+        builds['frozen'] = [os.path.abspath(args.frozen)]
+    for name, command in builds.items():
+        launches = [launch(command, args.timeout) for _ in range(args.repeat)]
+        for milestone in MILESTONES:
+            times = [reached[milestone] for reached in launches if milestone in reached]
+            if not times:
+                print(f"{name:>8} {milestone:>17}: not reached (is a display available?)")
+                continue
+            print(f"{name:>8} {milestone:>17}: {statistics.median(times):7.3f} s "
+                  f"(min {min(times):.3f} s, {len(times)}/{len(launches)} launches)")
+
+
+if __name__ == '__main__':
+    main()
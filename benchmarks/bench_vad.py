@@ -0,0 +1,110 @@
+"""Compare split_audio_file's pydub silence splitting with the vectorized envelope
+
+Both paths run the same two-pass search as Transcribe.split_audio_file on
+synthetic speech-plus-silence audio. The envelope's peak memory is then
+measured alone on a long (3 h by default) 16 kHz mono WAV file, memory-mapped
+as Transcribe reads it. Run from the repository root:
+
+    python -m benchmarks.bench_vad --seconds 600 --long-seconds 10800
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+import wave
+
+from pydub import AudioSegment
+from pydub.silence import split_on_silence
+
+from audio_store import PCMStore
+from benchmarks.synthetic import speech_like
+from vad import EnergyEnvelope
+
+PASSES = (
+    # min_silence_len, dB below the file's dBFS, keep_silence
+    (300, 10, 200),
+    (200, 5, 100),
+)
+
+
+def pydub_passes(samples, frame_rate):
+    """The previous split_audio_file path: one full pydub scan per pass"""
+    audio = AudioSegment(samples.tobytes(), frame_rate=frame_rate, sample_width=2, channels=samples.shape[1])
+    results = []
+    for min_silence_len, below, keep_silence in PASSES:
+        chunks = split_on_silence(audio, min_silence_len=min_silence_len, silence_thresh=audio.dBFS - below,
+                                  keep_silence=keep_silence, seek_step=1)
+        results.append(len(chunks))
+    return results
+
+
+def envelope_passes(samples, frame_rate):
+    """The vectorized path: one envelope, every pass evaluated from it"""
+    envelope = EnergyEnvelope(samples, frame_rate)
+    results = []
+    for min_silence_len, below, keep_silence in PASSES:
+        ranges = envelope.split_on_silence(min_silence_len, envelope.dBFS - below, keep_silence)
+        results.append(len(ranges))
+    return results
+
+
+def long_file_memory(seconds, frame_rate=16000):
+    """(seconds taken, peak traced bytes) of the first split pass over a memory-mapped WAV file"""
+    workdir = tempfile.mkdtemp(prefix='bench-vad-')
+    try:
+        path = os.path.join(workdir, 'long.wav')
+        with wave.open(path, 'wb') as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(frame_rate)
+            wav_file.writeframes(speech_like(seconds, frame_rate).tobytes())
+        store = PCMStore(path)
+        try:
+            min_silence_len, below, _ = PASSES[0]
+            tracemalloc.start()
+            start = time.perf_counter()
+            envelope = EnergyEnvelope(store.samples, store.frame_rate)
+            envelope.detect_nonsilent(min_silence_len, envelope.dBFS - below)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        finally:
+            store.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=300.0, help="Length of the synthetic audio")
+    parser.add_argument('--rate', type=int, default=44100, help="Sample rate of the synthetic audio")
+    parser.add_argument('--channels', type=int, default=2, help="Channel count of the synthetic audio")
+    parser.add_argument('--long-seconds', type=float, default=10800.0,
+                        help="Length of the file the envelope's memory is measured on, 0 to skip")
+    args = parser.parse_args()
+
+    samples = speech_like(args.seconds, args.rate, args.channels)
+    timings = {}
+    counts = {}
+    for name, function in (('pydub', pydub_passes), ('envelope', envelope_passes)):
+        start = time.perf_counter()
+        counts[name] = function(samples, args.rate)
+        timings[name] = time.perf_counter() - start
+        print(f"{name:>9}: {timings[name]:8.3f} s for both passes, "
+              f"{args.seconds / timings[name]:10.1f}x realtime, chunks per pass {counts[name]}")
+
+    print(f"  speedup: {timings['pydub'] / timings['envelope']:.1f}x, "
+          f"identical chunk counts: {counts['pydub'] == counts['envelope']}")
+
+    if args.long_seconds:
+        elapsed, peak = long_file_memory(args.long_seconds)
+        envelope_bytes = (round(args.long_seconds * 1000) + 1) * 8
+        print(f"  {args.long_seconds / 3600:.1f} h at 16 kHz, memory-mapped: {elapsed:.2f} s, "
+              f"peak {peak / 2**20:.1f} MiB ({envelope_bytes / 2**20:.1f} MiB of it the envelope)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Time the video renderers of make_video on a synthetic clip
+
+Renders the same audio and subtitles with the legacy two-pass encode and the
+single-pass fast and soft modes and the segment-parallel burn-in. Needs ffmpeg and ffprobe on PATH. Run from
+the repository root:
+
+    python -m benchmarks.bench_video --seconds 600
+"""
+import argparse
+import os
+import tempfile
+import time
+import wave
+
+from benchmarks.synthetic import speech_like
+from main import _ms_to_srt_time
+from make_video import create_video_with_subtitles
+
+MODES = ('legacy', 'fast', 'soft', 'parallel')
+
+
+def write_clip(directory, seconds, frame_rate=44100, cue_ms=3000):
+    """Write a synthetic WAV and an SRT with a cue every cue_ms; return both paths"""
+    audio_path = os.path.join(directory, 'clip.wav')
+    with wave.open(audio_path, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(frame_rate)
+        wav_file.writeframes(speech_like(seconds, frame_rate).tobytes())
+
+    srt_path = os.path.join(directory, 'clip.srt')
+    with open(srt_path, 'w', encoding='utf-8') as srt_file:
+        for index, start in enumerate(range(0, int(seconds * 1000), cue_ms), 1):
+            end = min(start + cue_ms, int(seconds * 1000))
+            srt_file.write(f"{index}\n{_ms_to_srt_time(start)} --> {_ms_to_srt_time(end)}\n"
+                           f"زیرنویس شماره {index}\n\n")
+    return audio_path, srt_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=300.0, help="Length of the synthetic clip")
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        audio_path, srt_path = write_clip(directory, args.seconds)
+        timings = {}
+        for mode in args.modes:
+            output_path = os.path.join(directory, f"{mode}.mp4")
+            start = time.perf_counter()
+            create_video_with_subtitles(audio_path, srt_path, output_path, mode=mode)
+            timings[mode] = time.perf_counter() - start
+            size = os.path.getsize(output_path) / 2**20
+            print(f"{mode:>7}: {timings[mode]:8.2f} s, {args.seconds / timings[mode]:8.1f}x realtime, {size:7.1f} MiB")
+
+    if 'legacy' in timings:
+        for mode in timings:
+            if mode != 'legacy':
+                print(f"{mode:>7} speedup over legacy: {timings['legacy'] / timings[mode]:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
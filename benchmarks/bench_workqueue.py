@@ -0,0 +1,75 @@
+"""Chunk throughput of the SQLite work queue with 1, 2, 4, ... worker processes
+
+The same synthetic files are queued afresh for every worker count and
+recognized by a fake backend with a fixed latency, so the numbers show how
+well claiming, leasing and finalizing scale rather than the speech API.
+With one request in flight per worker, N workers should approach N times
+the chunks per second of one. --format mp3 (or any other extension ffmpeg
+encodes) queues compressed files instead, which `add` decodes once for all
+workers. Run from the repository root:
+
+    python -m benchmarks.bench_workqueue --files 4 --seconds 600 --workers 1 2 4
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import wave
+
+from benchmarks.synthetic import speech_like
+from workqueue import WorkQueue, add_files, run_workers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=4, help="Synthetic files to queue")
+    parser.add_argument('--seconds', type=float, default=600.0, help="Length of every file")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help="Worker counts to compare")
+    parser.add_argument('--concurrency', type=int, default=1, help="Requests in flight per worker")
+    parser.add_argument('--latency', type=float, default=0.5, help="Seconds per fake recognition request")
+    parser.add_argument('--journal', choices=('wal', 'delete'), default='wal')
+    parser.add_argument('--format', default='wav', help="Extension of the queued files, encoded by ffmpeg unless wav")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-workqueue-')
+    try:
+        files = []
+        for n in range(args.files):
+            path = os.path.join(workdir, f"speech_{n}.wav")
+            with wave.open(path, 'wb') as wav_file:
+                wav_file.setnchannels(1)
+                wav_file.setsampwidth(2)
+                wav_file.setframerate(16000)
+                wav_file.writeframes(speech_like(args.seconds, 16000, seed=n).tobytes())
+            if args.format != 'wav':
+                encoded = os.path.join(workdir, f"speech_{n}.{args.format}")
+                subprocess.run(['ffmpeg', '-v', 'error', '-y', '-i', path, encoded], check=True)
+                path = encoded
+            files.append(path)
+
+        options = {'journal': args.journal, 'concurrency': args.concurrency, 'lease_s': 60.0, 'max_attempts': 3,
+                   'follow': False, 'poll_s': 0.2, 'backend': 'fake', 'language': 'fa-IR', 'endpoint': None,
+                   'fake_latency': args.latency}
+        print(f"{'workers':>7} {'add s':>7} {'chunks':>7} {'wall s':>7} {'chunks/s':>9} {'speedup':>8}")
+        baseline = None
+        for workers in args.workers:
+            db_path = os.path.join(workdir, f"queue_{workers}.db")
+            start = time.perf_counter()
+            add_files(WorkQueue(db_path, args.journal), files, os.path.join(workdir, f"output_{workers}"),
+                      progress=lambda message: None)
+            added = time.perf_counter() - start
+            start = time.perf_counter()
+            summaries = run_workers(db_path, workers, options, progress=lambda message: None)
+            wall = time.perf_counter() - start
+            chunks = sum(summary['chunks'] for summary in summaries)
+            rate = chunks / wall
+            baseline = baseline or rate
+            print(f"{workers:>7} {added:>7.2f} {chunks:>7} {wall:>7.2f} {rate:>9.2f} {rate / baseline:>8.2f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
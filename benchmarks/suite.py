@@ -0,0 +1,196 @@
+"""Benchmark every pipeline stage on synthetic audio and compare with a stored baseline
+
+Each stage runs in a fresh process, so its peak RSS is its own. Fixtures
+are speech-like WAV files (see benchmarks.synthetic) generated once into
+--fixtures. Run from the repository root:
+
+    python -m benchmarks.suite --quick                      # 1 and 10 minutes
+    python -m benchmarks.suite                              # 1 minute to 3 hours
+    python -m benchmarks.suite --quick --update-baseline    # record the baseline
+
+The run fails (exit status 1) when a stage is slower than its baseline by
+more than --threshold, or uses more peak memory than --memory-threshold.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor
+
+LENGTHS = (60, 600, 3600, 10800)  # Seconds: 1 minute, 10 minutes, 1 hour, 3 hours
+QUICK_LENGTHS = (60, 600)
+STAGES = ('prepare_samples', 'split_audio_file', 'generate_srt', 'create_video_with_subtitles', 'end_to_end')
+FRAME_RATE = 16000
+CUE_MS = 3000  # Cue length of the synthetic subtitles
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def fixture_path(directory, seconds, frame_rate=FRAME_RATE):
+    """Path of the synthetic fixture for a length, generating it on first use"""
+    path = os.path.join(directory, f"speech_{int(seconds)}s_{frame_rate}hz.wav")
+    if not os.path.isfile(path):
+        from benchmarks.synthetic import speech_like
+
+        os.makedirs(directory, exist_ok=True)
+        temp_path = path + '.tmp'
+        with wave.open(temp_path, 'wb') as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(frame_rate)
+            wav_file.writeframes(speech_like(seconds, frame_rate).tobytes())
+        os.replace(temp_path, path)
+    return path
+
+
+def synthetic_subtitles(length_ms):
+    return [
+        {'start': start, 'end': min(start + CUE_MS, length_ms), 'text': f"زیرنویس شماره {i}"}
+        for i, start in enumerate(range(0, length_ms, CUE_MS), 1)
+    ]
+
+
+def run_stage(stage, audio_path, workdir):
+    """Run one stage in this (fresh) process; return its wall time and the process's peak RSS"""
+    from main import Transcribe
+    from metrics import peak_rss_bytes
+    from recognition import FakeBackend
+
+    # Chunks prepared on this thread: pool processes' memory would be missing from this process's peak RSS
+    transcriber = Transcribe(audio_path, backend=FakeBackend(), cache=False, fingerprints=False,
+                             preprocess_workers=0, output_dir=workdir, scratch_dir=os.path.join(workdir, 'scratch'))
+    transcriber.check_folders()
+    if stage in ('generate_srt', 'create_video_with_subtitles'):
+        transcriber.subtitles = synthetic_subtitles(transcriber.open_store().duration_ms)
+    if stage == 'create_video_with_subtitles':
+        transcriber.generate_srt()
+    if stage == 'prepare_samples':
+        from preprocess import prepare_samples
+
+        store = transcriber.open_store()
+        windows = range(0, store.duration_ms, transcriber.chunk_length_ms)
+
+    start = time.perf_counter()
+    if stage == 'prepare_samples':
+        # Downmix, resample and denoise every chunk on this thread, as a preprocess worker does
+        for window in windows:
+            prepare_samples(store.view(window, window + transcriber.chunk_length_ms), store.frame_rate,
+                            transcriber.target_rate)
+    elif stage == 'split_audio_file':
+        transcriber.split_audio_file(transcriber.chunk_length_ms)
+    elif stage == 'generate_srt':
+        transcriber.generate_srt()
+    elif stage == 'create_video_with_subtitles':
+        from make_video import create_video_with_subtitles
+
+        create_video_with_subtitles(audio_path, transcriber.srt_path, os.path.join(workdir, 'video.mp4'))
+    elif stage == 'end_to_end':
+        transcriber.run()
+    seconds = time.perf_counter() - start
+
+    transcriber.cleanup()
+    return {'seconds': seconds, 'peak_rss_bytes': peak_rss_bytes()}
+
+
+def measure(stage, audio_path, repeat=1):
+    """Best of repeat runs of a stage, each in a new spawned process with its own scratch directory"""
+    runs = []
+    for _ in range(repeat):
+        workdir = tempfile.mkdtemp(prefix=f"bench-{stage}-")
+        try:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                runs.append(pool.submit(run_stage, stage, audio_path, workdir).result())
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        'seconds': min(run['seconds'] for run in runs),
+        'peak_rss_bytes': min((run['peak_rss_bytes'] or 0 for run in runs), default=0) or None,
+    }
+
+
+def compare(results, baseline, threshold, memory_threshold, min_delta=0.05):
+    """Regressions of results against the baseline, as printable lines"""
+    regressions = []
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if not reference:
+            continue
+        # min_delta keeps millisecond-scale stages from failing on timer noise
+        if result['seconds'] > max(reference['seconds'] * (1 + threshold), reference['seconds'] + min_delta):
+            regressions.append(f"{key}: {result['seconds']:.3f} s vs baseline {reference['seconds']:.3f} s")
+        if (result['peak_rss_bytes'] and reference.get('peak_rss_bytes')
+                and result['peak_rss_bytes'] > reference['peak_rss_bytes'] * (1 + memory_threshold)):
+            regressions.append(f"{key}: {result['peak_rss_bytes'] / 2**20:.0f} MiB peak RSS vs baseline "
+                               f"{reference['peak_rss_bytes'] / 2**20:.0f} MiB")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lengths', type=float, nargs='+', help="Fixture lengths in seconds")
+    parser.add_argument('--quick', action='store_true', help=f"Only the {QUICK_LENGTHS} second fixtures")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--fixtures', default=DEFAULT_FIXTURES, help="Where generated fixtures are kept")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--update-baseline', action='store_true', help="Store these results as the baseline")
+    parser.add_argument('--threshold', type=float, default=0.25, help="Allowed slowdown, 0.25 = 25%%")
+    parser.add_argument('--memory-threshold', type=float, default=0.25, help="Allowed peak RSS growth")
+    parser.add_argument('--min-delta', type=float, default=0.05, help="Slowdowns under this many seconds never fail")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per stage; the fastest counts")
+    parser.add_argument('--output', help="Also write the results as JSON here")
+    args = parser.parse_args(argv)
+
+    lengths = args.lengths or (QUICK_LENGTHS if args.quick else LENGTHS)
+    stages = list(args.stages)
+    if 'create_video_with_subtitles' in stages and not shutil.which('ffmpeg'):
+        print("ffmpeg not found, skipping create_video_with_subtitles")
+        stages.remove('create_video_with_subtitles')
+
+    results = {}
+    for seconds in lengths:
+        audio_path = fixture_path(args.fixtures, seconds)
+        for stage in stages:
+            key = f"{stage}@{int(seconds)}s"
+            results[key] = measure(stage, audio_path, args.repeat)
+            rss = results[key]['peak_rss_bytes']
+            print(f"{key:>36}: {results[key]['seconds']:9.3f} s, {seconds / results[key]['seconds']:9.1f}x realtime, "
+                  f"peak RSS {rss / 2**20 if rss else float('nan'):8.1f} MiB")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.isfile(args.baseline):
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        baseline['_machine'] = {'platform': platform.platform(), 'python': platform.python_version(),
+                                'cpus': os.cpu_count()}
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.isfile(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --update-baseline to record one")
+        return 0
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold, args.memory_threshold, args.min_delta)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    if not regressions:
+        print(f"No regressions beyond {args.threshold:.0%} time / {args.memory_threshold:.0%} memory")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
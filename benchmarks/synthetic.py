@@ -0,0 +1,34 @@
+import numpy as np
+
+_BLOCK = 1 << 20  # Frames of room noise generated at a time
+
+
+def speech_like(duration_s, frame_rate=16000, channels=1, seed=0):
+    """Generate speech-like int16 PCM: tone/noise bursts separated by silence
+
+    Bursts of 0.3-4 s (a few harmonics with a syllable-rate envelope plus a
+    little broadband noise) alternate with 0.2-1.5 s gaps of low-level room
+    noise. Returns an array of shape (frames, channels).
+    """
+    rng = np.random.default_rng(seed)
+    total = int(duration_s * frame_rate)
+    samples = np.empty(total, dtype=np.int16)
+    for start in range(0, total, _BLOCK):
+        count = min(_BLOCK, total - start)
+        samples[start:start + count] = rng.standard_normal(count, dtype=np.float32) * 30  # room noise
+
+    position = int(rng.uniform(0.2, 1.0) * frame_rate)
+    while position < total:
+        length = min(int(rng.uniform(0.3, 4.0) * frame_rate), total - position)
+        t = np.arange(length, dtype=np.float32) / frame_rate
+        pitch = rng.uniform(90, 260)
+        burst = sum(np.sin(2 * np.pi * pitch * h * t) / h for h in (1, 2, 3))
+        burst *= 0.55 + 0.45 * np.sin(2 * np.pi * rng.uniform(3, 6) * t)
+        burst += rng.standard_normal(length, dtype=np.float32) * 0.05
+        burst = burst * rng.uniform(2000, 9000) + samples[position:position + length]
+        samples[position:position + length] = np.clip(burst, -32768, 32767)
+        position += length + int(rng.uniform(0.2, 1.5) * frame_rate)
+
+    if channels == 1:
+        return samples[:, None]
+    return np.repeat(samples[:, None], channels, axis=1)
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+CACHE_VERSION = 1  # Bump whenever chunking or noise reduction changes what a key produces
+
+
+def hash_file(path, block_size=1 << 20):
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ChunkCache:
+    """Persistent, content-addressed cache of chunk boundaries and per-chunk transcripts
+
+    Entries are keyed by the SHA-256 of the source audio plus the parameters
+    that shape its chunks and transcripts, so a renamed file still hits and a
+    different file never does. Each entry is a directory holding
+    boundaries.json and an append-only transcripts.jsonl, written as soon as a
+    chunk is recognized so a crashed run resumes where it stopped. Entries
+    unused for max_age_days are evicted first, then the least recently used
+    ones until the cache fits in max_bytes.
+    """
+
+    def __init__(self, root="cache", max_bytes=200 * 2**20, max_age_days=30):
+        self.root = os.path.join(os.getcwd(), root) if not os.path.isabs(root) else root
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self._file_hashes = {}  # (path, size, mtime) -> content hash, avoids rehashing within a process
+
+    def key(self, audio_path, params):
+        """Cache key for a source file and the parameters that affect its results"""
+        stat = os.stat(audio_path)
+        file_id = (os.path.abspath(audio_path), stat.st_size, stat.st_mtime_ns)
+        if file_id not in self._file_hashes:
+            self._file_hashes[file_id] = hash_file(audio_path)
+        params = dict(params, cache_version=CACHE_VERSION)
+        digest = hashlib.sha256(self._file_hashes[file_id].encode('ascii'))
+        digest.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def _touch(self, key):
+        """Mark an entry as recently used"""
+        entry = self._entry(key)
+        if os.path.isdir(entry):
+            os.utime(entry)
+
+    def load_boundaries(self, key):
+        """Chunk boundaries stored for a key, or None"""
+        path = os.path.join(self._entry(key), 'boundaries.json')
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                boundaries = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._touch(key)
+        return [{'start': start, 'end': end} for start, end in boundaries]
+
+    def save_boundaries(self, key, chunks):
+        entry = self._entry(key)
+        os.makedirs(entry, exist_ok=True)
+        temp_path = os.path.join(entry, 'boundaries.json.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump([[chunk['start'], chunk['end']] for chunk in chunks], f)
+        os.replace(temp_path, os.path.join(entry, 'boundaries.json'))
+        self._touch(key)
+
+    def load_transcripts(self, key):
+        """Transcripts recognized so far for a key, as {chunk index: text}"""
+        transcripts = {}
+        path = os.path.join(self._entry(key), 'transcripts.jsonl')
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # A line cut short by a crash
+                    transcripts[record['index']] = record['text']
+        except OSError:
+            pass
+        return transcripts
+
+    def add_transcript(self, key, index, text):
+        """Append one recognized chunk, flushed to disk immediately"""
+        entry = self._entry(key)
+        os.makedirs(entry, exist_ok=True)
+        with open(os.path.join(entry, 'transcripts.jsonl'), 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'index': index, 'text': text}, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._touch(key)
+
+    def evict(self):
+        """Drop entries older than max_age_days, then least recently used ones above max_bytes"""
+        if not os.path.isdir(self.root):
+            return
+        entries = []
+        for prefix in os.listdir(self.root):
+            prefix_path = os.path.join(self.root, prefix)
+            try:
+                keys = os.listdir(prefix_path)
+            except OSError:  # Not a directory, or removed by another process evicting too
+                continue
+            for key in keys:
+                entry = os.path.join(prefix_path, key)
+                try:
+                    size = sum(
+                        os.path.getsize(os.path.join(entry, name))
+                        for name in os.listdir(entry)
+                        if os.path.isfile(os.path.join(entry, name))
+                    )
+                    entries.append((os.path.getmtime(entry), size, entry))
+                except OSError:
+                    continue
+
+        entries.sort()  # Least recently used first
+        oldest_allowed = time.time() - self.max_age_days * 86400
+        total = sum(size for _, size, _ in entries)
+        for last_used, size, entry in entries:
+            if last_used >= oldest_allowed and total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+        for prefix in os.listdir(self.root):
+            prefix_path = os.path.join(self.root, prefix)
+            try:
+                if os.path.isdir(prefix_path) and not os.listdir(prefix_path):
+                    os.rmdir(prefix_path)
+            except OSError:  # Refilled or removed meanwhile
+                continue
@@ -0,0 +1,81 @@
+"""Cooperative cancellation of a transcription, decode or render
+
+A CancelToken is created by whoever may want to stop the work (the GUI's
+Cancel button) and passed down. Long loops call check() between steps, and
+child processes started through the token are killed as soon as it is
+cancelled, so a cancelled run stops within one step instead of running to
+the end.
+"""
+import subprocess
+import threading
+
+
+class Cancelled(Exception):
+    """Raised where cancelled work stops"""
+
+
+class CancelToken:
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._processes = set()  # Running subprocess.Popen objects to kill on cancel()
+
+    def cancel(self):
+        """Ask the work to stop and kill its child processes; safe from any thread"""
+        with self._lock:
+            self._event.set()
+            processes = list(self._processes)
+        for process in processes:
+            _kill(process)
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def check(self):
+        """Raise Cancelled if the token has been cancelled"""
+        if self._event.is_set():
+            raise Cancelled("Cancelled")
+
+    def wait(self, timeout=None):
+        """Sleep up to timeout seconds, waking up early on cancel(); True if cancelled"""
+        return self._event.wait(timeout)
+
+    def attach(self, process):
+        """Kill process on cancel() until it is detached; at once if already cancelled"""
+        with self._lock:
+            if not self._event.is_set():
+                self._processes.add(process)
+                return
+        _kill(process)
+
+    def detach(self, process):
+        with self._lock:
+            self._processes.discard(process)
+
+    def run(self, cmd, **kwargs):
+        """subprocess.run(cmd, capture_output=True, **kwargs) whose process cancel() kills
+
+        Raises Cancelled instead of returning when the token was cancelled meanwhile.
+        """
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs) as process:
+            self.attach(process)
+            try:
+                stdout, stderr = process.communicate()
+            finally:
+                self.detach(process)
+        self.check()
+        return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+
+def _kill(process):
+    try:
+        process.kill()
+    except OSError:
+        pass  # Already gone
+
+
+def check(cancel):
+    """cancel.check() for an optional token"""
+    if cancel is not None:
+        cancel.check()
@@ -0,0 +1,133 @@
+import numpy as np
+
+from cancel import check
+
+NOISE_GATE_THRESHOLD = 0.01  # Samples below this (after normalizing) are halved
+NOISE_FLOOR_DB = -40  # Spectral bins below this level are halved
+WINDOW_SIZE = 2048  # Window for the dynamic noise floor, advanced by half a window
+STFT_SIZE = 2048  # Frame length of the spectral pass
+STFT_HOP = STFT_SIZE // 2  # Squared analysis/synthesis windows at this hop sum to exactly 1
+STFT_BATCH = 8  # Frames transformed at once, bounds the spectral pass' working memory
+
+
+def reduce_noise_samples(samples, cancel=None):
+    """Apply gentle noise reduction to PCM samples and return them as int16
+
+    cancel (cancel.CancelToken) is checked between batches of the spectral pass.
+
+    Vectorized float32 version of the original Transcribe.reduce_noise heuristic.
+    Differences from the original:
+
+    - The spectral pass runs frame by frame (square-root Hann STFT with overlap-add) instead of
+      one FFT over the whole chunk. The -40 dB floor is rescaled from whole-chunk
+      to per-frame FFT magnitudes (Parseval), so the same bins relative to the
+      signal level are attenuated.
+    - The dynamic noise floor and its half-overlapping windows are evaluated from
+      block sums, applying both overlapping windows in the original order.
+    - Odd-length input keeps its length; the original irfft dropped the last sample.
+
+    On speech-like input of 2 to 59 s at 16 and 44.1 kHz, at least 99.9% of the
+    int16 output stays within 1 LSB of the original. The rest are isolated
+    samples right at the dynamic gate's threshold, which the small differences
+    of the spectral pass put on its other side: attenuated in one version and
+    not the other, they and their two smoothed neighbours move by a tenth of
+    their value (about 10 LSB in quiet passages, hundreds in loud ones).
+    benchmarks/bench_reduce_noise.py checks this over a sweep of lengths and rates.
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    peak = np.max(np.abs(samples)) if samples.size else 0
+    if peak == 0:
+        return samples.astype(np.int16)
+
+    # Normalize the audio
+    samples = samples / peak
+
+    # First pass: Gentle noise gate (reduce instead of zeroing)
+    np.multiply(samples, 0.5, out=samples, where=np.abs(samples) < NOISE_GATE_THRESHOLD)
+
+    # Second pass: Light spectral noise reduction
+    samples = _spectral_gate(samples, 10 ** (NOISE_FLOOR_DB / 20), cancel)
+
+    # Third pass: Very gentle dynamic noise reduction
+    _dynamic_gate(samples)
+
+    # Final pass: Very light smoothing, a 3-tap moving average ('same' convolution)
+    smoothed = samples.copy()
+    smoothed[1:] += samples[:-1]
+    smoothed[:-1] += samples[1:]
+    smoothed /= 3
+
+    # Normalize again and convert back to the int16 range
+    peak = np.max(np.abs(smoothed))
+    if peak == 0:
+        return smoothed.astype(np.int16)
+    max_int16 = np.iinfo(np.int16).max
+    min_int16 = np.iinfo(np.int16).min
+    smoothed *= max_int16 / peak
+    np.clip(smoothed, min_int16, max_int16, out=smoothed)
+    return smoothed.astype(np.int16)
+
+
+def _spectral_gate(samples, noise_floor_linear, cancel=None):
+    """Halve STFT bins whose magnitude is below the noise floor, resynthesize with overlap-add"""
+    n = len(samples)
+    pad = STFT_SIZE - STFT_HOP  # Every original sample is covered by the same number of frames
+    blocks = -(-(n + 2 * pad) // STFT_HOP)
+    padded = np.zeros(blocks * STFT_HOP, dtype=np.float32)
+    padded[pad:pad + n] = samples
+    output = np.zeros_like(padded)
+    output_blocks = output.reshape(blocks, STFT_HOP)
+
+    # Square-root periodic Hann for both analysis and synthesis: the products overlap-add to 1
+    window = np.sqrt(np.hanning(STFT_SIZE + 1)[:-1]).astype(np.float32)
+    # The original thresholded a single FFT over the whole chunk; scale that level to a frame
+    threshold = noise_floor_linear * np.sqrt(np.sum(window ** 2) / n)
+
+    frames = np.lib.stride_tricks.sliding_window_view(padded, STFT_SIZE)[::STFT_HOP]
+    overlap = STFT_SIZE // STFT_HOP
+    for first in range(0, len(frames), STFT_BATCH):
+        check(cancel)
+        batch = frames[first:first + STFT_BATCH] * window
+        spectrum = np.fft.rfft(batch, axis=1)
+        spectrum[np.abs(spectrum) < threshold] *= 0.5
+        batch = np.fft.irfft(spectrum, n=STFT_SIZE, axis=1).astype(np.float32) * window
+        batch = batch.reshape(len(batch), overlap, STFT_HOP)
+        for j in range(overlap):
+            output_blocks[first + j:first + j + len(batch)] += batch[:, j]
+
+    return output[pad:pad + n]
+
+
+def _dynamic_gate(samples, multiplier=1.5, attenuation=0.7):
+    """Attenuate samples below 1.5x the local noise floor, in place
+
+    The original walked half-overlapping windows in order, so every sample is
+    checked against the window that starts one half-window before it and then
+    against the window that starts at its own half-window.
+    """
+    half = WINDOW_SIZE // 2
+    windows = len(range(0, len(samples) - WINDOW_SIZE, half))
+    if windows <= 0:
+        return
+
+    # Mean absolute level of each window from the sums of its two halves
+    blocks = len(samples) // half
+    block_view = samples[:blocks * half].reshape(blocks, half)
+    block_sums = np.abs(block_view).sum(axis=1, dtype=np.float64)
+    noise_floor = (block_sums[:windows] + block_sums[1:windows + 1]) / WINDOW_SIZE
+
+    # Average of up to four neighbouring windows: noise_floor[k-2:k+2]
+    cumulative = np.concatenate(([0.0], np.cumsum(noise_floor)))
+    k = np.arange(windows)
+    low = np.maximum(0, k - 2)
+    high = np.minimum(windows, k + 2)
+    thresholds = (cumulative[high] - cumulative[low]) / (high - low) * multiplier
+
+    # A zero threshold leaves the block untouched
+    previous_window = np.zeros(blocks, dtype=np.float32)
+    previous_window[1:windows + 1] = thresholds
+    own_window = np.zeros(blocks, dtype=np.float32)
+    own_window[:windows] = thresholds
+    for block_thresholds in (previous_window, own_window):
+        quiet = np.abs(block_view) < block_thresholds[:, None]
+        np.multiply(block_view, attenuation, out=block_view, where=quiet)
@@ -0,0 +1,234 @@
+"""Acoustic fingerprints of chunks, to reuse the transcripts of audio heard before
+
+Episodes of a series repeat the same intros, outros and ad reads. A chunk's
+fingerprint is one 32-bit word per 16 ms: the signs of the energy
+differences between 33 bands from 300 to 2000 Hz, across neighbouring bands
+and consecutive frames. Frames are 256 ms long and overlap by 15/16, so a
+shifted chunk boundary, another gain or a re-encode flips few bits. Quiet
+frames get the word 0 and are left out of comparisons: silence after
+denoising looks the same everywhere.
+FingerprintIndex keeps the fingerprints of recognized chunks with their
+transcripts in SQLite, so a chunk that matches one of them is not sent to
+the recognizer again.
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+FINGERPRINT_VERSION = 1  # Bump whenever the words change, so stale entries stop matching
+FRAME_MS = 256  # Frame length
+FRAME_STEP = 16  # Frames start every FRAME_MS / FRAME_STEP
+BAND_HZ = (300, 2000)  # Where the 33 bands are, log-spaced
+BANDS = 33
+QUIET_DB = -30  # Frames this far below the chunk's loudest one are quiet
+FRAMES_PER_BATCH = 512  # Frames transformed at a time, which bounds memory
+INDEX_EVERY = 4  # Every how many words of a stored fingerprint are indexed for candidate lookup
+CANDIDATES = 5  # Best candidate alignments verified per lookup
+MIN_VOTES = 2  # Identical words a candidate alignment needs
+BLOCK_WORDS = 62  # Words (about a second) compared at a time
+MAX_BLOCK_BER = 0.35  # Share of differing bits up to which a block matches
+
+
+def fingerprint(samples, frame_rate):
+    """32-bit words of a mono int16 chunk, one per 16 ms (0 where quiet), as a uint32 array"""
+    frame = int(frame_rate * FRAME_MS / 1000)
+    hop = max(1, frame // FRAME_STEP)
+    audio = np.asarray(samples, dtype=np.float32).reshape(-1)
+    count = (len(audio) - frame) // hop + 1 if len(audio) >= frame else 0
+    if count < 2:
+        return np.zeros(0, dtype=np.uint32)
+
+    window = np.hanning(frame).astype(np.float32)
+    edges = np.round(np.geomspace(*BAND_HZ, BANDS + 1) * frame / frame_rate).astype(np.int64)
+    frames = np.lib.stride_tricks.sliding_window_view(audio, frame)[::hop][:count]
+    energy = np.empty((count, BANDS))
+    for start in range(0, count, FRAMES_PER_BATCH):
+        spectrum = np.fft.rfft(frames[start:start + FRAMES_PER_BATCH] * window, axis=1)[:, edges[0]:edges[-1]]
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        energy[start:start + len(power)] = np.add.reduceat(power, edges[:-1] - edges[0], axis=1)
+
+    across = energy[:, :-1] - energy[:, 1:]
+    bits = across[1:] - across[:-1] > 0
+    words = np.packbits(bits, axis=1, bitorder='little').view('<u4').reshape(-1).astype(np.uint32)
+    loudness = energy.sum(axis=1)[1:]
+    words[loudness <= loudness.max() * 10 ** (QUIET_DB / 10)] = 0
+    return words
+
+
+def _sound_blocks(words):
+    """Which whole blocks of a fingerprint are at least half not quiet"""
+    blocks = len(words) // BLOCK_WORDS
+    return np.count_nonzero(words[:blocks * BLOCK_WORDS].reshape(blocks, BLOCK_WORDS), axis=1) * 2 >= BLOCK_WORDS
+
+
+def similarity(query, stored, offset):
+    """Share of the seconds with sound that match, with query[i] aligned to stored[i + offset]
+
+    Out of the seconds with sound of whichever fingerprint has more of them.
+    A second matches when it has sound in both and at most MAX_BLOCK_BER of
+    the bits of the words that are not quiet in either differ. Seconds with
+    sound in only one of the two chunks count as not matching.
+    """
+    sound = max(np.count_nonzero(_sound_blocks(query)), np.count_nonzero(_sound_blocks(stored)))
+    low, high = max(0, -offset), min(len(query), len(stored) - offset)
+    if high <= low or sound == 0:
+        return 0.0
+    aligned_query, aligned_stored = query[low:high], stored[low + offset:high + offset]
+    both = (aligned_query != 0) & (aligned_stored != 0)
+    differing = np.bitwise_xor(aligned_query, aligned_stored) * both
+    errors = np.unpackbits(differing.view(np.uint8)).reshape(-1, 32).sum(axis=1)
+    full = len(errors) // BLOCK_WORDS
+    errors = errors[:full * BLOCK_WORDS].reshape(full, BLOCK_WORDS).sum(axis=1)
+    compared = np.count_nonzero(both[:full * BLOCK_WORDS].reshape(full, BLOCK_WORDS), axis=1)
+    matched = (_sound_blocks(aligned_query) & _sound_blocks(aligned_stored)
+               & (errors <= MAX_BLOCK_BER * 32 * compared))
+    return float(min(1.0, np.count_nonzero(matched) / sound))
+
+
+class FingerprintIndex:
+    """Local index of chunk fingerprints and their transcripts, least recently used evicted first
+
+    lookup() finds stored chunks that share words with a new one at some
+    alignment, then returns the transcript of the one that matches for at
+    least min_similarity of its seconds (see similarity()). A chunk that
+    only shares an intro or outro with a stored one matches for about as
+    long as that, so the default threshold keeps it from reusing the
+    transcript unless it differs in at most a tenth of its seconds.
+    Entries are scoped (recognizer, sample rate) so a transcript is only
+    reused under the settings it was made with. Above max_entries the least
+    recently matched entries are dropped, a tenth at a time. Several
+    processes can share one index file.
+    """
+
+    def __init__(self, path=os.path.join("cache", "fingerprints.db"), max_entries=2000, min_similarity=0.9,
+                 timeout=60):
+        self.path = os.path.join(os.getcwd(), path) if not os.path.isabs(path) else path
+        self.max_entries = max_entries
+        self.min_similarity = min_similarity
+        self.timeout = timeout
+        self._db = None
+        self._lock = threading.Lock()
+
+    def settings(self):
+        """What decides which stored transcripts a chunk can reuse, e.g. for cache keys"""
+        return {'version': FINGERPRINT_VERSION, 'min_similarity': self.min_similarity}
+
+    def _connect(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    id INTEGER PRIMARY KEY,
+                    scope TEXT NOT NULL,
+                    words BLOB NOT NULL,
+                    text TEXT NOT NULL,
+                    added REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+                CREATE TABLE IF NOT EXISTS postings (
+                    word INTEGER NOT NULL,
+                    entry INTEGER NOT NULL,
+                    t INTEGER NOT NULL,
+                    PRIMARY KEY (word, entry, t)
+                ) WITHOUT ROWID;
+                CREATE TEMP TABLE IF NOT EXISTS query (word INTEGER NOT NULL, t INTEGER NOT NULL);
+                CREATE TEMP TABLE IF NOT EXISTS evicted (id INTEGER PRIMARY KEY);
+            """)
+            self._db = db
+        return self._db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+            db.execute("COMMIT")
+        except BaseException:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            raise
+
+    def lookup(self, scope, words):
+        """The best stored match for a chunk's fingerprint as {'id', 'text', 'similarity'}, or None"""
+        if len(words) < BLOCK_WORDS:
+            return None
+        with self._lock:
+            try:
+                with self._transaction() as db:
+                    db.execute("DELETE FROM query")
+                    db.executemany("INSERT INTO query VALUES (?, ?)",
+                                   ((word, t) for t, word in enumerate(words.tolist())))
+                    # Alignments (stored word index - query word index) that the most identical words agree on
+                    candidates = db.execute("""
+                        SELECT p.entry, p.t - q.t AS offset, COUNT(*) AS votes FROM query AS q
+                        JOIN postings AS p ON p.word = q.word
+                        GROUP BY p.entry, offset HAVING votes >= ?
+                        ORDER BY votes DESC LIMIT ?
+                    """, (MIN_VOTES, CANDIDATES)).fetchall()
+
+                    best = None
+                    for entry, offset, _ in candidates:
+                        row = db.execute("SELECT scope, words, text FROM entries WHERE id = ?", (entry,)).fetchone()
+                        if row is None or row[0] != scope:
+                            continue
+                        score = similarity(words, np.frombuffer(row[1], dtype='<u4'), offset)
+                        if score >= self.min_similarity and (best is None or score > best['similarity']):
+                            best = {'id': entry, 'text': row[2], 'similarity': score}
+                    if best is not None:
+                        db.execute("UPDATE entries SET last_used = ?, hits = hits + 1 WHERE id = ?",
+                                   (time.time(), best['id']))
+                    return best
+            except Exception as e:
+                raise Exception(f"Failed to look up fingerprint: {str(e)}")
+
+    def add(self, scope, words, text):
+        """Store a recognized chunk's fingerprint and transcript, evicting old entries above max_entries"""
+        if len(words) < BLOCK_WORDS:
+            return
+        now = time.time()
+        indexed = [(word, t) for t, word in enumerate(words.tolist())
+                   if t % INDEX_EVERY == 0 and word not in (0, 0xFFFFFFFF)]  # Quiet frames and steady tones
+        with self._lock:
+            try:
+                with self._transaction() as db:
+                    entry = db.execute(
+                        "INSERT INTO entries (scope, words, text, added, last_used) VALUES (?, ?, ?, ?, ?)",
+                        (scope, words.astype('<u4').tobytes(), text, now, now)).lastrowid
+                    db.executemany("INSERT OR IGNORE INTO postings VALUES (?, ?, ?)",
+                                   ((word, entry, t) for word, t in indexed))
+                    count = db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+                    if count > self.max_entries:
+                        self._evict(db, count - int(self.max_entries * 0.9))
+            except Exception as e:
+                raise Exception(f"Failed to add fingerprint: {str(e)}")
+
+    def _evict(self, db, count):
+        """Drop the count least recently used entries"""
+        db.execute("DELETE FROM evicted")
+        db.execute("INSERT INTO evicted SELECT id FROM entries ORDER BY last_used LIMIT ?", (count,))
+        db.execute("DELETE FROM postings WHERE entry IN (SELECT id FROM evicted)")
+        db.execute("DELETE FROM entries WHERE id IN (SELECT id FROM evicted)")
+
+    def stats(self):
+        """Entries, indexed words and total hits in the index"""
+        with self._lock:
+            db = self._connect()
+            entries, hits = db.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM entries").fetchone()
+            postings = db.execute("SELECT COUNT(*) FROM postings").fetchone()[0]
+        return {'entries': entries, 'postings': postings, 'hits': hits}
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -1,17 +1,68 @@
+import time
+
+STARTED = time.perf_counter()  # Origin of the --startup-profile timings
+
+import argparse
+import builtins
+import sys
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
+import multiprocessing
 import os
 import threading
-from main import Transcribe
-from make_video import create_video_with_subtitles
-from pydub import AudioSegment
 import queue
 
+from cancel import CancelToken, Cancelled
+
+# The pipeline (numpy, speech_recognition, pydub) is imported on first use and
+# by a warm-up thread once the window is up, so it does not delay the window
+
+
+class StartupProfile:
+    """Import and milestone timings of a GUI launch, for --startup-profile
+
+    Wraps __import__ to time every module the first time it is imported, on
+    any thread; nested imports are included in the time of their parent.
+    """
+
+    def __init__(self, path):
+        self.path = path  # '-' for stdout; a file works for the windowed frozen build too
+        self.imports = []  # (seconds, module, thread name)
+        self._import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def _timed_import(self, name, *args, **kwargs):
+        if not name or name in sys.modules:  # Relative imports count towards their package
+            return self._import(name, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return self._import(name, *args, **kwargs)
+        finally:
+            self.imports.append((time.perf_counter() - start, name, threading.current_thread().name))
+
+    def write(self, line):
+        if self.path == '-':
+            print(line, flush=True)
+        else:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+    def milestone(self, name):
+        self.write(f"startup: {name} after {time.perf_counter() - STARTED:.3f} s")
+
+    def dump(self, top=25):
+        """Write the slowest imports so far, then stop timing imports"""
+        builtins.__import__ = self._import
+        for seconds, name, thread in sorted(self.imports, reverse=True)[:top]:
+            self.write(f"import: {seconds * 1000:9.1f} ms  {name}  [{thread}]")
+
+
 class TranscriptionGUI:
-    def __init__(self, root):
+    def __init__(self, root, profile=None):
         self.root = root
+        self.profile = profile
         self.root.title("Persian Audio Transcription")
-        self.root.geometry("600x400")
+        self.root.geometry("600x560")
 
         # Variables
         self.audio_path = tk.StringVar()
@@ -21,6 +72,14 @@ class TranscriptionGUI:
         
         # Queue for thread-safe communication
         self.queue = queue.Queue()
+
+        # Probes and decodes the selected file in the background, see ingest.py
+        self.ingest = None
+        self._ingest_percent = None
+
+        # Running transcription or video worker and the token that stops it
+        self.worker = None
+        self.cancel_token = None
         
         # Create main frame
         main_frame = ttk.Frame(root, padding="10")
@@ -43,16 +102,52 @@ class TranscriptionGUI:
         # Buttons
         button_frame = ttk.Frame(main_frame)
         button_frame.grid(row=3, column=0, columnspan=3, pady=20)
+
+        # Live transcript, filled in as chunks finish
+        text_frame = ttk.Frame(main_frame)
+        text_frame.grid(row=4, column=0, columnspan=3, sticky=(tk.W, tk.E))
+        self.transcript_text = tk.Text(text_frame, height=10, width=70, wrap='word', state='disabled')
+        self.transcript_text.tag_configure('rtl', justify='right')
+        scrollbar = ttk.Scrollbar(text_frame, command=self.transcript_text.yview)
+        self.transcript_text.config(yscrollcommand=scrollbar.set)
+        self.transcript_text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         
         self.transcribe_button = ttk.Button(button_frame, text="Transcribe", command=self.start_transcription, state='disabled')
         self.transcribe_button.pack(side=tk.LEFT, padx=5)
         
         self.video_button = ttk.Button(button_frame, text="Create Video", command=self.create_video, state='disabled')
         self.video_button.pack(side=tk.LEFT, padx=5)
+
+        self.cancel_button = ttk.Button(button_frame, text="Cancel", command=self.cancel, state='disabled')
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
+
+        # Stop running work (and its ffmpeg processes) when the window is closed
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         
         # Start checking the queue
         self.check_queue()
 
+        # Import the pipeline once the window has been drawn
+        self.root.after_idle(self.start_warm_up)
+
+    def start_warm_up(self):
+        if self.profile:
+            self.profile.milestone("window shown")
+        threading.Thread(target=self.warm_up, name='warm-up', daemon=True).start()
+
+    def warm_up(self):
+        """Import the pipeline in the background, so the first transcription does not wait for it"""
+        try:
+            from main import preload
+            preload()
+            import make_video  # noqa: F401
+        except Exception as e:
+            print(f"Warm-up failed: {str(e)}")  # The workers import it again and report the error
+        if self.profile:
+            self.profile.milestone("pipeline imported")
+            self.profile.dump()
+
     def check_queue(self):
         """Check the queue for messages from worker threads"""
         try:
@@ -60,12 +155,27 @@ class TranscriptionGUI:
                 message = self.queue.get_nowait()
                 if message['type'] == 'progress':
                     self.progress_var.set(message['value'])
+                elif message['type'] == 'segment':
+                    self.transcript_text.config(state='normal')
+                    self.transcript_text.insert(tk.END, message['text'] + '\n', 'rtl')
+                    self.transcript_text.see(tk.END)
+                    self.transcript_text.config(state='disabled')
+                elif message['type'] == 'clear':
+                    self.transcript_text.config(state='normal')
+                    self.transcript_text.delete('1.0', tk.END)
+                    self.transcript_text.config(state='disabled')
                 elif message['type'] == 'status':
                     self.status_label.config(text=message['text'])
                 elif message['type'] == 'error':
+                    self.cancel_button.config(state='disabled')
                     messagebox.showerror("Error", message['text'])
                     self.enable_buttons()
+                elif message['type'] == 'cancelled':
+                    self.cancel_button.config(state='disabled')
+                    self.progress_var.set(0)
+                    self.enable_buttons()
                 elif message['type'] == 'success':
+                    self.cancel_button.config(state='disabled')
                     messagebox.showinfo("Success", message['text'])
                     if message.get('enable_video', False):
                         self.video_button.config(state='normal')
@@ -86,42 +196,48 @@ class TranscriptionGUI:
         self.transcribe_button.config(state='disabled')
         self.video_button.config(state='disabled')
 
-    def convert_ogg_to_mp3(self, input_path):
-        """Convert OGG file to MP3 format"""
-        try:
-            self.queue.put({'type': 'status', 'text': "Converting OGG to MP3..."})
-
-            input_name= '.'.join(input_path.split('.')[:-1])
-            input_name = input_name.split('/')[-1]
-            output_path = os.path.join(os.getcwd(),'output')
-            if not os.path.isdir(output_path):
-                os.makedirs(output_path,exist_ok=True)
-            output_path = os.path.join(output_path,f"c_{input_name}.mp3")
-            audio = AudioSegment.from_ogg(input_path)
-            audio.export(output_path, format="mp3")
-            
-            self.queue.put({'type': 'status', 'text': "OGG to MP3 conversion complete!"})
-            return output_path
-        except Exception as e:
-            raise Exception(f"Failed to convert OGG to MP3: {str(e)}")
-        
-    def update_progress(self, value):
+    def update_progress(self, value, stats=None):
         """Thread-safe progress update"""
         self.queue.put({'type': 'progress', 'value': value})
+        if stats and stats.get('eta_s') is not None:
+            minutes, seconds = divmod(int(stats['eta_s']), 60)
+            self.queue.put({'type': 'status', 'text': f"Transcribing... {stats['chunks_done']}/{stats['chunks_total']} "
+                                                      f"chunks, {stats['audio_s_per_s']:.1f}x realtime, "
+                                                      f"about {minutes}:{seconds:02d} left"})
         
+    def ingest_progress(self, stage, fraction):
+        """Thread-safe status update while the selected file is probed and decoded"""
+        percent = int(fraction * 100)
+        if (stage, percent) == self._ingest_percent:
+            return
+        self._ingest_percent = (stage, percent)
+        text = "Reading audio..." if stage == 'probe' else f"Decoding audio... {percent}%"
+        self.queue.put({'type': 'status', 'text': text})
+
+    def ingest_done(self, ingest):
+        """Thread-safe status update once the selected file is ready (or failed)"""
+        if ingest is not self.ingest:
+            return  # Another file was selected meanwhile
+        if ingest.error:
+            self.queue.put({'type': 'status', 'text': f"Could not read audio: {str(ingest.error)}"})
+            return
+        minutes, seconds = divmod(int(ingest.info['duration']), 60)
+        self.queue.put({'type': 'status', 'text': f"Ready: {minutes}:{seconds:02d} of audio, "
+                                                  f"{ingest.info['sample_rate']} Hz, {ingest.info['channels']} ch"})
+
     def browse_audio(self):
+        from ingest import AUDIO_EXTENSIONS, Ingest
+
         filename = filedialog.askopenfilename(
-            filetypes=[("Audio Files", "*.mp3 *.wav *.m4a *.ogg")]
+            filetypes=[("Audio Files", " ".join(f"*{extension}" for extension in AUDIO_EXTENSIONS))]
         )
         if filename:
-            # If OGG file is selected, convert it to MP3
-            if filename.lower().endswith('.ogg'):
-                try:
-                    filename = self.convert_ogg_to_mp3(filename)
-                except Exception as e:
-                    messagebox.showerror("Error", str(e))
-                    return
-            
+            # Decode in the background, straight from the original file; the window stays responsive
+            self.close_ingest()
+            self._ingest_percent = None
+            self.ingest = Ingest(filename, on_progress=self.ingest_progress, on_done=self.ingest_done)
+            self.ingest.start()
+
             self.audio_path.set(filename)
             # Set default output paths
             base_path = os.path.splitext(filename)[0]
@@ -134,20 +250,35 @@ class TranscriptionGUI:
     def transcription_worker(self):
         """Worker thread for transcription"""
         try:
+            from main import Transcribe
+
+            store = None
+            ingest = self.ingest  # cancel() may drop it meanwhile
+            if ingest and ingest.audio_path == self.audio_path.get():
+                if not ingest.done:
+                    self.queue.put({'type': 'status', 'text': "Waiting for the audio to be decoded..."})
+                store = ingest.take(self.cancel_token)  # None after the first run; Transcribe decodes it again
+
             self.queue.put({'type': 'status', 'text': "Transcribing..."})
             self.queue.put({'type': 'progress', 'value': 0})
+            self.queue.put({'type': 'clear'})
             
             transcriber = Transcribe(
                 self.audio_path.get(),
                 self.text_path.get(),
                 self.srt_path.get(),
-                progress_callback=self.update_progress
+                progress_callback=self.update_progress,
+                store=store,
+                cancel=self.cancel_token
             )
-            transcriber.run()
+            transcriber.run(on_segment=lambda segment: self.queue.put({'type': 'segment', 'text': segment['text']}))
             
             self.queue.put({'type': 'status', 'text': "Transcription completed!"})
             self.queue.put({'type': 'success', 'text': "Transcription completed successfully!", 'enable_video': True})
-            
+
+        except Cancelled:
+            self.queue.put({'type': 'status', 'text': "Transcription cancelled; finished chunks were kept"})
+            self.queue.put({'type': 'cancelled'})
         except Exception as e:
             self.queue.put({'type': 'status', 'text': "Error occurred!"})
             self.queue.put({'type': 'error', 'text': f"An error occurred: {str(e)}"})
@@ -155,18 +286,26 @@ class TranscriptionGUI:
     def video_worker(self):
         """Worker thread for video creation"""
         try:
+            from make_video import create_video_with_subtitles
+
             self.queue.put({'type': 'status', 'text': "Creating video..."})
             self.queue.put({'type': 'progress', 'value': 0})
             
             create_video_with_subtitles(
                 audio_path=self.audio_path.get(),
                 srt_path=self.srt_path.get(),
-                output_path=self.video_path.get()
+                output_path=self.video_path.get(),
+                mode='parallel',
+                progress_callback=self.update_progress,
+                cancel=self.cancel_token
             )
             
             self.queue.put({'type': 'status', 'text': "Video created!"})
             self.queue.put({'type': 'success', 'text': "Video created successfully!"})
-            
+
+        except Cancelled:
+            self.queue.put({'type': 'status', 'text': "Video cancelled"})
+            self.queue.put({'type': 'cancelled'})
         except Exception as e:
             self.queue.put({'type': 'status', 'text': "Error occurred!"})
             self.queue.put({'type': 'error', 'text': f"An error occurred: {str(e)}"})
@@ -176,23 +315,57 @@ class TranscriptionGUI:
             messagebox.showerror("Error", "Please select an audio file first!")
             return
             
-        self.disable_buttons()
-        # Start transcription in a separate thread
-        threading.Thread(target=self.transcription_worker, daemon=True).start()
+        self.start_worker(self.transcription_worker)
             
     def create_video(self):
         if not all([self.audio_path.get(), self.srt_path.get(), self.video_path.get()]):
             messagebox.showerror("Error", "Please transcribe the audio first!")
             return
             
+        self.start_worker(self.video_worker)
+
+    def start_worker(self, target):
+        """Run a worker in a separate thread, cancellable with the Cancel button"""
         self.disable_buttons()
-        # Start video creation in a separate thread
-        threading.Thread(target=self.video_worker, daemon=True).start()
+        self.cancel_token = CancelToken()
+        self.cancel_button.config(state='normal')
+        self.worker = threading.Thread(target=target, daemon=True)
+        self.worker.start()
+
+    def cancel(self):
+        """Stop the running worker; it reports back through the queue once it has cleaned up"""
+        if self.cancel_token:
+            self.cancel_token.cancel()
+        self.close_ingest()
+        self.cancel_button.config(state='disabled')
+        self.status_label.config(text="Cancelling...")
+
+    def close_ingest(self):
+        """Stop a background decode (killing ffmpeg) or drop its result; the next run decodes the file itself"""
+        if self.ingest:
+            self.ingest.close()
+            self.ingest = None
+
+    def on_close(self):
+        """Cancel running work and give it a moment to kill ffmpeg and delete scratch files"""
+        if self.cancel_token:
+            self.cancel_token.cancel()
+        self.close_ingest()
+        if self.worker and self.worker.is_alive():
+            self.worker.join(timeout=5)
+        self.root.destroy()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Persian Audio Transcription")
+    parser.add_argument('--startup-profile', nargs='?', const='-', metavar='PATH',
+                        help="Write startup and import timings to PATH (default: stdout)")
+    args = parser.parse_args(argv)
 
-def main():
+    profile = StartupProfile(args.startup_profile) if args.startup_profile else None
     root = tk.Tk()
-    app = TranscriptionGUI(root)
+    app = TranscriptionGUI(root, profile)
     root.mainloop()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Preprocessing workers re-run the frozen executable
     main() 
\ No newline at end of file
@@ -0,0 +1,123 @@
+"""Keep-alive HTTP(S) connections shared by recognition requests
+
+urllib opens (and for HTTPS, handshakes) a new connection for every
+request. ConnectionPool keeps them open instead, and times connecting
+separately from sending the request and reading the answer.
+"""
+import http.client
+import threading
+import time
+from collections import deque
+
+# Raised when the server closed an idle keep-alive connection before our request reached it
+STALE_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError, ConnectionAbortedError)
+
+
+class ConnectionPool:
+    """Keep-alive connections to one host, reused across requests, threads and files
+
+    Up to max_idle connections stay open between requests (size it to the
+    request concurrency). More requests than that at once open extra
+    connections, which are closed when they finish. A request that fails on
+    a reused connection before any answer arrives is retried once on a new
+    connection, since the server may close idle connections at any time.
+    """
+
+    def __init__(self, scheme, host, port=None, max_idle=8, timeout=None):
+        if scheme not in ('http', 'https'):
+            raise Exception(f"Unsupported scheme: {scheme}")
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.stats = {'connections': 0, 'requests': 0, 'reused': 0, 'stale': 0, 'connect_s': 0.0, 'transfer_s': 0.0}
+        self._idle = deque()  # Open connections, most recently used last
+        self._lock = threading.Lock()
+
+    def _checkout(self):
+        """An idle connection and True, or a new unconnected one and False"""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        connection_class = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        return connection_class(self.host, self.port, timeout=self.timeout), False
+
+    def _checkin(self, connection):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def request(self, method, path, body=None, headers=None):
+        """Send one request; returns {'status', 'reason', 'body', 'connect_s', 'transfer_s', 'reused'}
+
+        connect_s is the TCP (and TLS) handshake, 0 on a reused connection;
+        transfer_s covers sending the request and reading the whole answer.
+        """
+        for attempt in range(2):
+            connection, reused = self._checkout()
+            start = time.perf_counter()
+            try:
+                if connection.sock is None:
+                    connection.connect()
+                    with self._lock:
+                        self.stats['connections'] += 1
+                connected = time.perf_counter()
+                connection.request(method, path, body=body, headers=headers or {})
+                response = connection.getresponse()
+                data = response.read()
+            except STALE_ERRORS:
+                connection.close()
+                if reused and attempt == 0:
+                    with self._lock:
+                        self.stats['stale'] += 1
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            finished = time.perf_counter()
+
+            if response.will_close:
+                connection.close()
+            else:
+                self._checkin(connection)
+            connect_s = connected - start if not reused else 0.0
+            with self._lock:
+                self.stats['requests'] += 1
+                self.stats['reused'] += 1 if reused else 0
+                self.stats['connect_s'] += connect_s
+                self.stats['transfer_s'] += finished - connected
+            return {'status': response.status, 'reason': response.reason, 'body': data,
+                    'connect_s': connect_s, 'transfer_s': finished - connected, 'reused': reused}
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def close(self):
+        """Close the idle connections; connections in use are closed when they come back"""
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+            self.max_idle = 0
+        for connection in idle:
+            connection.close()
+
+
+def connection_report(before, after):
+    """Connection statistics between two pool snapshots, with per-request means"""
+    if after is None:
+        return None
+    delta = {key: value - (before or {}).get(key, 0) for key, value in after.items()}
+    requests = delta['requests']
+    return {
+        'connections_opened': delta['connections'],
+        'requests': requests,
+        'reused_ratio': delta['reused'] / requests if requests else None,
+        'stale_retries': delta['stale'],
+        'connect_s_total': delta['connect_s'],
+        'connect_s_mean': delta['connect_s'] / requests if requests else None,
+        'transfer_s_mean': delta['transfer_s'] / requests if requests else None,
+    }
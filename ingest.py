@@ -0,0 +1,103 @@
+"""Background ingest of a source file into the pipeline's PCM format
+
+Any container ffmpeg reads (OGG, Opus, M4A, FLAC, ...) is probed (see
+audio_store.probe_audio, which caches the result) and decoded straight into
+a PCMStore on a background thread; 16-bit WAV is mapped in place. The
+original file is what the pipeline and the video renderer read, so there is
+no lossy intermediate copy.
+"""
+import threading
+
+from audio_store import PCMStore, probe_audio
+from cancel import CancelToken, Cancelled, check
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.m4a', '.ogg', '.opus', '.flac', '.aac', '.wma')
+CANCEL_POLL_S = 0.1  # How often take() checks its cancel token while waiting for the decode
+
+
+class Ingest:
+    """Probe and decode one source on a background thread
+
+    on_progress(stage, fraction) is called from that thread with stage
+    'probe' or 'decode'; on_done(ingest) once it has finished, successfully
+    or not. take() waits for the result and hands the store over to the
+    caller, who then owns (and closes) it.
+    """
+
+    def __init__(self, audio_path, scratch_dir="chunks", on_progress=None, on_done=None):
+        self.audio_path = audio_path
+        self.scratch_dir = scratch_dir
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.info = None  # probe_audio result
+        self.store = None
+        self.error = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._cancel = CancelToken()  # Stops a decode that is no longer wanted
+        self._thread = threading.Thread(target=self._run, name='ingest', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _progress(self, stage, fraction):
+        if self.on_progress:
+            self.on_progress(stage, fraction)
+
+    def _run(self):
+        try:
+            self._progress('probe', 0.0)
+            self.info = probe_audio(self.audio_path)
+            self._progress('decode', 0.0)
+            store = PCMStore(self.audio_path, scratch_dir=self.scratch_dir, info=self.info,
+                             progress_callback=lambda fraction: self._progress('decode', fraction),
+                             cancel=self._cancel)
+            with self._lock:
+                if self._closed:
+                    store.close()  # Nobody will take it any more
+                else:
+                    self.store = store
+            self._progress('decode', 1.0)
+        except Exception as e:
+            self.error = e
+        finally:
+            self._done.set()
+            if self.on_done:
+                self.on_done(self)
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Wait until ingest has finished; True unless the timeout expired"""
+        return self._done.wait(timeout)
+
+    def take(self, cancel=None):
+        """Wait for the decoded store and take ownership of it; None if it was already taken
+
+        Raises the error ingest failed with, if any, and cancel.Cancelled as
+        soon as cancel (a CancelToken) is cancelled or the ingest was closed
+        during the decode.
+        """
+        while not self._done.wait(CANCEL_POLL_S if cancel else None):
+            check(cancel)
+        if isinstance(self.error, Cancelled):
+            raise Cancelled("Decode cancelled")
+        if self.error:
+            raise Exception(f"Failed to read audio: {str(self.error)}")
+        with self._lock:
+            store, self.store = self.store, None
+        return store
+
+    def close(self):
+        """Discard the store unless it was taken; a decode still running is stopped"""
+        with self._lock:
+            self._closed = True
+            store, self.store = self.store, None
+        if store:
+            store.close()
+        elif not self.done:
+            self._cancel.cancel()  # Kills ffmpeg; the partial file is deleted
@@ -0,0 +1,413 @@
+"""Live captioning from a microphone, stdin, an ffmpeg-readable stream or a file
+
+    python -m live --input mic --srt live.srt --vtt live.vtt
+    ffmpeg -i http://radio/stream -f s16le -ac 1 -ar 16000 - | python -m live --input stdin
+    python -m live --input ffmpeg:http://radio/stream --vtt live.vtt
+    python -m live --input file:talk.wav --backend fake       # file-backed fake input, paced in real time
+
+PCM flows into a fixed-size ring buffer. After every block the audio since
+the last cut is scanned with the same energy envelope and silence rule that
+split_audio_file uses; every utterance followed by enough silence (or grown
+to max_utterance_ms) is denoised and sent to the recognizer on a thread pool.
+Cues are written in order; one whose result is not back max_latency_s after
+its audio ended is dropped, so captions never fall further behind than that.
+"""
+import argparse
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import speech_recognition as sr
+
+from audio_store import SAMPLE_WIDTH, PCMStore, downmix
+from denoise import reduce_noise_samples
+from recognition import AdaptiveScheduler, FakeBackend, GoogleBackend
+from vad import EnergyEnvelope
+
+LIVE_FRAME_RATE = 16000
+BLOCK_MS = 100
+
+
+class RingBuffer:
+    """Fixed-capacity mono int16 buffer addressed by absolute frame numbers"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.data = np.zeros(capacity, dtype=np.int16)
+        self.end = 0  # Frames written so far; the buffer holds [start, end)
+
+    @property
+    def start(self):
+        return max(0, self.end - self.capacity)
+
+    def write(self, block):
+        if len(block) >= self.capacity:
+            self.end += len(block) - self.capacity
+            block = block[-self.capacity:]
+        position = self.end % self.capacity
+        first = min(len(block), self.capacity - position)
+        self.data[position:position + first] = block[:first]
+        self.data[:len(block) - first] = block[first:]
+        self.end += len(block)
+
+    def read(self, first, last):
+        """Copy of frames [first, last); raises if they were already overwritten"""
+        if first < self.start or last > self.end or first > last:
+            raise ValueError(f"Frames {first}-{last} not in buffer ({self.start}-{self.end})")
+        a, b = first % self.capacity, last % self.capacity
+        if last - first == 0:
+            return self.data[:0].copy()
+        if a < b:
+            return self.data[a:b].copy()
+        return np.concatenate((self.data[a:], self.data[:b]))
+
+
+class PipeInput:
+    """Raw signed 16-bit little-endian PCM from a binary stream (stdin, an ffmpeg pipe)"""
+
+    def __init__(self, stream, frame_rate=LIVE_FRAME_RATE, channels=1, block_ms=BLOCK_MS):
+        self.stream = stream
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.block_bytes = int(frame_rate * block_ms / 1000) * channels * SAMPLE_WIDTH
+
+    def __iter__(self):
+        leftover = b''
+        while True:
+            data = self.stream.read(self.block_bytes)
+            if not data:
+                return
+            data = leftover + data
+            usable = len(data) - len(data) % (self.channels * SAMPLE_WIDTH)
+            data, leftover = data[:usable], data[usable:]
+            if data:
+                yield downmix(np.frombuffer(data, dtype='<i2').reshape(-1, self.channels))
+
+    def close(self):
+        pass
+
+
+class FFmpegInput(PipeInput):
+    """Anything ffmpeg can read (file, URL, device), resampled to mono PCM"""
+
+    def __init__(self, source, frame_rate=LIVE_FRAME_RATE, block_ms=BLOCK_MS):
+        self.process = subprocess.Popen(
+            ['ffmpeg', '-v', 'error', '-i', source, '-f', 's16le', '-acodec', 'pcm_s16le',
+             '-ar', str(frame_rate), '-ac', '1', 'pipe:1'],
+            stdout=subprocess.PIPE)
+        super().__init__(self.process.stdout, frame_rate, 1, block_ms)
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+        self.process.wait()
+
+
+class PyAudioInput:
+    """Microphone (or other capture device) input through PyAudio"""
+
+    def __init__(self, frame_rate=LIVE_FRAME_RATE, block_ms=BLOCK_MS, device_index=None):
+        import pyaudio  # Only needed for microphone input
+
+        self.frame_rate = frame_rate
+        self.block_frames = int(frame_rate * block_ms / 1000)
+        self.audio = pyaudio.PyAudio()
+        self.stream = self.audio.open(format=pyaudio.paInt16, channels=1, rate=frame_rate, input=True,
+                                      frames_per_buffer=self.block_frames, input_device_index=device_index)
+
+    def __iter__(self):
+        while self.stream.is_active():
+            data = self.stream.read(self.block_frames, exception_on_overflow=False)
+            yield np.frombuffer(data, dtype='<i2')
+
+    def close(self):
+        self.stream.stop_stream()
+        self.stream.close()
+        self.audio.terminate()
+
+
+class FileInput:
+    """File-backed fake live input: blocks of a file, paced at speed times real time (0 = no pacing)"""
+
+    def __init__(self, path, block_ms=BLOCK_MS, speed=1.0, scratch_dir="chunks"):
+        self.store = PCMStore(path, scratch_dir=scratch_dir)
+        self.frame_rate = self.store.frame_rate
+        self.block_frames = int(self.frame_rate * block_ms / 1000)
+        self.speed = speed
+
+    def __iter__(self):
+        started = time.perf_counter()
+        for first in range(0, self.store.frames, self.block_frames):
+            if self.speed:
+                delay = started + first / self.frame_rate / self.speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            yield downmix(self.store.samples[first:first + self.block_frames])
+
+    def close(self):
+        self.store.close()
+
+
+def _cue_time(ms, separator):
+    seconds, ms = divmod(int(ms), 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{ms:03d}"
+
+
+class CueWriter:
+    """Append cues to SRT and/or WebVTT files, flushed one cue at a time"""
+
+    def __init__(self, srt_path=None, vtt_path=None):
+        self.count = 0
+        self.srt_file = open(srt_path, 'w', encoding='utf-8') if srt_path else None
+        self.vtt_file = open(vtt_path, 'w', encoding='utf-8') if vtt_path else None
+        if self.vtt_file:
+            self.vtt_file.write("WEBVTT\n\n")
+            self.vtt_file.flush()
+
+    def write(self, cue):
+        self.count += 1
+        if self.srt_file:
+            self.srt_file.write(f"{self.count}\n{_cue_time(cue['start'], ',')} --> {_cue_time(cue['end'], ',')}\n"
+                                f"{cue['text'].strip()}\n\n")
+            self.srt_file.flush()
+        if self.vtt_file:
+            self.vtt_file.write(f"{_cue_time(cue['start'], '.')} --> {_cue_time(cue['end'], '.')}\n"
+                                f"{cue['text'].strip()}\n\n")
+            self.vtt_file.flush()
+
+    def close(self):
+        for f in (self.srt_file, self.vtt_file):
+            if f:
+                f.close()
+
+
+class LiveTranscriber:
+    """Cut a live PCM stream into utterances and caption them with bounded latency and memory"""
+
+    def __init__(self, source, backend=None, on_cue=None, srt_path=None, vtt_path=None, max_workers=4,
+                 min_silence_len=300, silence_below_dbfs=10, keep_silence=200, max_utterance_ms=15000,
+                 max_latency_s=10.0, level_window_s=30.0, denoise=True):
+        self.source = source
+        self.frame_rate = source.frame_rate
+        self.backend = backend or AdaptiveScheduler(GoogleBackend(language='fa-IR', pool_size=max_workers),
+                                                    max_concurrency=max_workers,
+                                                    max_retries=1)
+        self.on_cue = on_cue
+        self.writer = CueWriter(srt_path, vtt_path)
+        self.max_workers = max_workers
+        self.min_silence_len = min_silence_len  # Same defaults as split_audio_file's first pass
+        self.silence_below_dbfs = silence_below_dbfs
+        self.keep_silence = keep_silence
+        self.max_utterance_ms = max_utterance_ms
+        self.max_latency_s = max_latency_s
+        self.denoise = denoise
+
+        # Room for the longest utterance plus its padding and a couple of blocks
+        capacity_ms = max_utterance_ms + 2 * keep_silence + min_silence_len + 10 * BLOCK_MS
+        self.ring = RingBuffer(int(self.frame_rate * capacity_ms / 1000))
+        self.cut = 0  # Absolute frame before which all audio has been handled
+        self.levels = deque(maxlen=max(1, int(level_window_s * 1000 / BLOCK_MS)))  # (sum of squares, frames)
+        self.pending = deque()  # Utterances in recognition, in stream order
+        self.max_pending = 4 * max_workers
+        self.executor = None
+        self.stats = {'utterances': 0, 'cues': 0, 'empty': 0, 'errors': 0, 'late': 0, 'dropped': 0,
+                      'max_latency_s': 0.0}
+        self._stop = threading.Event()
+
+    def stop(self):
+        """Ask run() to finish after the current block"""
+        self._stop.set()
+
+    def _ms_to_frame(self, ms):
+        return int(ms * self.frame_rate // 1000)
+
+    def _frame_to_ms(self, frame):
+        return frame * 1000 // self.frame_rate
+
+    def _level_dbfs(self):
+        """dBFS of the recent stream, the live counterpart of the whole file's dBFS"""
+        energy = sum(level[0] for level in self.levels)
+        frames = sum(level[1] for level in self.levels)
+        rms = int(np.sqrt(energy / frames)) if frames else 0
+        if not rms:
+            return -float("infinity")
+        return 20 * np.log10(rms / EnergyEnvelope.max_possible_amplitude)
+
+    def _scan(self, final=False):
+        """Cut every utterance that is complete in the audio after self.cut"""
+        head = self.ring.end
+        base = self.cut
+        samples = self.ring.read(base, head)
+        envelope = EnergyEnvelope(samples[:, None], self.frame_rate)
+        length_ms = envelope.length_ms
+        level = self._level_dbfs()
+        if level == -float("infinity"):
+            ranges = []
+        else:
+            ranges = envelope.detect_nonsilent(self.min_silence_len, level - self.silence_below_dbfs)
+
+        if not ranges:
+            # Only silence: keep just enough to pad the next utterance
+            self.cut = max(base, head - self._ms_to_frame(self.keep_silence))
+            return
+
+        for start, end in ranges:
+            if end >= length_ms and not final:
+                # Still speaking: cut anyway once the utterance is too long to wait for
+                if end - start >= self.max_utterance_ms:
+                    self._submit(max(self.cut, base + self._ms_to_frame(start - self.keep_silence)), head)
+                    self.cut = head
+                else:
+                    # Drop leading silence so the buffer holds little more than the utterance
+                    self.cut = max(self.cut, base + self._ms_to_frame(start - self.keep_silence))
+                return
+            first = max(self.cut, base + self._ms_to_frame(start - self.keep_silence))
+            last = min(head, base + self._ms_to_frame(end + self.keep_silence))
+            self._submit(first, last)
+            self.cut = last
+        if not final:
+            self.cut = max(self.cut, head - self._ms_to_frame(self.keep_silence))
+
+    def _submit(self, first, last):
+        """Denoise an utterance and send it to the recognizer"""
+        if last <= first:
+            return
+        self.stats['utterances'] += 1
+        if len(self.pending) >= self.max_pending:
+            # The recognizer cannot keep up; shed load instead of buffering without bound
+            self.stats['dropped'] += 1
+            print(f"Dropping utterance at {self._frame_to_ms(first) / 1000:.1f}s, recognizer is behind")
+            return
+        samples = self.ring.read(first, last)
+        if self.denoise:
+            samples = reduce_noise_samples(samples)
+        audio_data = sr.AudioData(samples.tobytes(), self.frame_rate, SAMPLE_WIDTH)
+        self.pending.append({
+            'start': self._frame_to_ms(first),
+            'end': self._frame_to_ms(last),
+            'ready_at': time.perf_counter(),  # When its audio had fully arrived
+            'future': self.executor.submit(self.backend.recognize, audio_data),
+        })
+
+    def _flush(self, wait=False):
+        """Write finished cues in order; give up on any older than max_latency_s"""
+        while self.pending:
+            utterance = self.pending[0]
+            future = utterance['future']
+            deadline = utterance['ready_at'] + self.max_latency_s
+            if not future.done():
+                remaining = deadline - time.perf_counter()
+                if remaining > 0 and wait:
+                    try:
+                        future.exception(timeout=remaining)
+                    except Exception:
+                        pass
+                if not future.done():
+                    if time.perf_counter() < deadline:
+                        return
+                    future.cancel()
+                    self.pending.popleft()
+                    self.stats['late'] += 1
+                    print(f"Skipping cue at {utterance['start'] / 1000:.1f}s, recognition took too long")
+                    continue
+
+            self.pending.popleft()
+            latency = time.perf_counter() - utterance['ready_at']
+            self.stats['max_latency_s'] = max(self.stats['max_latency_s'], latency)
+            try:
+                text = future.result()
+            except sr.UnknownValueError:
+                self.stats['empty'] += 1
+                continue
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"[Error at {utterance['start'] / 1000:.1f}s: {str(e)}]")
+                continue
+            if not text or not text.strip():
+                self.stats['empty'] += 1
+                continue
+            cue = {'start': utterance['start'], 'end': utterance['end'], 'text': text, 'latency_s': latency}
+            self.stats['cues'] += 1
+            self.writer.write(cue)
+            if self.on_cue:
+                self.on_cue(cue)
+
+    def run(self):
+        """Caption the source until it ends or stop() is called; returns self.stats"""
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='live-recognize')
+        try:
+            for block in self.source:
+                block = np.asarray(block, dtype=np.int16)
+                self.ring.write(block)
+                wide = block.astype(np.int64)
+                self.levels.append((int(np.dot(wide, wide)), len(block)))
+                if self.cut < self.ring.start:
+                    self.cut = self.ring.start  # Only if a block is larger than the whole buffer
+                self._scan()
+                self._flush()
+                if self._stop.is_set():
+                    break
+            if self.ring.end > self.cut:
+                self._scan(final=True)
+            self._flush(wait=True)
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.writer.close()
+            self.source.close()
+        return self.stats
+
+
+def open_input(spec, frame_rate=LIVE_FRAME_RATE, speed=1.0):
+    """Input for 'mic', 'stdin', 'ffmpeg:<source>' or 'file:<path>'"""
+    if spec == 'mic':
+        return PyAudioInput(frame_rate)
+    if spec == 'stdin':
+        return PipeInput(sys.stdin.buffer, frame_rate)
+    if spec.startswith('ffmpeg:'):
+        return FFmpegInput(spec[len('ffmpeg:'):], frame_rate)
+    if spec.startswith('file:'):
+        return FileInput(spec[len('file:'):], speed=speed)
+    raise ValueError(f"Unknown input: {spec}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--input', default='mic', help="mic, stdin, ffmpeg:<file or URL> or file:<path>")
+    parser.add_argument('--rate', type=int, default=LIVE_FRAME_RATE, help="Sample rate of mic, stdin and ffmpeg input")
+    parser.add_argument('--speed', type=float, default=1.0, help="Pacing of file: input, 0 = as fast as possible")
+    parser.add_argument('--srt', help="SRT file to append cues to")
+    parser.add_argument('--vtt', help="WebVTT file to append cues to")
+    parser.add_argument('--language', default='fa-IR')
+    parser.add_argument('--backend', choices=('google', 'fake'), default='google')
+    parser.add_argument('--endpoint', help="Google-compatible recognition endpoint, e.g. a stub_server URL")
+    parser.add_argument('--workers', type=int, default=4, help="Recognition requests in flight")
+    parser.add_argument('--max-utterance', type=float, default=15.0, help="Seconds before an utterance is cut anyway")
+    parser.add_argument('--max-latency', type=float, default=10.0, help="Seconds to wait for a cue before skipping it")
+    args = parser.parse_args()
+
+    if args.backend == 'fake':
+        backend = FakeBackend()
+    else:
+        backend = AdaptiveScheduler(GoogleBackend(language=args.language, endpoint=args.endpoint,
+                                                  pool_size=args.workers),
+                                    max_concurrency=args.workers, max_retries=1)
+    transcriber = LiveTranscriber(
+        open_input(args.input, args.rate, args.speed), backend, srt_path=args.srt, vtt_path=args.vtt,
+        max_workers=args.workers, max_utterance_ms=int(args.max_utterance * 1000), max_latency_s=args.max_latency,
+        on_cue=lambda cue: print(f"[{_cue_time(cue['start'], '.')} -> {_cue_time(cue['end'], '.')}] {cue['text']}"))
+    try:
+        stats = transcriber.run()
+    except KeyboardInterrupt:
+        transcriber.stop()
+        stats = transcriber.stats
+    print(stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,23 @@
-import subprocess
+import json
 import os
-import speech_recognition as sr
-from pydub import AudioSegment
-from pydub.utils import make_chunks
-from pydub.silence import split_on_silence
-import numpy as np
+import time
+import wave
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from cache import ChunkCache
+from cancel import Cancelled, check
+from metrics import RunMetrics, accepts_stats
+
+# numpy, speech_recognition, pydub and the modules built on them are imported
+# where they are first used, so importing main (e.g. from the GUI) stays fast
+RECOGNITION_RATE = 16000  # Same as preprocess.RECOGNITION_RATE, without importing it
+CANCEL_POLL_S = 0.1  # How often a cancellable run checks its token while waiting for requests
+
+
+def preload():
+    """Import everything a run needs up front, e.g. on a background thread"""
+    import speech_recognition  # noqa: F401
+    import audio_store, denoise, preprocess, recognition, vad  # noqa: F401
 
 
 def _ms_to_srt_time(ms):
@@ -15,277 +28,520 @@ def _ms_to_srt_time(ms):
     return f"{hours:02d}:{minutes:02d}:{seconds:02d},{ms:03d}"
 
 
+def _srt_entry(idx, subtitle):
+    """One numbered SRT cue for a segment"""
+    start = _ms_to_srt_time(subtitle['start'])
+    end = _ms_to_srt_time(subtitle['end'])
+    text = subtitle['text'].strip()
+    return (
+        f"{idx}\n"
+        f"{start} --> {end}\n"
+        f"{text}\n\n"
+    )
+
+
 class Transcribe:
-    def __init__(self, audio_path, text_path="transcript.txt", srt_path="subtitles.srt", progress_callback=None):
-        self.output_folder = "output"
+    def __init__(self, audio_path, text_path="transcript.txt", srt_path="subtitles.srt", progress_callback=None,
+                 backend=None, max_workers=4, in_memory=True, cache=None, output_dir="output", scratch_dir="chunks",
+                 metrics=None, report_path=None, prometheus_path=None, target_rate=RECOGNITION_RATE, flac=False,
+                 preprocess_workers=None, preprocess_ahead=None, store=None, chunking='pack', speech_gate=None,
+                 cancel=None, fingerprints=None):
+        self.output_folder = output_dir
+        self.scratch_folder = os.path.join(os.getcwd(), scratch_dir)  # Give concurrent instances their own
         self.audio_path = audio_path
         self.text_path = os.path.join(os.getcwd(),self.output_folder,text_path)
         self.srt_path = os.path.join(os.getcwd(),self.output_folder,srt_path)
-        self.chunks = []
+        self.audio_info = None  # ffprobe metadata of the source
+        self.store = store  # Decoded source audio, see audio_store.PCMStore; may be passed in pre-decoded (ingest.py)
+        self.chunks = []  # Chunk boundaries in milliseconds: {'start': ..., 'end': ...}
         self.subtitles = []  # Stores timing and text for SRT
+        # Called with the percentage, plus a stats dict (ETA, throughput) if it takes a second argument
         self.progress_callback = progress_callback
-        
+        self._progress_stats = progress_callback is not None and accepts_stats(progress_callback)
+        self.max_workers = max(1, max_workers)  # Maximum recognition requests in flight
+        # Retries, adaptive pacing and hedging around the speech API, within max_workers
+        self.owns_backend = backend is None  # Closed by cleanup(); a backend passed in may be shared
+        self.backend = backend or self._default_backend()
+        self.in_memory = in_memory  # Hand chunks to the recognizer from memory instead of WAV files
+        self.chunk_length_ms = 59000
+        self.chunking = chunking  # 'pack', 'silence' or 'fixed', see split_audio_file
+        self.chunk_stats = None  # Chunks per hour, padding ratio, ... of the last split
+        self.target_rate = target_rate  # Chunks are downmixed and resampled to this rate; None keeps the source rate
+        self.flac = flac  # FLAC-encode payloads during preprocessing instead of in the recognition threads
+        # Processes that downmix, resample and denoise chunks; 0 does it on this thread
+        if preprocess_workers is None:
+            from preprocess import default_preprocess_workers
+            preprocess_workers = default_preprocess_workers()
+        self.preprocess_workers = preprocess_workers
+        # Chunks prepared ahead of recognition at most, which bounds their shared memory
+        self.preprocess_ahead = preprocess_ahead or 2 * max(1, self.preprocess_workers)
+        # Keeps chunks without speech (silence, noise, music) from the recognizer; pass speech_gate=False to disable
+        if speech_gate is None:
+            from vad import SpeechGate
+            speech_gate = SpeechGate()
+        self.speech_gate = speech_gate
+        self.cache = ChunkCache() if cache is None else cache  # Pass cache=False to disable
+        # Reuses the transcripts of chunks heard before, in any file; pass fingerprints=False to disable
+        if fingerprints is None:
+            from fingerprint import FingerprintIndex
+            fingerprints = FingerprintIndex()
+        self.fingerprints = fingerprints
+        self.cancel = cancel  # cancel.CancelToken that stops the run, see run()
+        self.cache_key = None
+        self.metrics = metrics or RunMetrics()  # Stage timings, recognition latencies, memory
+        self.report_path = report_path  # Optional JSON run report, relative to the output folder
+        self.prometheus_path = prometheus_path  # Optional Prometheus text file, relative to the output folder
+
+    def _default_backend(self):
+        from recognition import AdaptiveScheduler, GoogleBackend
+        return AdaptiveScheduler(GoogleBackend(language='fa-IR', pool_size=self.max_workers),
+                                 max_concurrency=self.max_workers)
 
     def transcribe_persian_audio(self):
         """Main transcription function with duration handling"""
-        audio = AudioSegment.from_file(self.audio_path)
-        duration_seconds = len(audio) / 1000
+        for _ in self.iter_segments():
+            pass
+
+    def iter_segments(self):
+        """Transcribe the audio, yielding every finished segment in order
+
+        Segments are {'start': ms, 'end': ms, 'text': ...}, and are also
+        appended to self.subtitles. Call cleanup() when done; run() does.
+        """
+        from audio_store import probe_audio
+        from http_pool import connection_report
 
-        if duration_seconds > 60:
+        if self.metrics.started is None:
+            self.metrics.start()
+        connections = self.backend.connection_stats()  # The pool may be shared with earlier runs
+        # Duration comes from the container metadata; the audio is decoded at most once, on demand
+        with self.metrics.stage('probe'):
+            self.audio_info = probe_audio(self.audio_path)
+        check(self.cancel)
+        duration_seconds = self.audio_info['duration']
+        self.metrics.audio_duration = duration_seconds
+        mode = 'long' if duration_seconds > 60 else 'short'
+        if self.cache:
+            self.cache_key = self.cache.key(self.audio_path, {
+                'mode': mode,
+                'chunk_length_ms': self.chunk_length_ms,
+                'chunking': self.chunking,
+                'speech_gate': self.speech_gate.settings() if self.speech_gate else None,
+                # Transcripts borrowed from other recordings must not come back from the cache without it
+                'fingerprints': self.fingerprints.settings() if self.fingerprints else None,
+                'target_rate': self.target_rate,
+                'backend': self.backend.cache_id(),
+            })
+
+        if mode == 'long':
             print("File too long, splitting into chunks...")
-            self.transcribe_long_audio()
+            segments = self.transcribe_long_audio()
         else:
-            recognizer = sr.Recognizer()
-            with sr.AudioFile(self.audio_path) as source:
-                audio_data = recognizer.record(source)
-                text = recognizer.recognize_google(
-                    audio_data, language='fa-IR')
-                self.subtitles.append({
-                    'start': 0,
-                    'end': len(audio),
-                    'text': text
-                })
-                if self.progress_callback:
-                    self.progress_callback(100)
+            segments = self.transcribe_short_audio()
+        for segment in segments:
+            self.subtitles.append(segment)
+            yield segment
+        self.metrics.connections = connection_report(connections, self.backend.connection_stats())
+
+    def transcribe_short_audio(self):
+        """Recognize audio of up to 1 minute in one request, yielding its single segment"""
+        from preprocess import make_audio_data, payload_size, prepare_samples
+
+        text = self.cache.load_transcripts(self.cache_key).get(0) if self.cache_key else None
+        if text is None:
+            self.open_store()
+            with self.metrics.stage('preprocess'):
+                samples, frame_rate = prepare_samples(self.store.samples, self.store.frame_rate, self.target_rate,
+                                                      denoise=False, cancel=self.cancel)
+            with self.metrics.stage('export'):
+                audio_data = make_audio_data(samples, frame_rate, self.flac)
+            self.metrics.record_payload(self.store.samples.nbytes, payload_size(audio_data), len(samples) / frame_rate)
+            text = self._recognize(audio_data)
+            if self.cache_key:
+                self.cache.add_transcript(self.cache_key, 0, text)
+        end = round(self.audio_info['duration'] * 1000)
+        self.metrics.chunks = 1
+        self._report_progress(1, 1, end)
+        yield {'start': 0, 'end': end, 'text': text}
+
+    def open_store(self):
+        """Decode the source into self.store unless that already happened"""
+        if self.store is None:
+            from audio_store import PCMStore
+            with self.metrics.stage('decode'):
+                self.store = PCMStore(self.audio_path, scratch_dir=self.scratch_folder, info=self.audio_info,
+                                      cancel=self.cancel)
+        return self.store
+
+    def _recognize(self, audio_data):
+        """Recognize one chunk with the backend, recording its latency and size"""
+        from preprocess import payload_size
+
+        check(self.cancel)  # Started after the run was cancelled
+        start = time.perf_counter()
+        ok = False
+        try:
+            text = self.backend.recognize(audio_data, cancel=self.cancel)
+            ok = True
+            return text
+        finally:
+            self.metrics.record_request(time.perf_counter() - start, payload_size(audio_data), ok)
+
+    def _report_progress(self, done_chunks, total_chunks, done_audio_ms):
+        """Send the percentage (and ETA/throughput stats, if wanted) to the progress callback"""
+        if not self.progress_callback:
+            return
+        stats = self.metrics.progress(done_chunks, total_chunks, done_audio_ms / 1000, self.audio_info['duration'])
+        if self._progress_stats:
+            self.progress_callback(stats['percent'], stats)
+        else:
+            self.progress_callback(stats['percent'])
 
     def transcribe_long_audio(self):
-        """Handle audio files longer than 1 minute with noise reduction and silence detection"""
-        recognizer = sr.Recognizer()
-        
-        # Adjust silence threshold and minimum silence length
-        recognizer.energy_threshold = 300  # Increase threshold to better detect silence
-        recognizer.dynamic_energy_threshold = True
-        recognizer.pause_threshold = 0.8  # Adjust pause detection threshold
-        
-        self.chunks = self.split_audio_file()
-        start_time = 0  # Track cumulative start time in milliseconds
-        total_chunks = len(self.chunks)
+        """Handle audio files longer than 1 minute with noise reduction and silence detection
 
-        for i, chunk in enumerate(self.chunks):
-            chunk_duration = len(chunk)
-            end_time = start_time + chunk_duration
-            chunk_file = f"chunks/chunk_{i}.wav"
+        A generator: segments are yielded in order as soon as every earlier chunk is done.
+        Chunks the speech gate finds no speech in are not sent and yield no segment.
+        Chunks whose fingerprint matches a chunk recognized before reuse its transcript.
+        """
+        import speech_recognition as sr
+        from preprocess import make_audio_data, payload_size
 
-            # Create chunks directory if not exists
-            os.makedirs(os.path.dirname(chunk_file), exist_ok=True)
+        # Reuse the boundaries and transcripts of an earlier run over the same audio
+        self.chunks = self.cache.load_boundaries(self.cache_key) if self.cache_key else None
+        if self.chunks is None:
+            self.open_store()
+            with self.metrics.stage('split'):
+                self.chunks = self.split_audio_file(self.chunk_length_ms)
+            if self.cache_key:
+                self.cache.save_boundaries(self.cache_key, self.chunks)
+        results = self.cache.load_transcripts(self.cache_key) if self.cache_key else {}
+        if results:
+            print(f"Reusing {len(results)} of {len(self.chunks)} chunk transcripts from the cache")
+        total_chunks = len(self.chunks)
+        self.metrics.chunks = total_chunks
 
-            # Apply noise reduction to the chunk
-            chunk = self.reduce_noise(chunk)
-            chunk.export(chunk_file, format="wav")
+        # results: chunk index -> transcribed text, until it can be appended in order
+        pending = {}  # future -> chunk index
+        prints = {}  # chunk index -> fingerprint, stored with the transcript once it is recognized
+        if self.fingerprints:
+            from fingerprint import FINGERPRINT_VERSION, fingerprint
+            # Transcripts are only reused under the recognizer and sample rate that made them
+            scope = json.dumps({'version': FINGERPRINT_VERSION, 'backend': self.backend.cache_id(),
+                                'target_rate': self.target_rate}, sort_keys=True)
+        next_index = 0
+        finished = len(results)
+        finished_ms = sum(self.chunks[i]['end'] - self.chunks[i]['start'] for i in results)
+        self.metrics.begin_progress(finished, finished_ms / 1000)
 
-            with sr.AudioFile(chunk_file) as source:
-                # Adjust for ambient noise
-                recognizer.adjust_for_ambient_noise(source, duration=0.5)
-                audio_data = recognizer.record(source)
-                try:
-                    text = recognizer.recognize_google(
-                        audio_data, language='fa-IR')
-                    self.subtitles.append({
-                        'start': start_time,
-                        'end': end_time,
+        def finish(i, text, keep=True):
+            """Record a chunk's text, in the cache too unless keep is False"""
+            nonlocal finished, finished_ms
+            finished += 1
+            finished_ms += self.chunks[i]['end'] - self.chunks[i]['start']
+            results[i] = text
+            if keep and self.cache_key:
+                self.cache.add_transcript(self.cache_key, i, text)
+
+        def release():
+            """Return the segments that are now contiguous with what was already yielded, in order"""
+            nonlocal next_index
+            ready = []
+            while next_index in results:
+                text = results.pop(next_index)
+                if text:  # Empty for chunks without speech
+                    ready.append({
+                        'start': self.chunks[next_index]['start'],
+                        'end': self.chunks[next_index]['end'],
                         'text': text
                     })
-                except Exception as e:
-                    print(f"[Error in chunk {i}: {str(e)}]")
-                    self.subtitles.append({
-                        'start': start_time,
-                        'end': end_time,
-                        'text': f"[Unable to transcribe chunk {i}]"
-                    })
+                next_index += 1
 
-            start_time = end_time  # Update for next chunk
-            
             # Calculate and report progress
-            if self.progress_callback:
-                progress = int((i + 1) / total_chunks * 100)
-                self.progress_callback(progress)
+            self._report_progress(finished, total_chunks, finished_ms)
+            return ready
+
+        def collect():
+            """Wait for at least one request; return the segments that are now ready, in order"""
+            done = set()
+            while pending and not done:
+                check(self.cancel)
+                done, _ = wait(pending, timeout=CANCEL_POLL_S if self.cancel else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = pending.pop(future)
+                words = prints.pop(i, None)
+                try:
+                    text = future.result()
+                except Cancelled:
+                    raise
+                except Exception as e:
+                    print(f"[Error in chunk {i}: {str(e)}]")
+                    finish(i, f"[Unable to transcribe chunk {i}]", keep=False)
+                    continue
+                finish(i, text)
+                if words is not None:
+                    try:
+                        self.fingerprints.add(scope, words, text)
+                    except Exception as e:  # The transcript is fine, it just will not be reused
+                        print(f"[Error in chunk {i}: {str(e)}]")
+            return release()
 
-    def reduce_noise(self, audio_chunk):
-        """Apply gentle noise reduction to an audio chunk"""
+        # Chunks recognized by an earlier run are skipped
+        todo = [i for i in range(total_chunks) if i not in results]
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
         try:
-            # Convert to numpy array
-            samples = np.array(audio_chunk.get_array_of_samples())
-            
-            # Normalize the audio
-            samples = samples / np.max(np.abs(samples))
-            
-            # First pass: Gentle noise gate
-            noise_gate_threshold = 0.01  # Reduced threshold
-            samples = np.where(np.abs(samples) < noise_gate_threshold, samples * 0.5, samples)  # Reduce instead of zeroing
-            
-            # Second pass: Light spectral noise reduction
-            # Convert to frequency domain
-            fft_data = np.fft.rfft(samples)
-            freqs = np.fft.rfftfreq(len(samples), 1/audio_chunk.frame_rate)
-            
-            # Apply gentler frequency-based noise reduction
-            noise_floor_db = -40  # Less aggressive noise floor
-            noise_floor_linear = 10 ** (noise_floor_db / 20)
-            
-            # Reduce noise in frequency domain more gently
-            fft_data[np.abs(fft_data) < noise_floor_linear] *= 0.5  # Reduce by 50% instead of 90%
-            
-            # Convert back to time domain
-            samples = np.fft.irfft(fft_data)
-            
-            # Third pass: Very gentle dynamic noise reduction
-            window_size = 2048  # Larger window for smoother processing
-            noise_floor = np.array([
-                np.mean(np.abs(samples[i:i+window_size]))
-                for i in range(0, len(samples)-window_size, window_size//2)
-            ])
-            
-            # Apply gentler dynamic threshold
-            for i in range(0, len(samples)-window_size, window_size//2):
-                local_noise_floor = np.mean(noise_floor[max(0, i//(window_size//2)-2):i//(window_size//2)+2])
-                threshold = local_noise_floor * 1.5  # Reduced multiplier
-                samples[i:i+window_size] = np.where(
-                    np.abs(samples[i:i+window_size]) < threshold,
-                    samples[i:i+window_size] * 0.7,  # Reduce by 30% instead of 90%
-                    samples[i:i+window_size]
-                )
-            
-            # Final pass: Very light smoothing
-            window = np.ones(3) / 3  # Smaller window for less smoothing
-            samples = np.convolve(samples, window, mode='same')
-            
-            # Normalize again after processing
-            samples = samples / np.max(np.abs(samples))
-            
-            # Convert back to original scale and ensure values are within int16 range
-            max_int16 = np.iinfo(np.int16).max
-            min_int16 = np.iinfo(np.int16).min
-            samples = samples * max_int16
-            samples = np.clip(samples, min_int16, max_int16)
-            
-            # Convert back to audio segment
-            return AudioSegment(
-                samples.astype(np.int16).tobytes(),
-                frame_rate=audio_chunk.frame_rate,
-                sample_width=audio_chunk.sample_width,
-                channels=audio_chunk.channels
-            )
-        except Exception as e:
-            print(f"Error in noise reduction: {str(e)}")
-            return audio_chunk  # Return original chunk if noise reduction fails
+            for i, view, samples, frame_rate in self._prepared_chunks(todo):
+                if self.speech_gate:
+                    with self.metrics.stage('speech_gate'):
+                        speech = self.speech_gate.is_speech(self.speech_gate.features(samples, frame_rate))
+                    if not speech:
+                        self.metrics.record_skip(len(samples) / frame_rate)
+                        finish(i, '')
+                        yield from release()
+                        continue
+                if self.fingerprints:
+                    with self.metrics.stage('fingerprint'):
+                        words = fingerprint(samples, frame_rate)
+                        try:
+                            match = self.fingerprints.lookup(scope, words)
+                        except Exception as e:
+                            print(f"[Error in chunk {i}: {str(e)}]")
+                            match = None
+                    self.metrics.record_dedup(len(samples) / frame_rate, match is not None)
+                    if match:
+                        finish(i, match['text'])
+                        yield from release()
+                        continue
+                    prints[i] = words
+                with self.metrics.stage('export'):
+                    if self.in_memory:
+                        audio_data = make_audio_data(samples, frame_rate, self.flac)
+                    else:
+                        chunk_file = os.path.join(self.scratch_folder, f"chunk_{i}.wav")
+
+                        # Create chunks directory if not exists
+                        os.makedirs(os.path.dirname(chunk_file), exist_ok=True)
+                        with wave.open(chunk_file, 'wb') as wav_file:
+                            wav_file.setnchannels(1)
+                            wav_file.setsampwidth(self.store.sample_width)
+                            wav_file.setframerate(frame_rate)
+                            wav_file.writeframes(samples.tobytes())
+
+                        with sr.AudioFile(chunk_file) as source:
+                            audio_data = sr.Recognizer().record(source)
+                self.metrics.record_payload(view.nbytes, payload_size(audio_data), len(samples) / frame_rate)
+
+                # Wait for a free slot so at most max_workers requests are in flight
+                if len(pending) >= self.max_workers:
+                    yield from collect()
+                pending[executor.submit(self._recognize, audio_data)] = i
+
+            while pending or next_index in results:
+                yield from collect()
+        finally:
+            # A cancelled (or failed) run does not wait for the requests in flight; their results are dropped
+            executor.shutdown(wait=False, cancel_futures=True)
+        if self.metrics.skipped_chunks:
+            print(f"Skipped {self.metrics.skipped_chunks} chunks without speech "
+                  f"({self.metrics.skipped_audio_s:.1f} s of audio)")
+        if self.metrics.dedup_hits:
+            print(f"Reused the transcripts of {self.metrics.dedup_hits} chunks heard before "
+                  f"({self.metrics.dedup_audio_s:.1f} s of audio)")
+
+    def _prepared_chunks(self, indices):
+        """Yield (index, source view, samples, frame_rate) for the given chunks, in order
+
+        Chunks are downmixed, resampled and denoised; speech recognition expects
+        mono 16-bit PCM. With preprocess_workers this happens in a process pool,
+        up to preprocess_ahead chunks ahead of the one being yielded, so it
+        overlaps recognition of earlier chunks. The 'preprocess' stage then
+        times how long the loop waited for a chunk, not the workers' CPU time.
+        """
+        from preprocess import PreprocessPool, prepare_samples
+
+        if not indices:
+            return  # Everything came from the cache: the source is not decoded at all
+        store = self.open_store()
+        if not self.preprocess_workers or len(indices) < 2:
+            for i in indices:
+                check(self.cancel)
+                view = store.view(self.chunks[i]['start'], self.chunks[i]['end'])
+                with self.metrics.stage('preprocess'):
+                    samples, frame_rate = prepare_samples(view, store.frame_rate, self.target_rate,
+                                                          cancel=self.cancel)
+                yield i, view, samples, frame_rate
+            return
+
+        longest = max(store.frame_at(self.chunks[i]['end']) - store.frame_at(self.chunks[i]['start'])
+                      for i in indices)
+        in_flight = deque()  # (index, view, handle), in chunk order
+        upcoming = deque(indices)
+        with PreprocessPool(min(self.preprocess_workers, len(indices)), min(self.preprocess_ahead, len(indices)),
+                            longest, store.channels) as pool:
+
+            def fill():
+                while pool.free_slots and upcoming:
+                    i = upcoming.popleft()
+                    view = store.view(self.chunks[i]['start'], self.chunks[i]['end'])
+                    in_flight.append((i, view, pool.submit(view, store.frame_rate, self.target_rate)))
+
+            fill()
+            while in_flight:
+                check(self.cancel)  # Closing the pool then waits for the chunks being prepared
+                i, view, handle = in_flight.popleft()
+                with self.metrics.stage('preprocess'):
+                    samples, frame_rate = pool.result(handle)
+                fill()  # Keep the workers busy while this chunk is being recognized
+                yield i, view, samples, frame_rate
 
     def split_audio_file(self, chunk_length_ms=59000):  # 59 seconds in milliseconds
-        """Try silence-based chunking first, fall back to fixed-length chunks if needed"""
-        audio = AudioSegment.from_file(self.audio_path)
+        """Split the audio into chunks with the strategy in self.chunking
+
+        'pack' packs the detected speech into as few chunks of up to
+        chunk_length_ms as possible, cutting only in silences (see
+        vad.pack_ranges). 'silence' makes every silence-split fragment a chunk,
+        and 'fixed' cuts every chunk_length_ms. Both silence strategies fall
+        back to fixed-length chunks when they find too little.
+
+        Returns chunk boundaries in milliseconds; the audio itself stays in
+        self.store. self.chunk_stats records how well they fit the speech.
+        """
+        from vad import EnergyEnvelope, chunk_stats, keep_silence_ranges
+
+        length_ms = self.open_store().duration_ms
+        check(self.cancel)
         
         # Calculate expected number of chunks for fixed-length approach
-        expected_chunks = len(audio) // chunk_length_ms + (1 if len(audio) % chunk_length_ms > 0 else 0)
-        
-        # Check if we already have the correct number of chunks
-        existing_chunks = len([f for f in os.listdir("chunks") if f.startswith("chunk_") and f.endswith(".wav")])
-        
-        if existing_chunks >= expected_chunks:
-            print(f"Found {existing_chunks} existing chunks, reusing them...")
-            # Load existing chunks
-            chunks = []
-            for i in range(existing_chunks):
-                chunk_path = f"chunks/chunk_{i}.wav"
-                if os.path.exists(chunk_path):
-                    chunks.append(AudioSegment.from_wav(chunk_path))
-            return chunks
-        
-        print("Attempting silence-based chunking...")
-        # Try silence-based chunking first
+        expected_chunks = length_ms // chunk_length_ms + (1 if length_ms % chunk_length_ms > 0 else 0)
+
+        ranges = None
+        speech = None
         try:
+            # One pass over the audio; every setting below is evaluated from this envelope
+            envelope = EnergyEnvelope(self.store.samples, self.store.frame_rate)
+            speech = envelope.detect_nonsilent(min_silence_len=300, silence_thresh=envelope.dBFS - 10)
+        except Exception as e:
+            print(f"Silence detection failed: {str(e)}, falling back to fixed-length chunks")
+
+        if speech is not None and self.chunking == 'pack':
+            print("Packing speech into chunks...")
+            ranges = envelope.pack(keep_silence_ranges(speech, 200, length_ms), chunk_length_ms)
+            if ranges:
+                print(f"Packed the speech into {len(ranges)} chunks of up to {chunk_length_ms / 1000:g} s")
+            else:
+                print("No speech detected, falling back to fixed-length chunks")
+                ranges = None
+        elif speech is not None and self.chunking == 'silence':
+            print("Attempting silence-based chunking...")
             # More sensitive silence detection parameters
-            chunks = split_on_silence(
-                audio,
+            ranges = envelope.split_on_silence(
                 min_silence_len=300,        # Reduced from 500ms to 300ms
-                silence_thresh=audio.dBFS - 10,  # More sensitive threshold
-                keep_silence=200,           # Keep less silence at edges
-                seek_step=1                 # More precise seeking
+                silence_thresh=envelope.dBFS - 10,  # More sensitive threshold
+                keep_silence=200            # Keep less silence at edges
             )
             
             # If we got too few chunks, try with even more sensitive parameters
-            if len(chunks) < expected_chunks * 0.3:  # If we got less than 30% of expected chunks
+            if len(ranges) < expected_chunks * 0.3:  # If we got less than 30% of expected chunks
                 print("First attempt created too few chunks, trying with more sensitive parameters...")
-                chunks = split_on_silence(
-                    audio,
+                ranges = envelope.split_on_silence(
                     min_silence_len=200,        # Even shorter silence detection
-                    silence_thresh=audio.dBFS - 5,  # Even more sensitive threshold
-                    keep_silence=100,           # Keep minimal silence
-                    seek_step=1                 # More precise seeking
+                    silence_thresh=envelope.dBFS - 5,  # Even more sensitive threshold
+                    keep_silence=100            # Keep minimal silence
                 )
             
             # Verify if we got a reasonable number of chunks
-            if len(chunks) >= expected_chunks * 0.3:  # If we got at least 30% of expected chunks
-                print(f"Successfully created {len(chunks)} chunks using silence detection")
-                # Save chunks to files
-                os.makedirs("chunks", exist_ok=True)
-                for i, chunk in enumerate(chunks):
-                    chunk_path = f"chunks/chunk_{i}.wav"
-                    chunk.export(chunk_path, format="wav")
-                return chunks
+            if len(ranges) >= expected_chunks * 0.3:  # If we got at least 30% of expected chunks
+                print(f"Successfully created {len(ranges)} chunks using silence detection")
             else:
-                print(f"Silence detection created only {len(chunks)} chunks, falling back to fixed-length chunks")
-        except Exception as e:
-            print(f"Silence detection failed: {str(e)}, falling back to fixed-length chunks")
-        
-        # Fall back to fixed-length chunks
-        print(f"Creating {expected_chunks} fixed-length chunks...")
-        os.makedirs("chunks", exist_ok=True)
-        chunks = make_chunks(audio, chunk_length_ms)
-        
-        # Save chunks to files
-        for i, chunk in enumerate(chunks):
-            chunk_path = f"chunks/chunk_{i}.wav"
-            chunk.export(chunk_path, format="wav")
-        
-        return chunks
+                print(f"Silence detection created only {len(ranges)} chunks, falling back to fixed-length chunks")
+                ranges = None
+
+        if ranges is None:
+            print(f"Creating {expected_chunks} fixed-length chunks...")
+            ranges = [(start, min(start + chunk_length_ms, length_ms)) for start in range(0, length_ms, chunk_length_ms)]
+        if speech is not None:
+            self.chunk_stats = chunk_stats(ranges, speech, length_ms)
+            self.metrics.chunking = self.chunk_stats
+        return [{'start': start, 'end': end} for start, end in ranges]
 
     def generate_srt(self):
         """Generate SRT subtitle file from transcribed segments"""
         with open(self.srt_path, 'w', encoding='utf-8') as srt_file:
             for idx, subtitle in enumerate(self.subtitles, 1):
-                start = _ms_to_srt_time(subtitle['start'])
-                end = _ms_to_srt_time(subtitle['end'])
-                text = subtitle['text'].strip()
-
-                srt_entry = (
-                    f"{idx}\n"
-                    f"{start} --> {end}\n"
-                    f"{text}\n\n"
-                )
-                srt_file.write(srt_entry)
+                srt_file.write(_srt_entry(idx, subtitle))
 
     def cleanup(self):
         """Clean up temporary chunk files"""
-        for i in range(len(self.chunks)):
-            file_path = f"chunks/chunk_{i}.wav"
+        if self.store:
+            self.store.close()
+        if self.fingerprints:
+            self.fingerprints.close()  # Reopened on the next lookup
+        if self.owns_backend:
+            self.backend.close()  # Drops retries and hedges of a cancelled run; restarted on the next request
+        for i in range(len(self.chunks or [])):  # None when the run stopped before the split
+            file_path = os.path.join(self.scratch_folder, f"chunk_{i}.wav")
             if os.path.isfile(file_path):
                 os.remove(file_path)
-        if os.path.exists("chunks") and not os.listdir("chunks"):
-            os.rmdir("chunks")
-        pass
+        if os.path.exists(self.scratch_folder) and not os.listdir(self.scratch_folder):
+            os.rmdir(self.scratch_folder)
      
     def check_folders(self):
-        folders = ['chunks','output']
+        folders = [self.scratch_folder, self.output_folder]
         for folder in folders:
             path = os.path.join(os.getcwd(),folder)
             if not os.path.isdir(path):
                 os.makedirs(path,exist_ok=True)
                 
-    def run(self):
-        """Main execution method"""
+    def run(self, on_segment=None):
+        """Main execution method
+
+        The TXT and SRT files grow as segments finish, so an interrupted run
+        leaves everything transcribed so far on disk. on_segment, if given, is
+        called with every segment as it is written.
+
+        Cancelling self.cancel stops the run within about one chunk's
+        preprocessing and raises cancel.Cancelled. Requests in flight are
+        not waited for, retried or hedged; finished chunks stay in the
+        TXT/SRT files and the cache, so a later run resumes after them.
+        Scratch files are removed however the run ends.
+        """
+        self.metrics.start()
         self.check_folders()
-        self.transcribe_persian_audio()
 
-        # Save raw text transcript
-        with open(self.text_path, 'w', encoding='utf-8') as txt_file:
-            for segment in self.subtitles:
-                txt_file.write(segment['text'] + '\n')
-        self.save_transcript_to_txt()
-        # Generate SRT subtitles
-        self.generate_srt()
-        self.cleanup()
+        segments = self.iter_segments()
+        try:
+            with open(self.text_path, 'w', encoding='utf-8') as txt_file, \
+                    open(self.srt_path, 'w', encoding='utf-8') as srt_file:
+                for segment in segments:
+                    with self.metrics.stage('write'):
+                        txt_file.write(segment['text'] + '\n')
+                        srt_file.write(_srt_entry(len(self.subtitles), segment))
+                        txt_file.flush()
+                        srt_file.flush()
+                    if on_segment:
+                        on_segment(segment)
+        except Cancelled:
+            print(f"Transcription cancelled; {len(self.subtitles)} segments kept in {self.text_path}")
+            raise
+        finally:
+            segments.close()  # Stops the recognition and preprocessing pools before the store is closed
+            with self.metrics.stage('cleanup'):
+                self.cleanup()
+                if self.cache:
+                    self.cache.evict()
+        self.metrics.finish()
+        self.save_reports()
         print(f"Transcription complete! Text saved to {self.text_path}")
         print(f"Subtitles saved to {self.srt_path}")
 
+    def save_reports(self):
+        """Write the JSON run report and Prometheus text file, if paths were given"""
+        if self.report_path:
+            self.metrics.save_json(os.path.join(os.getcwd(), self.output_folder, self.report_path))
+        if self.prometheus_path:
+            self.metrics.save_prometheus(os.path.join(os.getcwd(), self.output_folder, self.prometheus_path),
+                                         {'file': os.path.basename(self.audio_path)})
+
     def save_transcript_to_txt(self):
         """Save all transcribed text to a .txt file"""
         with open(self.text_path, 'w', encoding='utf-8') as txt_file:
@@ -1,82 +1,305 @@
 import os
 import subprocess
-import json
 import shutil
 import tempfile
 import locale
+import math
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def create_video_with_subtitles(audio_path, srt_path, output_path, width=1920, height=1080):
+from audio_store import probe_audio
+from cancel import Cancelled, check
+from metrics import RunMetrics
+
+SUBTITLE_STYLE = 'FontName=Arial,FontSize=24,PrimaryColour=&HFFFFFF,OutlineColour=&H000000,Outline=2,BorderStyle=3,Alignment=2'
+# Audio codecs MP4 can carry as-is; anything else is re-encoded to AAC
+MP4_AUDIO_CODECS = ('aac', 'mp3', 'alac')
+STILL_FPS = 5  # Frames per second of the still background; cue changes land within 1/STILL_FPS s
+MIN_SEGMENT_S = 60  # Shortest segment worth its own ffmpeg process in the parallel mode
+_SRT_TIME = re.compile(r'(\d+):(\d+):(\d+)[,.](\d+)')
+
+
+def _subtitles_filter(srt_path):
+    """subtitles filter burning an SRT file in with the house style"""
+    # Escape special characters in the SRT path for FFmpeg
+    escaped_srt_path = srt_path.replace('\\', '\\\\').replace(':', '\\:')
+    return f"subtitles={escaped_srt_path}:force_style='{SUBTITLE_STYLE}'"
+
+
+def _audio_args(audio_info):
+    """Stream-copy the audio when MP4 can hold its codec, otherwise encode AAC"""
+    if audio_info.get('codec_name') in MP4_AUDIO_CODECS:
+        return ['-c:a', 'copy']
+    return ['-c:a', 'aac', '-b:a', '192k']
+
+
+def _still_video_args(fps):
+    """x264 settings for a static background: few frames, still-image tuning"""
+    return [
+        '-c:v', 'libx264',
+        '-preset', 'veryfast',
+        '-tune', 'stillimage',
+        '-crf', '23',
+        '-pix_fmt', 'yuv420p',
+        '-r', str(fps),
+    ]
+
+
+def _parse_srt_time(text):
+    hours, minutes, seconds, ms = (int(part) for part in _SRT_TIME.match(text.strip()).groups())
+    return ((hours * 60 + minutes) * 60 + seconds) * 1000 + ms
+
+
+def _format_srt_time(ms):
+    seconds, ms = divmod(ms, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{ms:03d}"
+
+
+def read_srt(srt_path):
+    """Cues of an SRT file as [{'start': ms, 'end': ms, 'text': ...}]"""
+    with open(srt_path, 'r', encoding='utf-8-sig') as f:
+        blocks = re.split(r'\n\s*\n', f.read().replace('\r\n', '\n').strip())
+    cues = []
+    for block in blocks:
+        lines = block.split('\n')
+        timing = next((i for i, line in enumerate(lines) if '-->' in line), None)
+        if timing is None:
+            continue
+        start, end = lines[timing].split('-->')
+        cues.append({'start': _parse_srt_time(start), 'end': _parse_srt_time(end),
+                     'text': '\n'.join(lines[timing + 1:])})
+    return cues
+
+
+def write_srt(cues, srt_path):
+    with open(srt_path, 'w', encoding='utf-8') as f:
+        for i, cue in enumerate(cues, 1):
+            f.write(f"{i}\n{_format_srt_time(cue['start'])} --> {_format_srt_time(cue['end'])}\n{cue['text']}\n\n")
+
+
+def _segment_frames(cues, total_frames, fps, segments):
+    """Split [0, total_frames) into at most segments frame ranges cut at cue boundaries
+
+    Every cut is the cue start or end nearest to an even split, rounded to the
+    frame grid, so each segment starts on a frame the single-pass render would
+    also produce.
+    """
+    edges = sorted({round(ms * fps / 1000) for cue in cues for ms in (cue['start'], cue['end'])})
+    edges = [edge for edge in edges if 0 < edge < total_frames]
+    cuts = []
+    for i in range(1, segments):
+        target = total_frames * i // segments
+        if edges:
+            target = min(edges, key=lambda edge: abs(edge - target))
+        if (not cuts or target > cuts[-1]) and 0 < target < total_frames:
+            cuts.append(target)
+    bounds = [0] + cuts + [total_frames]
+    return list(zip(bounds, bounds[1:]))
+
+
+def _shift_cues(cues, start_ms, end_ms):
+    """Cues overlapping [start_ms, end_ms), clipped to it and moved to start at zero"""
+    shifted = []
+    for cue in cues:
+        if cue['end'] <= start_ms or cue['start'] >= end_ms:
+            continue
+        shifted.append({
+            'start': max(cue['start'], start_ms) - start_ms,
+            'end': min(cue['end'], end_ms) - start_ms,
+            'text': cue['text'],
+        })
+    return shifted
+
+
+def _run_ffmpeg(cmd, what, cancel=None):
+    """Run one ffmpeg command; with a cancel.CancelToken, cancelling it kills ffmpeg and raises Cancelled"""
+    try:
+        # Use UTF-8 encoding for FFmpeg output
+        if cancel:
+            result = cancel.run(cmd, text=True, encoding='utf-8')
+        else:
+            result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8')
+        result.check_returncode()
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"Failed to create {what}: {e.stderr}")
+
+
+def create_video_with_subtitles(audio_path, srt_path, output_path, width=1920, height=1080, mode='fast',
+                                fps=STILL_FPS, segments=None, progress_callback=None, metrics=None, cancel=None):
     """
     Create a video with black background, audio, and subtitles using FFmpeg.
-    
+
+    Modes:
+        fast: one ffmpeg pass, the color source feeds the subtitles filter directly
+            at a low frame rate; audio is stream-copied when MP4 allows it.
+        soft: no burn-in; the still background is muxed with the SRT as a
+            mov_text track that players can toggle.
+        parallel: the fast render split at cue boundaries into segments that
+            separate ffmpeg processes burn in concurrently, joined losslessly
+            with the concat demuxer; the audio is muxed once over the result.
+        legacy: the original two full-rate encodes (background, then burn-in with AAC audio).
+
     Args:
-        audio_path (str): Path to the MP3 audio file
+        audio_path (str): Path to the audio file
         srt_path (str): Path to the SRT subtitle file
         output_path (str): Path where the output video will be saved
         width (int): Video width in pixels
         height (int): Video height in pixels
+        mode (str): 'fast', 'soft', 'parallel' or 'legacy'
+        fps (int): Frame rate of the background in the fast, soft and parallel modes
+        segments (int): Segments rendered at once in the parallel mode
+            (default: one per CPU, each at least MIN_SEGMENT_S long)
+        progress_callback (callable): Called with 0-100 as parallel segments complete
+        metrics (RunMetrics): Records video_probe, video_render and video_mux stage timings
+        cancel (cancel.CancelToken): Cancelling it kills the ffmpeg processes, deletes the
+            partial output and raises cancel.Cancelled
     """
+    if mode not in ('fast', 'soft', 'parallel', 'legacy'):
+        raise ValueError(f"Unknown video mode: {mode}")
+    metrics = metrics or RunMetrics()
+    try:
+        with metrics.stage('video_probe'):
+            audio_info = probe_audio(audio_path)
+    except Exception as e:
+        raise Exception(f"Failed to get audio duration: {str(e)}")
+
+    try:
+        _render(audio_path, srt_path, output_path, width, height, mode, fps, segments, progress_callback, metrics,
+                cancel, audio_info)
+    except Cancelled:
+        if os.path.isfile(output_path):
+            os.remove(output_path)
+        raise
+
+
+def _render(audio_path, srt_path, output_path, width, height, mode, fps, segments, progress_callback, metrics,
+            cancel, audio_info):
+    """The rendering part of create_video_with_subtitles, in a scratch directory"""
+    duration = audio_info['duration']
+    check(cancel)
+
     # Create temporary directory for working files
     with tempfile.TemporaryDirectory() as temp_dir:
-        # Create temporary files with ASCII names
-        temp_video = os.path.join(temp_dir, 'temp_black.mp4')
-        temp_srt = os.path.join(temp_dir, 'temp_subtitles.srt')
-        
         # Copy SRT file to temporary location with ASCII name
+        temp_srt = os.path.join(temp_dir, 'temp_subtitles.srt')
         shutil.copy2(srt_path, temp_srt)
-        
-        # Get audio duration using FFmpeg
-        duration_cmd = [
-            'ffprobe', 
-            '-v', 'error',
-            '-show_entries', 'format=duration',
-            '-of', 'json',
-            audio_path
+
+        if mode == 'legacy':
+            with metrics.stage('video_render'):
+                _create_video_two_pass(audio_path, temp_srt, output_path, width, height, duration, temp_dir, cancel)
+            return
+        if mode == 'parallel':
+            _create_video_parallel(audio_path, temp_srt, output_path, width, height, audio_info, fps, segments,
+                                   progress_callback, temp_dir, metrics, cancel)
+            return
+
+        cmd = [
+            'ffmpeg', '-y',
+            '-f', 'lavfi',
+            '-i', f'color=c=black:s={width}x{height}:r={fps}:d={duration}',
+            '-i', audio_path,
         ]
-        
-        try:
-            # Use UTF-8 encoding for FFmpeg output
-            result = subprocess.run(duration_cmd, capture_output=True, text=True, encoding='utf-8')
-            result.check_returncode()
-            duration = float(json.loads(result.stdout)['format']['duration'])
-        except Exception as e:
-            raise Exception(f"Failed to get audio duration: {str(e)}")
-        
-        # Create black background video
-        try:
-            result = subprocess.run([
-                'ffmpeg', '-y',
-                '-f', 'lavfi',
-                '-i', f'color=c=black:s={width}x{height}:d={duration}',
-                '-c:v', 'libx264',
-                '-preset', 'medium',
-                '-crf', '23',
-                temp_video
-            ], capture_output=True, text=True, encoding='utf-8')
-            result.check_returncode()
-        except subprocess.CalledProcessError as e:
-            raise Exception(f"Failed to create background video: {e.stderr}")
-        
-        # Create the final video with audio and subtitles
-        try:
-            # Escape special characters in the SRT path for FFmpeg
-            escaped_srt_path = temp_srt.replace('\\', '\\\\').replace(':', '\\:')
-            
-            # Use UTF-8 encoding for FFmpeg output
-            result = subprocess.run([
-                'ffmpeg', '-y',
-                '-i', temp_video,
-                '-i', audio_path,
-                '-vf', f'subtitles={escaped_srt_path}:force_style=\'FontName=Arial,FontSize=24,PrimaryColour=&HFFFFFF,OutlineColour=&H000000,Outline=2,BorderStyle=3,Alignment=2\'',
-                '-c:v', 'libx264',
-                '-c:a', 'aac',
-                '-b:a', '192k',
-                '-shortest',
-                output_path
-            ], capture_output=True, text=True, encoding='utf-8')
-            result.check_returncode()
-        except subprocess.CalledProcessError as e:
-            raise Exception(f"Failed to create final video: {e.stderr}")
+        if mode == 'soft':
+            cmd += ['-i', temp_srt, '-map', '0:v', '-map', '1:a:0', '-map', '2:s', '-c:s', 'mov_text']
+        else:
+            cmd += ['-map', '0:v', '-map', '1:a:0', '-vf', _subtitles_filter(temp_srt)]
+        cmd += _still_video_args(fps) + _audio_args(audio_info)
+        cmd += ['-t', str(duration), '-movflags', '+faststart', output_path]
+        with metrics.stage('video_render'):
+            _run_ffmpeg(cmd, "video", cancel)
+
+
+def _render_segment(segment_srt, segment_path, width, height, fps, frames, threads, cancel=None):
+    """Burn one segment's cues into a silent still-background video of exactly frames frames"""
+    _run_ffmpeg([
+        'ffmpeg', '-y',
+        '-f', 'lavfi',
+        '-i', f'color=c=black:s={width}x{height}:r={fps}',
+        '-vf', _subtitles_filter(segment_srt),
+        '-frames:v', str(frames),
+        '-threads', str(threads),
+        '-an',
+    ] + _still_video_args(fps) + [segment_path], f"video segment {os.path.basename(segment_path)}", cancel)
+
+
+def _create_video_parallel(audio_path, srt_path, output_path, width, height, audio_info, fps, segments,
+                           progress_callback, temp_dir, metrics, cancel=None):
+    """Render cue-aligned segments concurrently, concat them and mux the audio once"""
+    duration = audio_info['duration']
+    cpus = os.cpu_count() or 1
+    if segments is None:
+        segments = max(1, min(cpus, int(duration // MIN_SEGMENT_S)))
+    total_frames = math.ceil(duration * fps)
+    cues = read_srt(srt_path)
+    ranges = _segment_frames(cues, total_frames, fps, segments)
+    threads = max(1, cpus // len(ranges))
+
+    # Each ffmpeg is its own process; threads only wait on them
+    segment_paths = []
+    with metrics.stage('video_render'), ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+        futures = []
+        for i, (first, last) in enumerate(ranges):
+            start_ms, end_ms = round(first * 1000 / fps), round(last * 1000 / fps)
+            segment_srt = os.path.join(temp_dir, f'segment_{i:03d}.srt')
+            write_srt(_shift_cues(cues, start_ms, end_ms), segment_srt)
+            segment_paths.append(os.path.join(temp_dir, f'segment_{i:03d}.mp4'))
+            futures.append(pool.submit(_render_segment, segment_srt, segment_paths[-1], width, height, fps,
+                                       last - first, threads, cancel))
+        for done, future in enumerate(as_completed(futures), 1):
+            future.result()
+            print(f"Rendered video segment {done}/{len(futures)}")
+            if progress_callback:
+                # Keep the last few percent for the final mux
+                progress_callback(int(done * 95 / len(futures)))
+
+    list_path = os.path.join(temp_dir, 'segments.txt')
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for path in segment_paths:
+            # Relative to the list file, which sits next to the segments
+            f.write(f"file '{os.path.basename(path)}'\n")
+    with metrics.stage('video_mux'):
+        _run_ffmpeg([
+            'ffmpeg', '-y',
+            '-f', 'concat', '-safe', '0',
+            '-i', list_path,
+            '-i', audio_path,
+            '-map', '0:v', '-map', '1:a:0',
+            '-c:v', 'copy',
+        ] + _audio_args(audio_info) + ['-t', str(duration), '-movflags', '+faststart', output_path], "video", cancel)
+    if progress_callback:
+        progress_callback(100)
+
+
+def _create_video_two_pass(audio_path, srt_path, output_path, width, height, duration, temp_dir, cancel=None):
+    """The original renderer: encode a black video, then decode it again to burn in subtitles"""
+    temp_video = os.path.join(temp_dir, 'temp_black.mp4')
+
+    # Create black background video
+    _run_ffmpeg([
+        'ffmpeg', '-y',
+        '-f', 'lavfi',
+        '-i', f'color=c=black:s={width}x{height}:d={duration}',
+        '-c:v', 'libx264',
+        '-preset', 'medium',
+        '-crf', '23',
+        temp_video
+    ], "background video", cancel)
+
+    # Create the final video with audio and subtitles
+    _run_ffmpeg([
+        'ffmpeg', '-y',
+        '-i', temp_video,
+        '-i', audio_path,
+        '-vf', _subtitles_filter(srt_path),
+        '-c:v', 'libx264',
+        '-c:a', 'aac',
+        '-b:a', '192k',
+        '-shortest',
+        output_path
+    ], "final video", cancel)
+
 
 if __name__ == '__main__':
     # Example usage
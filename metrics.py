@@ -0,0 +1,306 @@
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+
+def _children_cpu():
+    """CPU seconds of finished child processes (ffmpeg), 0 where unsupported"""
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process so far, or None where unsupported"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # Linux reports KiB
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def accepts_stats(callback):
+    """True if a progress callback can be called as callback(progress, stats)"""
+    try:
+        inspect.signature(callback).bind(0, {})
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+class RunMetrics:
+    """Timings, recognition latencies and memory of one pipeline run
+
+    Stages accumulate wall time, CPU time of the thread that entered them
+    and CPU time of finished child processes (ffmpeg) over every time they
+    are entered, so a per-chunk stage such as preprocess reports its total
+    and call count. CPU spent meanwhile by other threads (recognition,
+    another stage) is not counted; work handed to a pool shows up as wall
+    time only.
+    tracemalloc is only started with trace_memory=True because it slows
+    down every allocation.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = {}  # name -> {'wall_s', 'cpu_s' (this thread), 'child_cpu_s', 'calls'}
+        self.latencies = []  # Seconds per recognition request, in completion order
+        self.requests = 0
+        self.failed_requests = 0
+        self.bytes_sent = 0  # Request payloads: FLAC when encoded during preprocessing, else PCM
+        self.source_bytes = 0  # Decoded source PCM behind the payloads, at its own rate and channels
+        self.payload_bytes = 0
+        self.payload_audio_s = 0.0
+        self.audio_duration = None  # Seconds of source audio
+        self.chunks = 0
+        self.skipped_chunks = 0  # Chunks the speech gate found no speech in, so never sent
+        self.skipped_audio_s = 0.0
+        self.dedup_lookups = 0  # Chunks looked up in the fingerprint index
+        self.dedup_hits = 0  # ... that reused the transcript of a chunk heard before, so were never sent
+        self.dedup_audio_s = 0.0
+        self.chunking = None  # vad.chunk_stats of the split, when the audio was split in this run
+        self.connections = None  # http_pool.connection_report of the run, for pooled backends
+        self.started = None
+        self.finished = None
+        self.peak_traced_bytes = None
+        self._progress_start = None
+        self._lock = threading.Lock()
+        self._started_tracing = False
+
+    def start(self):
+        self.started = time.perf_counter()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def finish(self):
+        self.finished = time.perf_counter()
+        if tracemalloc.is_tracing():
+            self.peak_traced_bytes = tracemalloc.get_traced_memory()[1]
+            if self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block under a stage name"""
+        wall, cpu, child_cpu = time.perf_counter(), time.thread_time(), _children_cpu()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.thread_time() - cpu
+            child_cpu = _children_cpu() - child_cpu
+            with self._lock:
+                stage = self.stages.setdefault(name, {'wall_s': 0.0, 'cpu_s': 0.0, 'child_cpu_s': 0.0, 'calls': 0})
+                stage['wall_s'] += wall
+                stage['cpu_s'] += cpu
+                stage['child_cpu_s'] += child_cpu
+                stage['calls'] += 1
+
+    def record_request(self, latency, nbytes, ok=True):
+        """Record one recognition request; safe to call from worker threads"""
+        with self._lock:
+            self.requests += 1
+            self.failed_requests += 0 if ok else 1
+            self.bytes_sent += nbytes
+            self.latencies.append(latency)
+
+    def record_payload(self, source_bytes, payload_bytes, audio_s):
+        """Record one prepared chunk: source PCM size, payload size and seconds of audio"""
+        with self._lock:
+            self.source_bytes += source_bytes
+            self.payload_bytes += payload_bytes
+            self.payload_audio_s += audio_s
+
+    def record_skip(self, audio_s):
+        """Record one chunk the speech gate kept from the recognizer"""
+        with self._lock:
+            self.skipped_chunks += 1
+            self.skipped_audio_s += audio_s
+
+    def record_dedup(self, audio_s, hit):
+        """Record one fingerprint lookup, and whether it reused a stored transcript"""
+        with self._lock:
+            self.dedup_lookups += 1
+            if hit:
+                self.dedup_hits += 1
+                self.dedup_audio_s += audio_s
+
+    @property
+    def wall_s(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    def begin_progress(self, done_chunks=0, done_audio_s=0.0):
+        """Start measuring throughput here, counting work already done (e.g. cached chunks) as free"""
+        self._progress_start = (time.perf_counter(), done_chunks, done_audio_s)
+
+    def progress(self, done_chunks, total_chunks, done_audio_s, total_audio_s):
+        """Progress details for callbacks: percent, elapsed, ETA and throughput
+
+        Throughput and ETA count work since begin_progress (or since the run
+        started), so chunks restored from the cache do not make them optimistic.
+        """
+        now = time.perf_counter()
+        start, start_chunks, start_audio = self._progress_start or (self.started or now, 0, 0.0)
+        elapsed = now - start
+        audio_rate = (done_audio_s - start_audio) / elapsed if elapsed > 0 else None
+        remaining = max(0.0, total_audio_s - done_audio_s)
+        return {
+            'percent': int(done_chunks / total_chunks * 100) if total_chunks else 100,
+            'chunks_done': done_chunks,
+            'chunks_total': total_chunks,
+            'elapsed_s': self.wall_s,
+            'eta_s': remaining / audio_rate if audio_rate else None,
+            'chunks_per_s': (done_chunks - start_chunks) / elapsed if elapsed > 0 else None,
+            'audio_s_per_s': audio_rate,
+        }
+
+    def report(self):
+        """The run as a JSON-serializable dict"""
+        with self._lock:
+            latencies = sorted(self.latencies)
+            stages = {name: dict(stage) for name, stage in self.stages.items()}
+        wall = self.wall_s
+
+        mean_latency = sum(latencies) / len(latencies) if latencies else None
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))]
+
+        return {
+            'wall_s': wall,
+            'audio_duration_s': self.audio_duration,
+            'realtime_factor': wall / self.audio_duration if self.audio_duration else None,
+            'chunks': self.chunks,
+            'chunking': self.chunking,
+            'stages': stages,
+            'recognition': {
+                'requests': self.requests,
+                'failed': self.failed_requests,
+                'bytes_sent': self.bytes_sent,
+                'bytes_per_s': self.bytes_sent / wall if wall else None,
+                'latency_mean_s': mean_latency,
+                'latency_p50_s': percentile(50),
+                'latency_p95_s': percentile(95),
+                'latency_max_s': latencies[-1] if latencies else None,
+            },
+            'speech_gate': {
+                'skipped_chunks': self.skipped_chunks,
+                'skipped_audio_s': self.skipped_audio_s,
+                # Estimated: the skipped requests at the mean latency of the ones that were sent
+                'saved_request_s': self.skipped_chunks * mean_latency if mean_latency is not None else None,
+            },
+            'dedup': {
+                'lookups': self.dedup_lookups,
+                'hits': self.dedup_hits,
+                'hit_rate': self.dedup_hits / self.dedup_lookups if self.dedup_lookups else None,
+                'reused_audio_s': self.dedup_audio_s,
+                'saved_requests': self.dedup_hits,
+                'saved_request_s': self.dedup_hits * mean_latency if mean_latency is not None else None,
+            },
+            'connections': self.connections,
+            'payload': {
+                'source_bytes_per_audio_s': self.source_bytes / self.payload_audio_s if self.payload_audio_s else None,
+                'payload_bytes_per_audio_s': self.payload_bytes / self.payload_audio_s if self.payload_audio_s else None,
+                'compression': self.source_bytes / self.payload_bytes if self.payload_bytes else None,
+            },
+            'memory': {
+                'peak_rss_bytes': peak_rss_bytes(),
+                'peak_traced_bytes': self.peak_traced_bytes,
+            },
+        }
+
+    def save_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def samples(self, labels=None):
+        """(metric name, labels, value) for every value of the report that is known"""
+        report = self.report()
+        labels = dict(labels or {})
+        found = []
+
+        def sample(name, value, **extra):
+            if value is not None:
+                found.append((name, dict(labels, **extra), value))
+
+        sample('wall_seconds', report['wall_s'])
+        sample('audio_seconds', report['audio_duration_s'])
+        sample('realtime_factor', report['realtime_factor'])
+        sample('chunks', report['chunks'])
+        if report['chunking']:
+            sample('chunks_per_hour', report['chunking']['chunks_per_hour'])
+            sample('chunk_padding_ratio', report['chunking']['padding_ratio'])
+            sample('chunk_cuts_in_speech', report['chunking']['cuts_in_speech'])
+        for name, stage in sorted(report['stages'].items()):
+            sample('stage_wall_seconds', stage['wall_s'], stage=name)
+            sample('stage_cpu_seconds', stage['cpu_s'], stage=name)
+            sample('stage_child_cpu_seconds', stage['child_cpu_s'], stage=name)
+            sample('stage_calls', stage['calls'], stage=name)
+        recognition = report['recognition']
+        sample('recognition_requests', recognition['requests'])
+        sample('recognition_failed', recognition['failed'])
+        sample('recognition_bytes_sent', recognition['bytes_sent'])
+        for quantile in (50, 95):
+            sample('recognition_latency_seconds', recognition[f'latency_p{quantile}_s'], quantile=quantile / 100)
+        sample('skipped_chunks', report['speech_gate']['skipped_chunks'])
+        sample('skipped_audio_seconds', report['speech_gate']['skipped_audio_s'])
+        sample('saved_request_seconds', report['speech_gate']['saved_request_s'])
+        sample('dedup_lookups', report['dedup']['lookups'])
+        sample('dedup_hits', report['dedup']['hits'])
+        sample('dedup_reused_audio_seconds', report['dedup']['reused_audio_s'])
+        sample('dedup_saved_request_seconds', report['dedup']['saved_request_s'])
+        if report['connections']:
+            sample('http_connections_opened', report['connections']['connections_opened'])
+            sample('http_connect_seconds_mean', report['connections']['connect_s_mean'])
+            sample('http_transfer_seconds_mean', report['connections']['transfer_s_mean'])
+        sample('source_bytes_per_audio_second', report['payload']['source_bytes_per_audio_s'])
+        sample('payload_bytes_per_audio_second', report['payload']['payload_bytes_per_audio_s'])
+        sample('peak_rss_bytes', report['memory']['peak_rss_bytes'])
+        sample('peak_traced_bytes', report['memory']['peak_traced_bytes'])
+        return found
+
+    def to_prometheus(self, labels=None):
+        """The run in the Prometheus text exposition format"""
+        return prometheus_text([(self, labels)])
+
+    def save_prometheus(self, path, labels=None):
+        """Write the text format atomically, e.g. for node_exporter's textfile collector"""
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus(labels))
+        os.replace(temp_path, path)
+
+
+def prometheus_text(runs, prefix='transcribe'):
+    """Prometheus text format for [(RunMetrics, labels)], each metric's samples grouped together"""
+    families = {}
+    for metrics, labels in runs:
+        for name, sample_labels, value in metrics.samples(labels):
+            families.setdefault(name, []).append((sample_labels, value))
+    lines = []
+    for name, samples in families.items():
+        lines.append(f"# TYPE {prefix}_{name} gauge")
+        for sample_labels, value in samples:
+            label_text = ','.join(f'{key}="{_label(text)}"' for key, text in sample_labels.items())
+            lines.append(f"{prefix}_{name}{{{label_text}}} {value}" if label_text else f"{prefix}_{name} {value}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,190 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+import speech_recognition as sr
+
+from audio_store import SAMPLE_WIDTH, downmix
+from cancel import Cancelled
+from denoise import reduce_noise_samples
+
+RECOGNITION_RATE = 16000  # Speech APIs gain nothing from a higher rate
+MAX_PREPROCESS_WORKERS = 4
+
+_attached = {}  # Shared memory slots this worker process has attached, by name
+
+
+def _smooth_size(n):
+    """Smallest 2**a * 3**b * 5**c >= n, a length the FFT handles quickly"""
+    best = 1 << max(0, (n - 1).bit_length())
+    power3 = 1
+    while power3 < best:
+        size = power3
+        while size < best:
+            candidate = size
+            while candidate < n:
+                candidate *= 2
+            best = min(best, candidate)
+            size *= 5
+        power3 *= 3
+    return best
+
+
+def resample(samples, from_rate, to_rate):
+    """Band-limited resampling of mono int16 samples by truncating (or zero-padding) the spectrum
+
+    One real FFT over the whole chunk, so everything above the new Nyquist
+    frequency is removed exactly, without a separate anti-aliasing filter.
+    The chunk is reflect-padded to a length that is a multiple of the rate
+    ratio's denominator with small prime factors, which keeps the FFT fast
+    for any chunk length; the padding is cut off again afterwards.
+    """
+    if from_rate == to_rate or not len(samples):
+        return samples
+    divisor = math.gcd(from_rate, to_rate)
+    up, down = to_rate // divisor, from_rate // divisor
+    padded = down * _smooth_size(-(-len(samples) // down))
+    signal = samples.astype(np.float32)
+    if padded > len(samples):
+        mode = 'reflect' if padded - len(samples) < len(samples) else 'constant'
+        signal = np.pad(signal, (0, padded - len(samples)), mode=mode)
+    count = padded // down * up
+    spectrum = np.fft.rfft(signal)
+    resampled = np.fft.irfft(spectrum[:count // 2 + 1], count) * (count / padded)
+    resampled = resampled[:max(1, round(len(samples) * to_rate / from_rate))]
+    return np.clip(np.round(resampled), -32768, 32767).astype(np.int16)
+
+
+class FlacAudioData(sr.AudioData):
+    """AudioData carrying its FLAC encoding, made once during preprocessing
+
+    speech_recognition's Google client encodes every request to FLAC itself;
+    with this it reuses the bytes encoded here as long as no conversion is asked for.
+    """
+
+    def __init__(self, frame_data, sample_rate, sample_width, flac_data=None):
+        super().__init__(frame_data, sample_rate, sample_width)
+        self.flac_data = flac_data
+
+    def get_flac_data(self, convert_rate=None, convert_width=None):
+        if (self.flac_data is not None and convert_rate in (None, self.sample_rate)
+                and convert_width in (None, self.sample_width)):
+            return self.flac_data
+        return super().get_flac_data(convert_rate, convert_width)
+
+
+def prepare_samples(samples, frame_rate, target_rate=RECOGNITION_RATE, denoise=True, cancel=None):
+    """Turn a (frames, channels) int16 view into the mono samples sent to the recognizer
+
+    Downmixes, resamples down to target_rate (never up; None keeps the source
+    rate) and applies noise reduction, which stops early with Cancelled once
+    cancel (cancel.CancelToken) is cancelled. Returns (samples, frame_rate).
+    """
+    mono = downmix(samples)
+    if target_rate and frame_rate > target_rate:
+        mono = resample(mono, frame_rate, target_rate)
+        frame_rate = target_rate
+    if denoise:
+        try:
+            mono = reduce_noise_samples(mono, cancel)
+        except Cancelled:
+            raise
+        except Exception as e:
+            print(f"Error in noise reduction: {str(e)}")
+    return mono, frame_rate
+
+
+def make_audio_data(samples, frame_rate, flac=False):
+    """sr.AudioData for mono int16 samples, FLAC-encoded up front when flac is set"""
+    frame_data = np.ascontiguousarray(samples, dtype='<i2').tobytes()
+    if not flac:
+        return sr.AudioData(frame_data, frame_rate, SAMPLE_WIDTH)
+    audio_data = FlacAudioData(frame_data, frame_rate, SAMPLE_WIDTH)
+    audio_data.flac_data = sr.AudioData.get_flac_data(audio_data)
+    return audio_data
+
+
+def payload_size(audio_data):
+    """Bytes a request for this audio carries: the FLAC encoding if there is one, else the PCM"""
+    return len(getattr(audio_data, 'flac_data', None) or audio_data.frame_data)
+
+
+def default_preprocess_workers():
+    """Worker processes for preprocessing: one core is left for the recognition loop, 0 on a single core"""
+    return max(0, min(MAX_PREPROCESS_WORKERS, (os.cpu_count() or 1) - 1))
+
+
+def _prepare_in_slot(name, frames, channels, frame_rate, target_rate, denoise):
+    """Worker side of PreprocessPool: prepare the chunk in a slot and write the result back over it"""
+    block = _attached.get(name)
+    if block is None:
+        block = _attached[name] = shared_memory.SharedMemory(name=name)
+    source = np.ndarray((frames, channels), dtype='<i2', buffer=block.buf)
+    samples, frame_rate = prepare_samples(source, frame_rate, target_rate, denoise)
+    # Never longer than the source: mono, and only ever resampled down
+    np.ndarray(len(samples), dtype='<i2', buffer=block.buf)[:] = samples
+    return len(samples), frame_rate
+
+
+class PreprocessPool:
+    """Runs prepare_samples in worker processes, passing chunks through shared memory
+
+    Every chunk in flight has a slot of shared memory large enough for the
+    longest chunk: the source frames are copied in, the worker writes the
+    prepared mono samples back over them, so no array is pickled. The number
+    of slots bounds the chunks in flight, and with it the memory used.
+    """
+
+    def __init__(self, workers, slots, slot_frames, channels):
+        self.channels = channels
+        self._slots = [
+            shared_memory.SharedMemory(create=True, size=max(1, slot_frames * channels * SAMPLE_WIDTH))
+            for _ in range(max(1, slots))
+        ]
+        self._free = list(self._slots)
+        # spawn: forking a process that runs GUI or server threads is not safe
+        self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'))
+
+    @property
+    def free_slots(self):
+        return len(self._free)
+
+    def submit(self, samples, frame_rate, target_rate=RECOGNITION_RATE, denoise=True):
+        """Start preparing a (frames, channels) int16 chunk; returns a handle for result()"""
+        if not self._free:
+            raise Exception("No free preprocessing slot")
+        block = self._free.pop()
+        frames = len(samples)
+        np.ndarray((frames, self.channels), dtype='<i2', buffer=block.buf)[:] = samples
+        try:
+            future = self._executor.submit(_prepare_in_slot, block.name, frames, self.channels, frame_rate,
+                                           target_rate, denoise)
+        except Exception:
+            self._free.append(block)
+            raise
+        return future, block
+
+    def result(self, handle):
+        """Wait for a chunk and free its slot; returns (samples, frame_rate) like prepare_samples"""
+        future, block = handle
+        try:
+            length, frame_rate = future.result()
+            return np.ndarray(length, dtype='<i2', buffer=block.buf).copy(), frame_rate
+        finally:
+            self._free.append(block)
+
+    def close(self):
+        """Stop the workers and release the shared memory"""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        for block in self._slots:
+            block.close()
+            block.unlink()
+        self._slots = self._free = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
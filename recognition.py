@@ -0,0 +1,357 @@
+import http.client
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+import speech_recognition as sr
+
+from cancel import check
+from http_pool import ConnectionPool
+
+CANCEL_POLL_S = 0.1  # How often a request waiting on another thread checks its cancel token
+
+
+class ThrottledError(Exception):
+    """The recognition service asked us to slow down (HTTP 429)"""
+
+
+class TransientError(Exception):
+    """A recognition failure worth retrying (HTTP 5xx, connection problems)"""
+
+
+class RecognitionBackend:
+    """Base class for the speech recognition service used by Transcribe"""
+
+    def recognize(self, audio_data, cancel=None):
+        """Return the transcript for an sr.AudioData instance
+
+        cancel (cancel.CancelToken), if given, stops the request from being
+        sent, retried or waited for once cancelled, raising Cancelled.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Stop the threads the backend started; it starts them again when used"""
+
+    def cache_id(self):
+        """Identify the recognizer settings in cache keys, so a change invalidates cached transcripts"""
+        return type(self).__name__
+
+    def connection_stats(self):
+        """Cumulative http_pool.ConnectionPool statistics, or None for backends without a pool"""
+        return None
+
+
+class GoogleBackend(RecognitionBackend):
+    """Recognize speech with the free Google Web Speech API
+
+    Requests go over a pool of keep-alive connections (http_pool.py) of
+    pool_size idle connections, so reusing one backend across chunks and
+    files saves a TCP/TLS handshake per request. keep_alive=False sends
+    them through speech_recognition's own urllib client instead. A request
+    that takes longer than timeout seconds fails with a socket timeout.
+    """
+
+    def __init__(self, language='fa-IR', endpoint=None, timeout=30.0, pool_size=8, keep_alive=True):
+        self.language = language
+        self.endpoint = endpoint  # Point at a local stand-in, e.g. stub_server.py
+        self.recognizer = sr.Recognizer()
+        self.recognizer.operation_timeout = timeout
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.pool = None  # Created for the endpoint's host on the first request
+        self._pool_lock = threading.Lock()
+
+    def connection_stats(self):
+        return self.pool.snapshot() if self.pool else None
+
+    def _pool_for(self, url):
+        with self._pool_lock:
+            if self.pool is None:
+                self.pool = ConnectionPool(url.scheme, url.hostname, url.port, max_idle=self.pool_size,
+                                           timeout=self.timeout)
+            return self.pool
+
+    def recognize(self, audio_data, cancel=None):
+        check(cancel)
+        if self.keep_alive:
+            return self._recognize_pooled(audio_data)
+        options = {'endpoint': self.endpoint} if self.endpoint else {}
+        try:
+            return self.recognizer.recognize_google(audio_data, language=self.language, **options)
+        except sr.RequestError as e:
+            # speech_recognition raises RequestError while handling the urllib error
+            code = getattr(e.__cause__ or e.__context__, 'code', None)
+            if code == 429:
+                raise ThrottledError(str(e)) from e
+            if code is None or code >= 500:
+                raise TransientError(str(e)) from e
+            raise
+
+    def _recognize_pooled(self, audio_data):
+        """The request recognize_google sends, over a pooled connection, with the same errors"""
+        from speech_recognition.recognizers.google import ENDPOINT, OutputParser, create_request_builder
+
+        request = create_request_builder(endpoint=self.endpoint or ENDPOINT, language=self.language).build(audio_data)
+        url = urlsplit(request.full_url)
+        path = f"{url.path}?{url.query}" if url.query else url.path
+        try:
+            response = self._pool_for(url).request('POST', path, body=request.data, headers=dict(request.header_items()))
+        except (OSError, http.client.HTTPException) as e:
+            raise TransientError(f"recognition connection failed: {str(e)}") from e
+        if response['status'] == 429:
+            raise ThrottledError(f"recognition request failed: {response['reason']}")
+        if response['status'] >= 500:
+            raise TransientError(f"recognition request failed: {response['reason']}")
+        if response['status'] != 200:
+            raise sr.RequestError(f"recognition request failed: {response['reason']}")
+        return OutputParser(show_all=False, with_confidence=False).parse(response['body'].decode('utf-8'))
+
+    def cache_id(self):
+        return f"google:{self.language}"
+
+
+class FakeBackend(RecognitionBackend):
+    """Local stand-in recognizer with configurable latency, used for testing the chunk pool"""
+
+    def __init__(self, latency=0.0, text="chunk of {seconds:.1f}s", fail_every=0):
+        self.latency = latency
+        self.text = text
+        self.fail_every = fail_every
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def recognize(self, audio_data, cancel=None):
+        check(cancel)
+        with self._lock:
+            self.calls += 1
+            call_number = self.calls
+        if self.latency:
+            if cancel:
+                cancel.wait(self.latency)
+            else:
+                time.sleep(self.latency)
+        check(cancel)
+        if self.fail_every and call_number % self.fail_every == 0:
+            raise sr.UnknownValueError()
+        seconds = len(audio_data.frame_data) / (audio_data.sample_rate * audio_data.sample_width)
+        return self.text.format(seconds=seconds, call=call_number)
+
+
+class BudgetedBackend(RecognitionBackend):
+    """Hold a slot of a shared semaphore for every request of another backend
+
+    With a multiprocessing.Manager semaphore this caps requests in flight
+    across every process of a batch, not just within one Transcribe.
+    """
+
+    def __init__(self, backend, semaphore):
+        self.backend = backend
+        self.semaphore = semaphore
+
+    def cache_id(self):
+        return self.backend.cache_id()
+
+    def connection_stats(self):
+        return self.backend.connection_stats()
+
+    def recognize(self, audio_data, cancel=None):
+        self.semaphore.acquire()
+        try:
+            return self.backend.recognize(audio_data, cancel)
+        finally:
+            self.semaphore.release()
+
+    def close(self):
+        self.backend.close()
+
+
+class AdaptiveScheduler(RecognitionBackend):
+    """Pace, retry and hedge the requests of another backend
+
+    - Concurrency adapts AIMD-style: every success adds 1/limit to the limit
+      of requests in flight, a throttle or error halves it, and a response
+      slower than latency_tolerance times the recent median shrinks it by 10%.
+    - Throttled, transient and socket errors are retried up to max_retries
+      times with full-jitter exponential backoff. Other errors (such as
+      sr.UnknownValueError for unintelligible audio) are raised at once.
+    - A request still running after the hedge_percentile latency of recent
+      successes gets one duplicate; whichever answers first wins. The loser
+      keeps its thread until it finishes, so a hedge is only sent while a
+      thread is free for it and never queues behind stuck requests.
+    - A cancelled request is neither retried nor hedged, and its caller stops
+      waiting for it at once; close() drops the requests not started yet.
+    """
+
+    def __init__(self, backend, max_concurrency=8, min_concurrency=1, initial_concurrency=None,
+                 max_retries=4, backoff_base=0.5, backoff_max=30.0,
+                 hedge_percentile=95, hedge_min_samples=10, latency_tolerance=2.0):
+        self.backend = backend
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.limit = float(initial_concurrency or self.max_concurrency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.latency_tolerance = latency_tolerance
+
+        self.in_flight = 0
+        self.running = 0  # Requests holding an executor thread, including hedges and their losers
+        self.latencies = deque(maxlen=200)  # Seconds taken by recent successful requests
+        self.stats = {'requests': 0, 'retries': 0, 'throttled': 0, 'errors': 0, 'hedged': 0, 'hedge_wins': 0,
+                      'hedges_skipped': 0}
+        self._condition = threading.Condition()
+        # Room for every primary request plus one hedge each
+        self.threads = 2 * self.max_concurrency
+        self._executor = None  # Started on the first request, again after close()
+
+    def cache_id(self):
+        return self.backend.cache_id()
+
+    def connection_stats(self):
+        return self.backend.connection_stats()
+
+    def close(self):
+        with self._condition:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def recognize(self, audio_data, cancel=None):
+        for attempt in range(self.max_retries + 1):
+            self._acquire(cancel)
+            try:
+                start = time.perf_counter()
+                text = self._hedged(audio_data, cancel)
+            except ThrottledError as e:
+                self._on_failure('throttled')
+                error = e
+            except (TransientError, OSError) as e:
+                self._on_failure('errors')
+                error = e
+            else:
+                self._on_success(time.perf_counter() - start)
+                return text
+            finally:
+                self._release()
+
+            if attempt < self.max_retries:
+                check(cancel)
+                with self._condition:
+                    self.stats['retries'] += 1
+                backoff = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                if cancel:
+                    cancel.wait(backoff)
+                else:
+                    time.sleep(backoff)
+        raise error
+
+    def _acquire(self, cancel=None):
+        with self._condition:
+            check(cancel)
+            while self.in_flight >= int(self.limit):
+                self._condition.wait(CANCEL_POLL_S if cancel else None)
+                check(cancel)
+            self.in_flight += 1
+            self.stats['requests'] += 1
+
+    def _release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def _on_success(self, latency):
+        with self._condition:
+            if len(self.latencies) >= self.hedge_min_samples and \
+                    latency > self.latency_tolerance * _percentile(self.latencies, 50):
+                self.limit = max(self.min_concurrency, self.limit * 0.9)
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self.latencies.append(latency)
+            self._condition.notify_all()
+
+    def _on_failure(self, kind):
+        with self._condition:
+            self.stats[kind] += 1
+            self.limit = max(self.min_concurrency, self.limit / 2)
+
+    def _hedge_delay(self):
+        with self._condition:
+            if len(self.latencies) < self.hedge_min_samples:
+                return None
+            return _percentile(self.latencies, self.hedge_percentile)
+
+    def _start(self, audio_data, cancel=None):
+        """Submit a request, already counted in self.running"""
+        with self._condition:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.threads)
+            executor = self._executor
+        try:
+            future = executor.submit(self.backend.recognize, audio_data, cancel)
+        except RuntimeError:  # close() shut the executor down meanwhile
+            self._finished(None)
+            check(cancel)
+            raise
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future):
+        with self._condition:
+            self.running -= 1
+
+    def _hedged(self, audio_data, cancel=None):
+        """Run one request, duplicating it if it outlives the hedge delay and a thread is free"""
+        check(cancel)
+        with self._condition:
+            self.running += 1
+        primary = self._start(audio_data, cancel)
+        delay = self._hedge_delay()
+        if delay is None or _wait([primary], cancel, delay)[0]:
+            _wait([primary], cancel)
+            return primary.result()
+
+        check(cancel)
+        with self._condition:
+            free = self.running < self.threads
+            if free:
+                self.running += 1
+            self.stats['hedged' if free else 'hedges_skipped'] += 1
+        if not free:
+            _wait([primary], cancel)
+            return primary.result()
+        hedge = self._start(audio_data, cancel)
+        pending = {primary, hedge}
+        while True:
+            done, pending = _wait(pending, cancel)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._condition:
+                            self.stats['hedge_wins'] += 1
+                    return future.result()
+            if not pending:
+                return done.pop().result()  # Both attempts failed
+
+
+def _wait(futures, cancel=None, timeout=None):
+    """wait(futures, timeout, FIRST_COMPLETED) that raises Cancelled once cancel is cancelled"""
+    if cancel is None:
+        return wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        check(cancel)
+        step = CANCEL_POLL_S if deadline is None else max(0.0, min(CANCEL_POLL_S, deadline - time.monotonic()))
+        done, pending = wait(futures, timeout=step, return_when=FIRST_COMPLETED)
+        if done or (deadline is not None and time.monotonic() >= deadline):
+            return done, pending
+
+
+def _percentile(values, percentile):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
@@ -0,0 +1,443 @@
+"""Local HTTP job service around the Transcribe pipeline
+
+    python -m server --port 8000 --workers 2 --queue-size 8
+    python -m server --backend fake            # canned transcripts, no network
+    python -m server --backend stub            # real HTTP path against stub_server
+
+Endpoints:
+
+    POST /jobs?filename=talk.mp3[&video=1]   raw audio body -> 202 {"id": ...}
+                                             503 + Retry-After when the queue is full
+    GET  /jobs                               all jobs
+    GET  /jobs/<id>                          status, stage and progress
+    GET  /jobs/<id>/events                   progress as server-sent events
+    GET  /jobs/<id>/progress?after=<n>       long-poll until progress differs from n
+    GET  /jobs/<id>/transcript.txt
+    GET  /jobs/<id>/subtitles.srt
+    GET  /jobs/<id>/video.mp4                only for jobs submitted with video=1
+    GET  /jobs/<id>/report.json              stage timings, recognition latency, memory
+    GET  /metrics                            every job's run metrics in Prometheus text format
+
+Example:
+
+    curl --data-binary @talk.mp3 "http://127.0.0.1:8000/jobs?filename=talk.mp3"
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from main import Transcribe
+from make_video import create_video_with_subtitles
+from metrics import prometheus_text
+from recognition import AdaptiveScheduler, BudgetedBackend, FakeBackend, GoogleBackend
+from stub_server import StubRecognizerServer
+
+STATUS_TEXT = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               409: 'Conflict', 413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+RESULT_FILES = {
+    'transcript.txt': ('text_path', 'text/plain; charset=utf-8'),
+    'subtitles.srt': ('srt_path', 'application/x-subrip; charset=utf-8'),
+    'video.mp4': ('video_path', 'video/mp4'),
+}
+UPLOAD_BLOCK = 1 << 16
+
+
+class Job:
+    """One uploaded file moving through the queue"""
+
+    def __init__(self, job_id, filename, upload_path, job_dir, video):
+        self.id = job_id
+        self.filename = filename
+        self.upload_path = upload_path
+        self.job_dir = job_dir
+        self.video = video
+        self.status = 'queued'  # queued, running, done, failed
+        self.stage = None  # transcribe, video
+        self.progress = 0
+        self.eta_s = None
+        self.audio_s_per_s = None  # Seconds of audio transcribed per second
+        self.error = None
+        self.metrics = None  # RunMetrics of the pipeline, once it started
+        self.created = time.time()
+        self.text_path = os.path.join(job_dir, 'transcript.txt')
+        self.srt_path = os.path.join(job_dir, 'subtitles.srt')
+        self.video_path = os.path.join(job_dir, 'video.mp4') if video else None
+        self._changed = asyncio.Event()
+
+    def describe(self):
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': self.progress,
+            'eta_s': self.eta_s,
+            'audio_s_per_s': self.audio_s_per_s,
+            'error': self.error,
+            'video': self.video,
+        }
+
+    def update(self, **fields):
+        """Change fields and wake everyone waiting for a change; event loop thread only"""
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_for_change(self, timeout):
+        """Return True if the job changed within timeout seconds"""
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+
+class JobService:
+    """Bounded queue of jobs drained by a fixed number of pipeline workers"""
+
+    def __init__(self, workers=2, queue_size=8, concurrency=8, backend='google', language='fa-IR',
+                 endpoint=None, fake_latency=0.0, upload_dir='uploads', output_dir='output/jobs',
+                 max_upload_bytes=2 * 2**30):
+        self.workers = workers
+        self.queue = None  # Created on the running loop in start()
+        self.queue_size = queue_size
+        self.concurrency = concurrency
+        self.backend = backend
+        self.language = language
+        self.endpoint = endpoint
+        self.fake_latency = fake_latency
+        self.upload_dir = os.path.abspath(upload_dir)
+        self.output_dir = os.path.abspath(output_dir)
+        self.max_upload_bytes = max_upload_bytes
+        self.jobs = {}
+        # One recognition budget shared by every job in the service
+        self.budget = threading.BoundedSemaphore(concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='transcribe-job')
+        self.loop = None
+        self.stub = None  # In-process StubRecognizerServer for backend='stub'
+        self.google = None  # One GoogleBackend for every job, so its keep-alive connections are shared
+        self._tasks = []
+
+    def make_backend(self):
+        if self.backend == 'fake':
+            backend = FakeBackend(latency=self.fake_latency)
+        else:
+            if self.google is None:
+                self.google = GoogleBackend(language=self.language, endpoint=self.endpoint,
+                                            pool_size=self.concurrency)
+            backend = self.google
+        return AdaptiveScheduler(BudgetedBackend(backend, self.budget), max_concurrency=self.concurrency)
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        if self.backend == 'stub':
+            self.stub = StubRecognizerServer(latency=self.fake_latency).start()
+            self.endpoint = self.stub.endpoint
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        os.makedirs(self.upload_dir, exist_ok=True)
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.executor.shutdown(wait=False)
+        if self.stub:
+            self.stub.shutdown()
+            self.stub.server_close()
+
+    def accepting(self):
+        return not self.queue.full()
+
+    def submit(self, job):
+        """Queue a job; raises asyncio.QueueFull when the service is saturated"""
+        self.queue.put_nowait(job)
+        self.jobs[job.id] = job
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            job.update(status='running', stage='transcribe', progress=0)
+            try:
+                await self.loop.run_in_executor(self.executor, self._run_job, job)
+                job.update(status='done', progress=100)
+            except Exception as e:
+                job.update(status='failed', error=str(e))
+            finally:
+                if os.path.isfile(job.upload_path):
+                    os.remove(job.upload_path)
+                self.queue.task_done()
+
+    def _run_job(self, job):
+        """Run the pipeline for one job on an executor thread"""
+        def report(progress, stats=None):
+            stats = stats or {}
+            self.loop.call_soon_threadsafe(lambda: job.update(
+                progress=progress, eta_s=stats.get('eta_s'), audio_s_per_s=stats.get('audio_s_per_s')))
+
+        transcriber = Transcribe(
+            job.upload_path,
+            job.text_path,
+            job.srt_path,
+            progress_callback=report,
+            backend=self.make_backend(),
+            max_workers=self.concurrency,
+            output_dir=job.job_dir,
+            scratch_dir=os.path.join(job.job_dir, 'scratch'),
+        )
+        job.metrics = transcriber.metrics
+        transcriber.run()
+        if job.video:
+            self.loop.call_soon_threadsafe(lambda: job.update(stage='video', progress=0, eta_s=None))
+            create_video_with_subtitles(job.upload_path, job.srt_path, job.video_path, metrics=transcriber.metrics)
+
+
+class JobServer:
+    """Minimal HTTP/1.1 front end (one request per connection) for a JobService"""
+
+    def __init__(self, service, host='127.0.0.1', port=8000, poll_timeout=30.0):
+        self.service = service
+        self.host = host
+        self.port = port
+        self.poll_timeout = poll_timeout
+        self.server = None
+
+    async def start(self):
+        await self.service.start()
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        await self.service.stop()
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            url = urlsplit(target)
+            query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            await self.route(method, url.path.rstrip('/') or '/', query, headers, reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            try:
+                await self.send_json(writer, 500, {'error': str(e)})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, query, headers, reader, writer):
+        parts = path.strip('/').split('/')
+        if parts == ['metrics'] and method == 'GET':
+            return await self.send_metrics(writer)
+        if parts[0] != 'jobs':
+            return await self.send_json(writer, 404, {'error': 'not found'})
+        if len(parts) == 1:
+            if method == 'POST':
+                return await self.create_job(query, headers, reader, writer)
+            if method == 'GET':
+                return await self.send_json(writer, 200, [job.describe() for job in self.service.jobs.values()])
+            return await self.send_json(writer, 405, {'error': 'method not allowed'})
+
+        job = self.service.jobs.get(parts[1])
+        if job is None:
+            return await self.send_json(writer, 404, {'error': 'unknown job'})
+        if method != 'GET':
+            return await self.send_json(writer, 405, {'error': 'method not allowed'})
+        if len(parts) == 2:
+            return await self.send_json(writer, 200, job.describe())
+        if parts[2] == 'events':
+            return await self.stream_events(job, writer)
+        if parts[2] == 'progress':
+            return await self.long_poll(job, query, writer)
+        if parts[2] == 'report.json':
+            if job.metrics is None:
+                return await self.send_json(writer, 409, {'error': f"job is {job.status}"})
+            return await self.send_json(writer, 200, job.metrics.report())
+        if parts[2] in RESULT_FILES:
+            return await self.send_result(job, parts[2], writer)
+        return await self.send_json(writer, 404, {'error': 'not found'})
+
+    async def create_job(self, query, headers, reader, writer):
+        try:
+            length = int(headers.get('content-length', ''))
+        except ValueError:
+            return await self.send_json(writer, 400, {'error': 'Content-Length required'})
+        # A client sending "Expect: 100-continue" waits for our go-ahead before the body
+        expects_continue = headers.get('expect', '').lower() == '100-continue'
+
+        async def reject(status, error, extra_headers=None):
+            await self.send_json(writer, status, {'error': error}, extra_headers)
+            if not expects_continue and 0 < length <= self.service.max_upload_bytes:
+                # Swallow the body so closing the socket does not reset it under the client
+                await self.discard(reader, length)
+
+        # Backpressure: refuse before storing the upload when the queue is full
+        if not self.service.accepting():
+            return await reject(503, 'queue full, retry later', {'Retry-After': '10'})
+        if length <= 0:
+            return await reject(400, 'empty upload')
+        if length > self.service.max_upload_bytes:
+            return await reject(413, 'upload too large')
+        if expects_continue:
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            await writer.drain()
+
+        filename = os.path.basename(query.get('filename', 'upload.wav')) or 'upload.wav'
+        job_id = uuid.uuid4().hex[:12]
+        upload_path = os.path.join(self.service.upload_dir, f"{job_id}_{filename}")
+        with open(upload_path, 'wb') as upload:
+            remaining = length
+            while remaining:
+                block = await reader.read(min(UPLOAD_BLOCK, remaining))
+                if not block:
+                    raise ConnectionError("upload ended early")
+                upload.write(block)
+                remaining -= len(block)
+
+        job_dir = os.path.join(self.service.output_dir, job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        job = Job(job_id, filename, upload_path, job_dir, query.get('video') in ('1', 'true', 'yes'))
+        try:
+            self.service.submit(job)
+        except asyncio.QueueFull:
+            os.remove(upload_path)
+            shutil.rmtree(job_dir, ignore_errors=True)
+            return await self.send_json(writer, 503, {'error': 'queue full, retry later'}, {'Retry-After': '10'})
+        await self.send_json(writer, 202, job.describe(), {'Location': f"/jobs/{job.id}"})
+
+    async def discard(self, reader, length):
+        remaining = length
+        while remaining:
+            block = await reader.read(min(UPLOAD_BLOCK, remaining))
+            if not block:
+                return
+            remaining -= len(block)
+
+    async def stream_events(self, job, writer):
+        """Server-sent events: one 'progress' event per change, then 'done' or 'failed'"""
+        await self.send_head(writer, 200, 'text/event-stream', {'Cache-Control': 'no-cache'})
+        while True:
+            state = job.describe()
+            event = job.status if job.finished else 'progress'
+            writer.write(f"event: {event}\ndata: {json.dumps(state)}\n\n".encode('utf-8'))
+            await writer.drain()
+            if job.finished:
+                return
+            if not await job.wait_for_change(15):
+                writer.write(b": keep-alive\n\n")
+
+    async def long_poll(self, job, query, writer):
+        """Answer as soon as the progress or status differs from what the client has seen"""
+        try:
+            after = int(query.get('after', -1))
+        except ValueError:
+            after = -1
+        deadline = time.monotonic() + self.poll_timeout
+        while job.progress == after and not job.finished:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not await job.wait_for_change(remaining):
+                break
+        await self.send_json(writer, 200, job.describe())
+
+    async def send_result(self, job, name, writer):
+        attribute, content_type = RESULT_FILES[name]
+        path = getattr(job, attribute)
+        if path is None:
+            return await self.send_json(writer, 404, {'error': 'not requested for this job'})
+        if job.status != 'done' or not os.path.isfile(path):
+            return await self.send_json(writer, 409, {'error': f"job is {job.status}"})
+        await self.send_head(writer, 200, content_type, {'Content-Length': str(os.path.getsize(path))})
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(UPLOAD_BLOCK), b''):
+                writer.write(block)
+                await writer.drain()
+
+    async def send_metrics(self, writer):
+        text = prometheus_text([
+            (job.metrics, {'job': job.id, 'file': job.filename})
+            for job in self.service.jobs.values() if job.metrics is not None
+        ]).encode('utf-8')
+        await self.send_head(writer, 200, 'text/plain; version=0.0.4; charset=utf-8',
+                             {'Content-Length': str(len(text))})
+        writer.write(text)
+        await writer.drain()
+
+    async def send_head(self, writer, status, content_type, headers=None):
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}", f"Content-Type: {content_type}",
+                 "Connection: close"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        await writer.drain()
+
+    async def send_json(self, writer, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        await self.send_head(writer, status, 'application/json; charset=utf-8',
+                             dict(headers or {}, **{'Content-Length': str(len(body))}))
+        writer.write(body)
+        await writer.drain()
+
+
+async def serve(args):
+    service = JobService(
+        workers=args.workers, queue_size=args.queue_size, concurrency=args.concurrency, backend=args.backend,
+        language=args.language, endpoint=args.endpoint, fake_latency=args.fake_latency,
+        upload_dir=args.upload_dir, output_dir=args.output_dir)
+    server = await JobServer(service, args.host, args.port).start()
+    print(f"Transcription service listening on http://{args.host}:{server.port}")
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local HTTP job service around the Transcribe pipeline")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=2, help="Jobs processed at the same time")
+    parser.add_argument('--queue-size', type=int, default=8, help="Queued jobs before uploads are refused")
+    parser.add_argument('--concurrency', type=int, default=8, help="Recognition requests in flight, all jobs")
+    parser.add_argument('--language', default='fa-IR')
+    parser.add_argument('--backend', choices=('google', 'fake', 'stub'), default='google',
+                        help="'stub' starts an in-process stub_server and recognizes against it")
+    parser.add_argument('--endpoint', help="Google-compatible recognition endpoint, e.g. a stub_server URL")
+    parser.add_argument('--fake-latency', type=float, default=0.0,
+                        help="Seconds per request with --backend fake or stub")
+    parser.add_argument('--upload-dir', default='uploads')
+    parser.add_argument('--output-dir', default='output/jobs')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Local stand-in for the Google Web Speech API with injectable latency and errors
+
+Point GoogleBackend(endpoint=...) at it to exercise the recognition path
+without network access:
+
+    python -m stub_server --port 8765 --latency 0.2 --slow-rate 0.05 --throttle-rate 0.1 --error-rate 0.05
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RECOGNIZE_PATH = '/speech-api/v2/recognize'
+
+
+class StubRecognizerServer(ThreadingHTTPServer):
+    """HTTP server answering recognition requests in the Google speech-api v2 format"""
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, slow_latency=2.0, slow_rate=0.0,
+                 throttle_rate=0.0, error_rate=0.0, transcript="stub transcript", seed=None):
+        super().__init__(address, StubRecognizerHandler)
+        self.latency = latency
+        self.slow_latency = slow_latency
+        self.slow_rate = slow_rate  # Fraction of requests that take slow_latency instead
+        self.throttle_rate = throttle_rate  # Fraction answered with 429
+        self.error_rate = error_rate  # Fraction answered with 503
+        self.transcript = transcript
+        self.random = random.Random(seed)
+        self.stats = {'connections': 0, 'requests': 0, 'throttled': 0, 'errors': 0, 'slow': 0, 'bytes_received': 0}
+        self.lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}{RECOGNIZE_PATH}"
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+    def process_request(self, request, client_address):
+        self.count('connections')  # Accepted connections; keep-alive clients reuse them
+        super().process_request(request, client_address)
+
+    def start(self):
+        """Serve from a background thread and return self"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class StubRecognizerHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep connections alive between requests
+
+    def log_message(self, format, *args):
+        pass  # Keep test output quiet
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server.count('requests')
+        server.count('bytes_received', len(body))
+
+        with server.lock:
+            roll = server.random.random()
+            slow = server.random.random() < server.slow_rate
+        if slow:
+            server.count('slow')
+        time.sleep(server.slow_latency if slow else server.latency)
+
+        if not self.path.startswith(RECOGNIZE_PATH):
+            self.send_error(404)
+        elif roll < server.throttle_rate:
+            server.count('throttled')
+            self.send_error(429, "Too Many Requests")
+        elif roll < server.throttle_rate + server.error_rate:
+            server.count('errors')
+            self.send_error(503, "Service Unavailable")
+        else:
+            result = {
+                'result': [{'alternative': [{'transcript': server.transcript, 'confidence': 0.9}], 'final': True}],
+                'result_index': 0,
+            }
+            payload = ('{"result":[]}\n' + json.dumps(result) + '\n').encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds before every answer")
+    parser.add_argument('--slow-latency', type=float, default=2.0, help="Seconds before a slow answer")
+    parser.add_argument('--slow-rate', type=float, default=0.0, help="Fraction of slow answers")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Fraction of 429 answers")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of 503 answers")
+    parser.add_argument('--transcript', default="stub transcript")
+    args = parser.parse_args()
+
+    server = StubRecognizerServer(
+        (args.host, args.port), latency=args.latency, slow_latency=args.slow_latency, slow_rate=args.slow_rate,
+        throttle_rate=args.throttle_rate, error_rate=args.error_rate, transcript=args.transcript)
+    print(f"Stub recognizer listening on {server.endpoint}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.stats))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,311 @@
+import bisect
+import math
+
+import numpy as np
+
+ENVELOPE_BLOCK_MS = 10000  # Audio squared and summed (and window starts tested) at a time, bounds working memory
+CUT_WINDOW_MS = 100  # Window whose energy decides where speech longer than a chunk is cut
+MIN_FILL = 0.5  # Speech longer than a chunk is cut no earlier than this fraction of the chunk length
+GATE_FRAME_MS = 32  # Frame length of the speech gate's features
+GATE_BAND_HZ = (100, 4000)  # Band the spectral flatness is measured in, where voiced speech has its harmonics
+
+
+class EnergyEnvelope:
+    """Millisecond energy envelope of 16-bit PCM for vectorized silence detection
+
+    The running sum of squared samples is computed once, at every millisecond
+    boundary. Any window's RMS then costs two lookups, so every threshold and
+    minimum-silence setting is evaluated from the same envelope instead of
+    rescanning the audio. The envelope (8 bytes per millisecond) is the only
+    array as long as the audio; the samples are read and windows are tested
+    ENVELOPE_BLOCK_MS at a time, so a memory-mapped source is never copied whole. Window boundaries, the integer RMS and the range
+    merging follow pydub.silence with seek_step=1, so the results match
+    detect_nonsilent/split_on_silence on the same audio.
+    """
+
+    max_possible_amplitude = 32768  # pydub's value for 16-bit samples
+
+    def __init__(self, samples, frame_rate):
+        """samples: (frames, channels) int16 array or memmap view"""
+        self.frames, self.channels = samples.shape
+        self.frame_rate = frame_rate
+        self.length_ms = round(1000 * self.frames / frame_rate)  # len(AudioSegment)
+
+        # Exact running sum of squares at every millisecond boundary, built block by block
+        self.energy = np.zeros(self.length_ms + 1, dtype=np.int64)
+        total = 0
+        for start_ms in range(0, self.length_ms, ENVELOPE_BLOCK_MS):
+            end_ms = min(start_ms + ENVELOPE_BLOCK_MS, self.length_ms)
+            clipped = np.minimum(self._frame_at(np.arange(start_ms, end_ms + 1, dtype=np.int64)), self.frames)
+            first, last = clipped[0], clipped[-1]
+            block = samples[first:last].astype(np.int64)
+            running = np.concatenate(([0], np.cumsum((block * block).sum(axis=1))))
+            self.energy[start_ms + 1:end_ms + 1] = total + running[clipped[1:] - first]
+            total += int(running[-1])
+
+    def _frame_at(self, ms):
+        """Frame index of millisecond positions, truncated the way pydub slices
+
+        The last position can fall past the end; pydub pads that slice with silent frames.
+        """
+        return (ms.astype(np.float64) * (self.frame_rate / 1000.0)).astype(np.int64)
+
+    def _window_rms_exceeds(self, starts, length_ms, thresh):
+        """True where the integer RMS of [start, start + length_ms) is above thresh"""
+        ends = np.minimum(starts + length_ms, self.length_ms)
+        sums = self.energy[ends] - self.energy[starts]
+        counts = (self._frame_at(ends) - self._frame_at(starts)) * self.channels
+        # audioop.rms truncates to an integer, so rms <= thresh <=> mean < (floor(thresh) + 1) ** 2
+        limit = (math.floor(thresh) + 1) ** 2
+        return sums >= limit * np.maximum(counts, 1)
+
+    @property
+    def rms(self):
+        samples = self.frames * self.channels
+        return int(math.sqrt(self.energy[-1] / samples)) if samples else 0
+
+    @property
+    def dBFS(self):
+        rms = self.rms
+        if not rms:
+            return -float("infinity")
+        return 20 * math.log10(rms / self.max_possible_amplitude)
+
+    def detect_silence(self, min_silence_len=1000, silence_thresh=-16):
+        """Silent [start, end] ranges in milliseconds, like pydub.silence.detect_silence"""
+        if self.length_ms < min_silence_len:
+            return []
+
+        thresh = 10 ** (silence_thresh / 20) * self.max_possible_amplitude
+        count = self.length_ms - min_silence_len + 1  # Window starts
+        ranges = []  # [first, last] silent window start of every range
+        for first in range(0, count, ENVELOPE_BLOCK_MS):
+            starts = np.arange(first, min(first + ENVELOPE_BLOCK_MS, count), dtype=np.int64)
+            silence_starts = starts[~self._window_rms_exceeds(starts, min_silence_len, thresh)]
+            if not len(silence_starts):
+                continue
+
+            # Starts closer together than one silence length belong to the same range,
+            # also across blocks
+            breaks = np.flatnonzero(np.diff(silence_starts) > min_silence_len)
+            range_starts = silence_starts[np.concatenate(([0], breaks + 1))]
+            range_ends = silence_starts[np.concatenate((breaks, [len(silence_starts) - 1]))]
+            for start, end in zip(range_starts.tolist(), range_ends.tolist()):
+                if ranges and start - ranges[-1][1] <= min_silence_len:
+                    ranges[-1][1] = end
+                else:
+                    ranges.append([start, end])
+        return [[start, end + min_silence_len] for start, end in ranges]
+
+    def detect_nonsilent(self, min_silence_len=1000, silence_thresh=-16):
+        """Non-silent [start, end] ranges in milliseconds, like pydub.silence.detect_nonsilent"""
+        silent_ranges = self.detect_silence(min_silence_len, silence_thresh)
+
+        # if there is no silence, the whole thing is nonsilent
+        if not silent_ranges:
+            return [[0, self.length_ms]]
+
+        # short circuit when the whole audio is silent
+        if silent_ranges[0][0] == 0 and silent_ranges[0][1] == self.length_ms:
+            return []
+
+        prev_end = 0
+        nonsilent_ranges = []
+        for start, end in silent_ranges:
+            nonsilent_ranges.append([prev_end, start])
+            prev_end = end
+        if silent_ranges[-1][1] != self.length_ms:
+            nonsilent_ranges.append([prev_end, self.length_ms])
+        if nonsilent_ranges[0] == [0, 0]:
+            nonsilent_ranges.pop(0)
+        return nonsilent_ranges
+
+    def split_on_silence(self, min_silence_len=1000, silence_thresh=-16, keep_silence=100):
+        """(start, end) chunk boundaries in milliseconds, like pydub.silence.split_on_silence"""
+        return keep_silence_ranges(
+            self.detect_nonsilent(min_silence_len, silence_thresh), keep_silence, self.length_ms)
+
+    def quietest_point(self, start_ms, end_ms, window_ms=CUT_WINDOW_MS):
+        """Middle of the window_ms window with the least energy whose middle lies in [start_ms, end_ms]"""
+        first = max(0, start_ms - window_ms // 2)
+        last = min(self.length_ms - window_ms, end_ms - window_ms // 2)
+        if last < first:
+            return (start_ms + end_ms) // 2
+        starts = np.arange(first, last + 1, dtype=np.int64)
+        sums = self.energy[starts + window_ms] - self.energy[starts]
+        return int(starts[np.argmin(sums)]) + window_ms // 2
+
+    def pack(self, ranges, max_length_ms):
+        """Pack speech ranges into as few chunks of at most max_length_ms as possible, see pack_ranges"""
+        return pack_ranges(ranges, max_length_ms, self.quietest_point)
+
+
+def keep_silence_ranges(ranges, keep_silence, length_ms):
+    """Pad non-silent ranges like pydub's split_on_silence, splitting overlaps in the middle"""
+    output_ranges = [[start - keep_silence, end + keep_silence] for start, end in ranges]
+    for range_i, range_ii in zip(output_ranges, output_ranges[1:]):
+        if range_ii[0] < range_i[1]:
+            range_i[1] = (range_i[1] + range_ii[0]) // 2
+            range_ii[0] = range_i[1]
+    return [(max(start, 0), min(end, length_ms)) for start, end in output_ranges]
+
+
+def _split_long_ranges(ranges, max_length_ms, cut_at):
+    """Cut ranges longer than max_length_ms at cut_at(earliest, latest), the quietest point in between"""
+    pieces = []
+    for start, end in ranges:
+        while end - start > max_length_ms:
+            cut = cut_at(start + int(max_length_ms * MIN_FILL), start + max_length_ms)
+            cut = min(max(cut, start + 1), start + max_length_ms)
+            pieces.append((start, cut))
+            start = cut
+        pieces.append((start, end))
+    return pieces
+
+
+def pack_ranges(ranges, max_length_ms, cut_at=None):
+    """Group consecutive speech ranges into as few chunks of at most max_length_ms as possible
+
+    Chunks start at the start of a range and end at the end of one, so they
+    are only cut in the silence between ranges. Ranges longer than a chunk
+    are first cut at cut_at(earliest, latest) (the quietest point, see
+    EnergyEnvelope.quietest_point; the latest allowed point without one).
+    Among the packings with the fewest chunks, a dynamic program picks the
+    one that leaves the most silence out of the chunks. Returns (start, end)
+    tuples in milliseconds.
+    """
+    pieces = _split_long_ranges(ranges, max_length_ms, cut_at or (lambda earliest, latest: latest))
+    if not pieces:
+        return []
+    # Cumulative range length, so the silence inside a candidate chunk costs O(1)
+    speech = [0]
+    for start, end in pieces:
+        speech.append(speech[-1] + end - start)
+
+    # best[j]: (chunks, silence inside them) of the best packing of pieces[:j]; first[j]: its last chunk's first piece
+    best = [(0, 0)] + [None] * len(pieces)
+    first = [0] * (len(pieces) + 1)
+    for j in range(1, len(pieces) + 1):
+        end = pieces[j - 1][1]
+        i = j - 1
+        while i >= 0 and end - pieces[i][0] <= max_length_ms:
+            silence = (end - pieces[i][0]) - (speech[j] - speech[i])
+            candidate = (best[i][0] + 1, best[i][1] + silence)
+            if best[j] is None or candidate < best[j]:
+                best[j], first[j] = candidate, i
+            i -= 1
+
+    chunks = []
+    j = len(pieces)
+    while j:
+        i = first[j]
+        chunks.append((pieces[i][0], pieces[j - 1][1]))
+        j = i
+    return chunks[::-1]
+
+
+def chunk_stats(chunks, speech_ranges, length_ms):
+    """How well chunks fit the speech: count, chunks per hour, padding and cuts through speech
+
+    padding_ratio is the share of the chunked audio that is not speech,
+    speech_coverage the share of the speech that is inside some chunk, and
+    cuts_in_speech the number of chunk boundaries that fall inside speech.
+    """
+    chunks = sorted(chunks)
+    chunked_ms = sum(end - start for start, end in chunks)
+    speech_ms = sum(end - start for start, end in speech_ranges)
+    covered_ms = 0
+    i = 0
+    for start, end in chunks:
+        while i < len(speech_ranges) and speech_ranges[i][1] <= start:
+            i += 1
+        k = i
+        while k < len(speech_ranges) and speech_ranges[k][0] < end:
+            covered_ms += min(end, speech_ranges[k][1]) - max(start, speech_ranges[k][0])
+            k += 1
+    # A boundary shared by two chunks is one cut
+    speech_starts = [start for start, _ in speech_ranges]
+    cuts_in_speech = 0
+    for boundary in {boundary for chunk in chunks for boundary in chunk}:
+        k = bisect.bisect_left(speech_starts, boundary) - 1  # Last speech range starting before it
+        cuts_in_speech += k >= 0 and boundary < speech_ranges[k][1]
+    return {
+        'chunks': len(chunks),
+        'chunks_per_hour': len(chunks) * 3600000 / length_ms if length_ms else None,
+        'mean_chunk_s': chunked_ms / len(chunks) / 1000 if chunks else None,
+        'padding_ratio': 1 - covered_ms / chunked_ms if chunked_ms else None,
+        'speech_coverage': covered_ms / speech_ms if speech_ms else None,
+        'cuts_in_speech': cuts_in_speech,
+    }
+
+
+class SpeechGate:
+    """Decide from cheap frame features whether a prepared chunk contains any speech
+
+    The chunk (mono int16, as sent to the recognizer) is cut into 32 ms
+    frames. A frame is voiced when it is within active_db of the loudest
+    frame, its spectral flatness is below max_flatness (harmonics, not
+    noise) and its zero-crossing rate below max_zcr. A second of audio is
+    speech when it has at least 0.1 s of voiced frames and at least
+    min_low_energy_ratio of its frames are below half its mean energy:
+    speech pauses between syllables and words, sustained music does not.
+    A chunk is not worth a request when it has less than min_speech_s of
+    speech (silence, room tone, noise), or when less than
+    min_speech_ratio of its voiced time is speech (music beds). The
+    features are scale-invariant, so they work on normalized (denoised)
+    chunks; the defaults err towards recognizing.
+    """
+
+    def __init__(self, min_speech_s=1.0, min_speech_ratio=0.1, min_low_energy_ratio=0.3, max_flatness=0.3,
+                 max_zcr=0.25, active_db=-40):
+        self.min_speech_s = min_speech_s
+        self.min_speech_ratio = min_speech_ratio
+        self.min_low_energy_ratio = min_low_energy_ratio
+        self.max_flatness = max_flatness
+        self.max_zcr = max_zcr
+        self.active_db = active_db
+
+    def settings(self):
+        """The thresholds, e.g. for cache keys"""
+        return {'min_speech_s': self.min_speech_s, 'min_speech_ratio': self.min_speech_ratio,
+                'min_low_energy_ratio': self.min_low_energy_ratio,
+                'max_flatness': self.max_flatness, 'max_zcr': self.max_zcr, 'active_db': self.active_db}
+
+    def features(self, samples, frame_rate):
+        """speech_s and voiced_s, plus the median flatness and zero-crossing rate of the active frames"""
+        frame = max(2, frame_rate * GATE_FRAME_MS // 1000)
+        count = len(samples) // frame
+        if count == 0:
+            return {'speech_s': 0.0, 'voiced_s': 0.0, 'flatness': None, 'zcr': None}
+        frame_s = frame / frame_rate
+        frames = np.asarray(samples[:count * frame], dtype=np.float32).reshape(count, frame)
+        power = np.einsum('ij,ij->i', frames, frames) / frame
+        zcr = np.count_nonzero(np.diff(np.signbit(frames), axis=1), axis=1) / (frame - 1)
+
+        # Spectral flatness: geometric over arithmetic mean of the power spectrum in the band
+        spectrum = np.fft.rfft(frames * np.hanning(frame).astype(np.float32), axis=1)
+        low, high = (max(1, hz * frame // frame_rate) for hz in GATE_BAND_HZ)
+        band = spectrum[:, low:high + 1]
+        band = band.real ** 2 + band.imag ** 2 + 1e-10
+        flatness = np.exp(np.log(band).mean(axis=1)) / band.mean(axis=1)
+
+        active = power > power.max() * 10 ** (self.active_db / 10)
+        voiced = active & (flatness < self.max_flatness) & (zcr < self.max_zcr)
+
+        # Per one-second window: voiced time and the share of frames below half the window's mean energy
+        starts = np.arange(0, count, max(1, round(1 / frame_s)))
+        sizes = np.diff(np.append(starts, count))
+        window_mean = np.add.reduceat(power, starts) / sizes
+        low_energy = np.add.reduceat(power < 0.5 * np.repeat(window_mean, sizes), starts) / sizes
+        window_voiced_s = np.add.reduceat(voiced, starts) * frame_s
+        speech = (window_voiced_s >= 0.1) & (low_energy >= self.min_low_energy_ratio)
+        return {
+            'speech_s': float(sizes[speech].sum() * frame_s),
+            'voiced_s': float(np.count_nonzero(voiced) * frame_s),
+            'flatness': float(np.median(flatness[active])) if active.any() else None,
+            'zcr': float(np.median(zcr[active])) if active.any() else None,
+        }
+
+    def is_speech(self, features):
+        return (features['speech_s'] >= self.min_speech_s
+                and features['speech_s'] >= self.min_speech_ratio * features['voiced_s'])
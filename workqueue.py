@@ -0,0 +1,520 @@
+"""Durable chunk-level work queue in SQLite, shared by worker processes and machines
+
+    python -m workqueue add recordings/ --db queue.db --output-dir output/queue
+    python -m workqueue work --db queue.db --workers 4 --concurrency 4
+    python -m workqueue status --db queue.db
+
+`add` probes and splits every file into chunk tasks, keeping the PCM it
+decodes a compressed file to next to the database (in <db>.pcm/) so
+workers map it instead of decoding the file again. `work` starts worker
+processes that claim chunks under a lease, renewed by a heartbeat while the
+chunk is recognized; a chunk whose lease expires (its worker died) is
+claimed again, and one whose leases keep expiring is given up after
+--max-attempts. Once the last chunk of a file is done, a worker writes its
+TXT and SRT. Workers on several machines can share the database on a
+common filesystem; pass --journal delete there, since SQLite's WAL mode
+needs shared memory between the processes.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    text_path TEXT NOT NULL,
+    srt_path TEXT NOT NULL,
+    mode TEXT NOT NULL,                     -- 'short': one chunk, as Transcribe handles it; 'long'
+    duration_s REAL NOT NULL,
+    chunks INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',  -- queued, finalizing, done
+    worker TEXT,
+    lease_expires REAL,                     -- Of the finalizer, while finalizing
+    added REAL NOT NULL,
+    finished REAL,
+    pcm_path TEXT,                          -- The source decoded by add, deleted once done; NULL if not decoded
+    frame_rate INTEGER,
+    channels INTEGER
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    file_id INTEGER NOT NULL REFERENCES files (id),
+    idx INTEGER NOT NULL,
+    start_ms INTEGER NOT NULL,
+    end_ms INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',  -- queued, leased, done, failed
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    text TEXT,
+    error TEXT,
+    PRIMARY KEY (file_id, idx)
+);
+CREATE INDEX IF NOT EXISTS tasks_by_status ON tasks (status, file_id, idx);
+"""
+STORES_OPEN = 2  # Decoded sources a worker keeps open; chunks are claimed roughly in file order
+ADDED_COLUMNS = (('pcm_path', 'TEXT'), ('frame_rate', 'INTEGER'), ('channels', 'INTEGER'))  # Since the first schema
+
+
+def _failed_text(index):
+    """The text a chunk gets when it cannot be recognized, as in Transcribe"""
+    return f"[Unable to transcribe chunk {index}]"
+
+
+class WorkQueue:
+    """Chunk tasks and their files in an SQLite database
+
+    Every state change is one IMMEDIATE transaction, so concurrent workers
+    never claim the same chunk twice. Connections are per thread.
+    """
+
+    def __init__(self, path="workqueue.db", journal='wal', timeout=60.0):
+        self.path = path
+        self.journal = journal
+        self.timeout = timeout  # Seconds to wait for another process' write lock
+        self._local = threading.local()
+        self._connection().executescript(SCHEMA)
+        self._migrate()
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            # Autocommit; transactions are opened explicitly with BEGIN IMMEDIATE
+            db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute(f"PRAGMA journal_mode={self.journal}")
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            if db.in_transaction:  # SQLite may already have rolled back, e.g. after an I/O error
+                db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def _migrate(self):
+        """Add the columns a database created by an older version lacks"""
+        with self._transaction() as db:
+            columns = {row['name'] for row in db.execute("PRAGMA table_info(files)")}
+            for column, kind in ADDED_COLUMNS:
+                if column not in columns:
+                    db.execute(f"ALTER TABLE files ADD COLUMN {column} {kind}")
+
+    def add_file(self, audio_path, text_path, srt_path, mode, duration_s, chunks, pcm=None):
+        """Queue a file's chunks ({'start': ms, 'end': ms}); returns the file id
+
+        pcm is (path, frame_rate, channels) of the source already decoded (PCMStore.keep_file).
+        """
+        pcm_path, frame_rate, channels = pcm or (None, None, None)
+        with self._transaction() as db:
+            file_id = db.execute(
+                "INSERT INTO files (path, text_path, srt_path, mode, duration_s, chunks, added, "
+                "pcm_path, frame_rate, channels) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (audio_path, text_path, srt_path, mode, duration_s, len(chunks), time.time(),
+                 pcm_path, frame_rate, channels)).lastrowid
+            db.executemany(
+                "INSERT INTO tasks (file_id, idx, start_ms, end_ms) VALUES (?, ?, ?, ?)",
+                [(file_id, i, chunk['start'], chunk['end']) for i, chunk in enumerate(chunks)])
+        return file_id
+
+    def is_queued(self, audio_path):
+        """True if the file is already in the queue and not finished"""
+        row = self._connection().execute(
+            "SELECT 1 FROM files WHERE path = ? AND status != 'done'", (audio_path,)).fetchone()
+        return row is not None
+
+    def claim(self, worker, lease_s, max_attempts=3):
+        """Lease the next queued (or abandoned) chunk to a worker; returns the task as a dict, or None"""
+        now = time.time()
+        with self._transaction() as db:
+            # Chunks whose leases keep expiring (e.g. they crash their workers) are given up
+            for row in db.execute(
+                    "SELECT file_id, idx FROM tasks WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                    (now, max_attempts)).fetchall():
+                db.execute("UPDATE tasks SET status = 'failed', text = ?, error = 'lease expired too often' "
+                           "WHERE file_id = ? AND idx = ?", (_failed_text(row['idx']), row['file_id'], row['idx']))
+            task = db.execute(
+                "UPDATE tasks SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE rowid = (SELECT rowid FROM tasks WHERE status = 'queued' "
+                "               OR (status = 'leased' AND lease_expires < ?) ORDER BY file_id, idx LIMIT 1) "
+                "RETURNING file_id, idx, start_ms, end_ms, attempts",
+                (worker, now + lease_s, now)).fetchone()
+            if task is None:
+                return None
+            source = db.execute("SELECT path, mode, pcm_path, frame_rate, channels FROM files WHERE id = ?",
+                                (task['file_id'],)).fetchone()
+        return dict(task, **source)
+
+    def heartbeat(self, worker, keys, lease_s):
+        """Renew the leases a worker holds on (file_id, idx) keys; returns how many it still held"""
+        if not keys:
+            return 0
+        expires = time.time() + lease_s
+        with self._transaction() as db:
+            return sum(
+                db.execute("UPDATE tasks SET lease_expires = ? WHERE file_id = ? AND idx = ? "
+                           "AND status = 'leased' AND worker = ?", (expires, file_id, idx, worker)).rowcount
+                for file_id, idx in keys)
+
+    def complete(self, worker, file_id, idx, text, error=None):
+        """Store a chunk's result; False if the worker lost the lease to another worker meanwhile"""
+        with self._transaction() as db:
+            return db.execute(
+                "UPDATE tasks SET status = ?, text = ?, error = ?, lease_expires = NULL "
+                "WHERE file_id = ? AND idx = ? AND status = 'leased' AND worker = ?",
+                ('failed' if error else 'done', text, error, file_id, idx, worker)).rowcount == 1
+
+    def release(self, worker, keys):
+        """Put chunks a stopping worker still holds back in the queue"""
+        with self._transaction() as db:
+            for file_id, idx in keys:
+                db.execute("UPDATE tasks SET status = 'queued', worker = NULL, lease_expires = NULL "
+                           "WHERE file_id = ? AND idx = ? AND status = 'leased' AND worker = ?",
+                           (file_id, idx, worker))
+
+    def claim_finalization(self, worker, lease_s):
+        """Lease a file whose chunks are all finished, to write its outputs; returns the file as a dict, or None"""
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute(
+                "UPDATE files SET status = 'finalizing', worker = ?, lease_expires = ? "
+                "WHERE id = (SELECT id FROM files WHERE "
+                "            (status = 'queued' AND NOT EXISTS (SELECT 1 FROM tasks WHERE tasks.file_id = files.id "
+                "                                               AND tasks.status IN ('queued', 'leased'))) "
+                "            OR (status = 'finalizing' AND lease_expires < ?) ORDER BY id LIMIT 1) "
+                "RETURNING *", (worker, now + lease_s, now)).fetchone()
+            return dict(row) if row else None
+
+    def segments(self, file_id):
+        """A finished file's segments in order, as Transcribe.subtitles holds them (none for chunks without speech)"""
+        return [
+            {'start': row['start_ms'], 'end': row['end_ms'], 'text': row['text']}
+            for row in self._connection().execute(
+                "SELECT start_ms, end_ms, text FROM tasks WHERE file_id = ? AND text != '' ORDER BY idx", (file_id,))
+        ]
+
+    def finish_file(self, worker, file_id):
+        with self._transaction() as db:
+            db.execute("UPDATE files SET status = 'done', finished = ?, lease_expires = NULL "
+                       "WHERE id = ? AND status = 'finalizing' AND worker = ?", (time.time(), file_id, worker))
+
+    def drained(self):
+        """True when there is nothing left to claim, recognize or finalize"""
+        db = self._connection()
+        return (db.execute("SELECT 1 FROM tasks WHERE status IN ('queued', 'leased') LIMIT 1").fetchone() is None
+                and db.execute("SELECT 1 FROM files WHERE status != 'done' LIMIT 1").fetchone() is None)
+
+    def status(self):
+        """Per-file progress: path, status and chunk counts by state"""
+        rows = self._connection().execute(
+            "SELECT files.id, files.path, files.status, files.chunks, files.duration_s, "
+            "SUM(tasks.status = 'done') AS done, SUM(tasks.status = 'failed') AS failed, "
+            "SUM(tasks.status = 'leased') AS leased, SUM(tasks.attempts > 1) AS retried "
+            "FROM files LEFT JOIN tasks ON tasks.file_id = files.id GROUP BY files.id ORDER BY files.id")
+        return [dict(row) for row in rows]
+
+
+def split_file(audio_path, scratch_dir):
+    """(mode, duration in seconds, chunk boundaries, pcm) the way Transcribe would chunk the file
+
+    pcm is (path, frame_rate, channels) of the source decoded into scratch_dir,
+    left there for the workers; None when nothing was decoded (short files,
+    WAV mapped in place).
+    """
+    from audio_store import probe_audio
+    from main import Transcribe
+
+    info = probe_audio(audio_path)
+    if info['duration'] <= 60:
+        return 'short', info['duration'], [{'start': 0, 'end': round(info['duration'] * 1000)}], None
+    transcriber = Transcribe(audio_path, cache=False, scratch_dir=scratch_dir)
+    transcriber.audio_info = info
+    try:
+        chunks = transcriber.split_audio_file(transcriber.chunk_length_ms)
+        return 'long', info['duration'], chunks, transcriber.store.keep_file()
+    finally:
+        transcriber.cleanup()
+
+
+def add_files(queue, files, output_dir="output", progress=print):
+    """Split files into chunk tasks; returns the ids of the files queued"""
+    from batch import _output_names
+
+    os.makedirs(output_dir, exist_ok=True)
+    pcm_dir = os.path.abspath(queue.path) + '.pcm'  # Next to the database, so remote workers can reach it too
+    files = [os.path.abspath(path) for path in files]
+    stems = _output_names(files)
+    file_ids = []
+    for path in files:
+        if queue.is_queued(path):
+            progress(f"{path}: already queued")
+            continue
+        mode, duration, chunks, pcm = split_file(path, pcm_dir)
+        stem = stems[path]
+        try:
+            file_ids.append(queue.add_file(
+                path,
+                os.path.abspath(os.path.join(output_dir, f"{stem}_transcript.txt")),
+                os.path.abspath(os.path.join(output_dir, f"{stem}_subtitles.srt")),
+                mode, duration, chunks, pcm))
+        except BaseException:
+            _remove_pcm(pcm and pcm[0])
+            raise
+        progress(f"{path}: {len(chunks)} chunks queued")
+    return file_ids
+
+
+def _remove_pcm(pcm_path):
+    """Delete a source decoded by add, once its file is done"""
+    if pcm_path and os.path.isfile(pcm_path):
+        os.remove(pcm_path)
+
+
+def _make_backend(options):
+    from recognition import AdaptiveScheduler, FakeBackend, GoogleBackend
+
+    if options['backend'] == 'fake':
+        backend = FakeBackend(latency=options['fake_latency'])
+    else:
+        backend = GoogleBackend(language=options['language'], endpoint=options['endpoint'],
+                                pool_size=options['concurrency'])
+    return AdaptiveScheduler(backend, max_concurrency=options['concurrency'])
+
+
+def finalize(queue, worker, lease_s):
+    """Write the TXT and SRT of every file whose chunks are all finished; returns how many"""
+    from main import Transcribe
+    from recognition import FakeBackend
+
+    finalized = 0
+    while True:
+        file = queue.claim_finalization(worker, lease_s)
+        if file is None:
+            return finalized
+        for path in (file['text_path'], file['srt_path']):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # The same writers as a single-process run; the backend is never called
+        transcriber = Transcribe(file['path'], file['text_path'], file['srt_path'], backend=FakeBackend(),
+                                 cache=False)
+        transcriber.subtitles = queue.segments(file['id'])
+        transcriber.save_transcript_to_txt()
+        transcriber.generate_srt()
+        queue.finish_file(worker, file['id'])
+        _remove_pcm(file['pcm_path'])
+        finalized += 1
+
+
+def run_worker(db_path, options, worker=None):
+    """Claim, recognize and finalize chunks until the queue is drained (forever with options['follow'])
+
+    Returns a summary of the chunks this worker handled.
+    """
+    from audio_store import PCMStore
+    from preprocess import RECOGNITION_RATE, make_audio_data, prepare_samples
+    from vad import SpeechGate
+
+    queue = WorkQueue(db_path, options['journal'])
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    lease_s = options['lease_s']
+    concurrency = max(1, options['concurrency'])
+    backend = _make_backend(options)
+    gate = SpeechGate() if options.get('speech_gate', True) else None
+    scratch = tempfile.mkdtemp(prefix='workqueue-')
+    held = {}  # (file_id, idx) -> task, chunks whose leases the heartbeat renews
+    stores = OrderedDict()  # Source path -> PCMStore, least recently used first
+    summary = {'worker': worker, 'chunks': 0, 'failed': 0, 'skipped': 0, 'lost': 0, 'audio_s': 0.0,
+               'files_finalized': 0}
+    stopping = threading.Event()
+    start = time.perf_counter()
+
+    def heartbeat():
+        while not stopping.wait(lease_s / 3):
+            try:
+                queue.heartbeat(worker, list(held), lease_s)
+            except sqlite3.Error as e:
+                print(f"Heartbeat failed: {str(e)}")
+
+    def open_store(task):
+        path = task['path']
+        if path not in stores:
+            if task['pcm_path'] and os.path.isfile(task['pcm_path']):  # Decoded by add: map it
+                stores[path] = PCMStore(path, pcm=(task['pcm_path'], task['frame_rate'], task['channels']))
+            else:
+                stores[path] = PCMStore(path, scratch_dir=scratch)
+            while len(stores) > STORES_OPEN:
+                stores.popitem(last=False)[1].close()
+        stores.move_to_end(path)
+        return stores[path]
+
+    def prepare(task):
+        """The chunk's payload, on this thread (stores are not shared with the recognition threads)
+
+        None for a chunk of a long file the speech gate finds no speech in, as Transcribe skips them.
+        """
+        store = open_store(task)
+        view = store.view(task['start_ms'], task['end_ms'])
+        samples, frame_rate = prepare_samples(view, store.frame_rate, RECOGNITION_RATE,
+                                              denoise=task['mode'] == 'long')
+        if gate and task['mode'] == 'long' and not gate.is_speech(gate.features(samples, frame_rate)):
+            return None
+        return make_audio_data(samples, frame_rate)
+
+    def recognize(task, audio_data):
+        try:
+            if audio_data is None:
+                return '', None
+            if isinstance(audio_data, Exception):
+                raise audio_data
+            return backend.recognize(audio_data), None
+        except Exception as e:
+            print(f"[Error in chunk {task['idx']} of {task['path']}: {str(e)}]")
+            return _failed_text(task['idx']), str(e)
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending = {}  # future -> task
+            while True:
+                while len(pending) < concurrency:
+                    task = queue.claim(worker, lease_s, options['max_attempts'])
+                    if task is None:
+                        break
+                    held[(task['file_id'], task['idx'])] = task
+                    try:
+                        audio_data = prepare(task)
+                    except Exception as e:
+                        audio_data = e
+                    pending[executor.submit(recognize, task, audio_data)] = task
+                if not pending:
+                    summary['files_finalized'] += finalize(queue, worker, lease_s)
+                    if not options['follow'] and queue.drained():
+                        break
+                    time.sleep(options['poll_s'])  # Chunks leased by other workers may still come back
+                    continue
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = pending.pop(future)
+                    held.pop((task['file_id'], task['idx']), None)
+                    text, error = future.result()
+                    if queue.complete(worker, task['file_id'], task['idx'], text, error):
+                        summary['chunks'] += 1
+                        summary['failed'] += 1 if error else 0
+                        summary['skipped'] += 1 if text == '' else 0
+                        summary['audio_s'] += (task['end_ms'] - task['start_ms']) / 1000
+                    else:
+                        summary['lost'] += 1  # The lease expired and another worker took the chunk
+                summary['files_finalized'] += finalize(queue, worker, lease_s)
+    finally:
+        stopping.set()
+        queue.release(worker, list(held))
+        for store in stores.values():
+            store.close()
+        shutil.rmtree(scratch, ignore_errors=True)
+    summary['wall_s'] = time.perf_counter() - start
+    return summary
+
+
+def run_workers(db_path, workers, options, progress=print):
+    """Run workers local worker processes until the queue is drained; returns their summaries"""
+    if workers <= 1:
+        summaries = [run_worker(db_path, options)]
+    else:
+        # Spawned, so no worker inherits an open SQLite connection of this process
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = [pool.submit(run_worker, db_path, options) for _ in range(workers)]
+            summaries = [future.result() for future in futures]
+    for summary in summaries:
+        progress(f"{summary['worker']}: {summary['chunks']} chunks ({summary['failed']} failed, "
+                 f"{summary['skipped']} without speech, {summary['lost']} lost), {summary['audio_s']:.1f} s of audio in {summary['wall_s']:.1f} s, "
+                 f"{summary['files_finalized']} files finalized")
+    return summaries
+
+
+def format_status(rows):
+    """Plain-text table of WorkQueue.status()"""
+    lines = [f"{'file':<40} {'status':>10} {'chunks':>7} {'done':>6} {'failed':>7} {'leased':>7} {'retried':>8}"]
+    for row in rows:
+        lines.append(f"{os.path.basename(row['path'])[:40]:<40} {row['status']:>10} {row['chunks']:>7} "
+                     f"{row['done'] or 0:>6} {row['failed'] or 0:>7} {row['leased'] or 0:>7} {row['retried'] or 0:>8}")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    from batch import find_audio_files
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default='workqueue.db', help="Queue database, shared by every worker")
+    parser.add_argument('--journal', choices=('wal', 'delete'), default='wal',
+                        help="SQLite journal mode; use delete on network filesystems")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help="Split files into chunk tasks")
+    add.add_argument('inputs', nargs='+', help="Directories or glob patterns (quote globs with **)")
+    add.add_argument('--output-dir', default='output', help="Where transcripts and subtitles are written")
+
+    work = commands.add_parser('work', help="Recognize chunks until the queue is drained")
+    work.add_argument('--workers', type=int, default=max(1, min(4, os.cpu_count() or 1)), help="Worker processes")
+    work.add_argument('--concurrency', type=int, default=4, help="Recognition requests in flight per worker")
+    work.add_argument('--lease', type=float, default=60.0, help="Seconds a claimed chunk stays leased without a heartbeat")
+    work.add_argument('--max-attempts', type=int, default=3, help="Expired leases before a chunk is given up")
+    work.add_argument('--follow', action='store_true', help="Keep waiting for new work instead of exiting")
+    work.add_argument('--poll', type=float, default=1.0, help="Seconds between polls of an empty queue")
+    work.add_argument('--language', default='fa-IR')
+    work.add_argument('--backend', choices=('google', 'fake'), default='google')
+    work.add_argument('--endpoint', help="Google-compatible recognition endpoint, e.g. a stub_server URL")
+    work.add_argument('--fake-latency', type=float, default=0.0, help="Seconds per request with --backend fake")
+    work.add_argument('--no-speech-gate', action='store_true', help="Recognize chunks without speech too")
+
+    commands.add_parser('status', help="Show the progress of every file")
+    args = parser.parse_args(argv)
+
+    queue = WorkQueue(args.db, args.journal)
+    if args.command == 'add':
+        files = find_audio_files(args.inputs)
+        if not files:
+            print("No audio files found")
+            return 1
+        add_files(queue, files, args.output_dir)
+    elif args.command == 'work':
+        options = {
+            'journal': args.journal,
+            'concurrency': args.concurrency,
+            'lease_s': args.lease,
+            'max_attempts': args.max_attempts,
+            'follow': args.follow,
+            'poll_s': args.poll,
+            'backend': args.backend,
+            'language': args.language,
+            'endpoint': args.endpoint,
+            'fake_latency': args.fake_latency,
+            'speech_gate': not args.no_speech_gate,
+        }
+        summaries = run_workers(args.db, args.workers, options)
+        print(json.dumps({'chunks': sum(s['chunks'] for s in summaries),
+                          'failed': sum(s['failed'] for s in summaries),
+                          'skipped': sum(s['skipped'] for s in summaries)}))
+    else:
+        print(format_status(queue.status()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())